@@ -67,6 +67,32 @@ def register_indexes(indexes):
         gazetteer_tables_indexes[i.full_table_name].add(i)
 
 
+def apply_load_profiles(profiles):
+    '''Replace the registered tables named by a sequence of
+    gazetteer.projection.LoadProfile objects with copies that only have the
+    fields selected, and drop the registered indexes and foreign keys that
+    refer to the fields left out. Raise ValueError if a profile does not fit
+    its table.'''
+
+    for profile in profiles:
+        name = profile.full_table_name
+        if name not in gazetteer_tables:
+            raise ValueError('{} is not a recognised table name'.format(name))
+
+        table = gazetteer_tables[name]
+        projected = {}
+        for n, i in enumerate(gazetteer_files):
+            if i.full_table_name == name:
+                projected[id(i)] = gazetteer_files[n] = profile.apply(i)
+        gazetteer_tables[name] = projected[id(table)]
+
+        for indexes in list(gazetteer_schema_indexes.values()) + \
+                list(gazetteer_tables_indexes.values()):
+            for i in [j for j in indexes
+                      if profile.uses_dropped_fields(table, j)]:
+                indexes.discard(i)
+
+
 def find_table(file_name, schema=None):
     '''Given a file name, return the GazetteerTable or GazetteerTableCSV that
     it is likely to relate to, or None if it does not appear to be related to
@@ -83,6 +109,7 @@ def find_table(file_name, schema=None):
 
     return None
 
+
 # Actually register the tables and indexes defined in each module
 
 register_tables(ukapc.tables)
@@ -0,0 +1,248 @@
+# gazetteer.bench
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Generation of synthetic gazetteer data files from the table definitions,
+and a harness that times gazetteer_extract.py uploading them.'''
+
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from .fields import BigIntField, IntegerField, SmallIntField, DoubleField
+from .fields import FixedTextField, DateField, TimeStampField, FlagField
+from .fields import TextField
+from .tables import GazetteerTableCSV, GazetteerTableInserted
+
+# Place names with characters that can be represented in both ISO-8859-1 and
+# UTF-8, so they can be used whatever the encoding of the file
+
+names = ('Aberdeen', 'Bâton Rouge', 'Cañon City', 'Dûn Èideann', 'Esbjerg',
+         'Fårö', 'Göttingen', 'Hafnarfjörður', 'Île-de-France', 'Jönköping',
+         'Kraków', 'Lyon', 'Málaga', 'Nîmes', 'Ørsted', 'Porto', 'Québec',
+         'Reykjavík', 'São Tomé', 'Tromsø', 'Uppsala', 'Vänersborg',
+         'Würzburg', 'Zürich')
+
+ascii_names = ('Aberdeen', 'Boston', 'Canon City', 'Dundee', 'Esbjerg',
+               'Faro', 'Gdansk', 'Hamburg', 'Inverness', 'Juneau', 'Kirkwall',
+               'Lyon', 'Malaga', 'Nimes', 'Oslo', 'Porto', 'Quebec',
+               'Reno', 'Salem', 'Tromso', 'Uppsala', 'Ventnor', 'Wells',
+               'Zurich')
+
+# Values that have caused problems in real files. Those for tables read with
+# PostgreSQL's CSV mode are quoted when the file is written.
+
+awkward_text_values = ('ends in a backslash\\', 'NUL\x00byte', 'tab\tin it',
+                       '\\N', '   ')
+
+awkward_csv_values = ('comma, in it', '"quoted" words', 'line\nbreak',
+                      'back\\slash', '', ' padded ')
+
+date_formats = {'ISO': '%Y-%m-%d', 'MDY': '%m/%d/%Y', 'DMY': '%d/%m/%Y'}
+
+example_substitutions = ((r'([0-9]{8})', '20160101'), (r'[A-Z]{2}', 'AL'),
+                         (r'[a-z]{2}', 'zz'), (r'\.', '.'))
+
+
+def example_filename(table):
+    '''Return a file name that the table will recognise, or None if one
+    cannot be constructed from its regular expression'''
+
+    filename = table.filename_regexp.pattern
+    for pattern, replacement in example_substitutions:
+        filename = filename.replace(pattern, replacement)
+
+    return filename if table.match_name(filename) else None
+
+
+def _key(number, width=None):
+    '''Return a text key for a row number, wrapping around if it must fit in
+    a fixed width'''
+
+    digits = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    result = ''
+    while True:
+        number, remainder = divmod(number, 36)
+        result = digits[remainder] + result
+        if number == 0:
+            break
+
+    if width is not None:
+        result = result[-width:].rjust(width, '0')
+    return result
+
+
+def generate_value(field, rng, row, datestyle='ISO', key=False,
+                   non_ascii=True):
+    '''Return a random value as a string that is suitable for field, or None
+    for a NULL. If key is set, the value is derived from the row number so
+    that it is unique within the file.'''
+
+    if field.nullable and not key and rng.random() < 0.1:
+        return None
+
+    if isinstance(field, (BigIntField, IntegerField)):
+        return str(row) if key else str(rng.randrange(100000))
+
+    if isinstance(field, SmallIntField):
+        return str(row % 32768 if key else rng.randrange(100))
+
+    if isinstance(field, DoubleField):
+        return '{:.5f}'.format(rng.uniform(-90.0, 90.0))
+
+    if isinstance(field, (DateField, TimeStampField)):
+        value = datetime.datetime(2000, 1, 1) + \
+            datetime.timedelta(seconds=rng.randrange(500000000))
+        result = value.strftime(date_formats.get(datestyle, '%Y-%m-%d'))
+        if isinstance(field, TimeStampField):
+            result += value.strftime(' %H:%M:%S')
+        return result
+
+    if isinstance(field, FlagField):
+        return _key(row)[-1] if key else rng.choice('ABCDNY')
+
+    if isinstance(field, FixedTextField):
+        if key:
+            return _key(row, field.width)
+        return _key(rng.randrange(36 ** field.width), field.width)
+
+    if key:
+        return 'K' + _key(row)
+
+    return rng.choice(names if non_ascii else ascii_names)
+
+
+def _csv_quote(value, table):
+    '''Return a value quoted for a CSV file read with the table's quote and
+    escape characters'''
+
+    if value.strip() == value and value != '' and \
+            not any(i in value for i in (table.sep, table.quote,
+                                         table.escape, '\n', '\r')):
+        return value
+
+    if table.escape != table.quote:
+        value = value.replace(table.escape, table.escape * 2)
+    return table.quote + value.replace(table.quote,
+                                       table.escape + table.quote) + \
+        table.quote
+
+
+def generate_rows(table, rows, seed=0, awkward=True):
+    '''Yield the header and then rows lines of text for a data file of the
+    given table. If awkward is set, some text values are replaced with the
+    kind of values that have caused problems in real files, where the table
+    is able to handle them.'''
+
+    rng = random.Random(seed)
+    pk_columns = [i.strip().lower() for i in table.pk.split(',')]
+    non_ascii = table.encoding is not None
+    csv = isinstance(table, GazetteerTableCSV)
+    header_fields = len(table.fields) - getattr(table, 'dummy_columns', 0)
+
+    if isinstance(table, GazetteerTableInserted):
+        awkward_values = awkward_text_values
+    elif csv:
+        awkward_values = awkward_csv_values
+    else:
+        awkward_values = ()
+
+    yield table.sep.join(i.field_name for i in
+                         table.fields[:header_fields]) + '\n'
+
+    for row in range(rows):
+        values = []
+        for number, field in enumerate(table.fields):
+            if number >= header_fields:
+                value = None
+            else:
+                value = generate_value(field, rng, row, table.datestyle,
+                                       field.sql_name in pk_columns,
+                                       non_ascii)
+
+            # Blank values would be uploaded as NULL by some tables
+
+            if awkward and awkward_values and \
+                    isinstance(field, TextField) and value is not None and \
+                    field.sql_name not in pk_columns and rng.random() < 0.05:
+                value = rng.choice(awkward_values)
+                if not field.nullable and value.strip() == '':
+                    value = rng.choice(names if non_ascii else ascii_names)
+
+            if value is None:
+                value = (table.null or '') if csv else ''
+            elif csv:
+                value = _csv_quote(value, table)
+            values.append(value)
+
+        yield table.sep.join(values) + '\n'
+
+
+def write_file(table, path, rows, seed=0, awkward=True):
+    '''Write a data file for the table with the given number of rows to path,
+    in the table's encoding'''
+
+    with open(path, 'w', encoding=table.encoding or 'ASCII',
+              newline='') as fp:
+        fp.writelines(generate_rows(table, rows, seed, awkward))
+
+
+def run_extract(path, report_dir, extract_args=(), script=None):
+    '''Run gazetteer_extract.py on the file at path with the extra arguments
+    given, writing its metrics report to report_dir. Unless the arguments
+    include database connection details this should include --dry-run.
+    Return the wall-clock time taken and the report.'''
+
+    if script is None:
+        script = os.path.join(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))), 'gazetteer_extract.py')
+
+    report_path = os.path.join(report_dir, '{}.{}.json'.format(
+        os.path.basename(path), time.time_ns()))
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, script, '--metrics-file', report_path] +
+                   list(extract_args) + [path, ],
+                   check=True, stdout=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+
+    with open(report_path) as fp:
+        report = json.load(fp)
+
+    return elapsed, report
+
+
+def summarise(table, rows, path, elapsed, report):
+    '''Return a dict summarising one benchmark run'''
+
+    copy_seconds = report['phases'].get('copy', 0.0)
+    return {'table': table.full_table_name,
+            'file': os.path.basename(path),
+            'rows': rows,
+            'bytes': os.path.getsize(path),
+            'wall_seconds': elapsed,
+            'header_seconds': report['phases'].get('header', 0.0),
+            'copy_seconds': copy_seconds,
+            'read_seconds': sum(i['read_seconds'] for i in report['items']),
+            'rows_per_second': rows / copy_seconds if copy_seconds else None,
+            'phases': report['phases']}
@@ -0,0 +1,186 @@
+# gazetteer.clustering
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Sorting of gazetteer data files into a spatially clustered order before
+they are uploaded, so that the rows for places near each other are stored
+together in the table. Rows are ordered by the position of their coordinates
+along a Hilbert curve. Files too large to sort in memory are sorted in runs
+that are written to temporary files and then merged.'''
+
+import csv
+import heapq
+import io
+import operator
+import struct
+import tempfile
+
+from .streams import RecordStream
+from .tables import GazetteerTableCSV
+
+hilbert_order = 16
+
+# Records without usable coordinates are given a key beyond the end of the
+# curve, so they are placed after all of the others
+
+no_coordinates_key = 1 << (2 * hilbert_order)
+
+# The approximate memory used by Python to hold each record and its key, in
+# addition to the record itself
+
+record_overhead = 120
+
+run_header = struct.Struct('>QI')
+
+
+def hilbert_key(lat, long, order=hilbert_order):
+    '''Return the distance along a Hilbert curve of the cell containing a
+    point, where the curve passes through a grid of 2**order by 2**order
+    cells covering the world. Points near each other usually have keys
+    near each other.'''
+
+    side = 1 << order
+    x = min(max(int((long + 180.0) / 360.0 * side), 0), side - 1)
+    y = min(max(int((lat + 90.0) / 180.0 * side), 0), side - 1)
+
+    result = 0
+    s = side >> 1
+    while s:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        result += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x = side - 1 - x
+                y = side - 1 - y
+            x, y = y, x
+        s >>= 1
+
+    return result
+
+
+def record_key_function(table):
+    '''Return a function that gives the Hilbert curve key of a record of the
+    table, as bytes, from its coordinate fields'''
+
+    names = [i.sql_name for i in table.fields]
+    lat_index = names.index(table.coordinates[0])
+    long_index = names.index(table.coordinates[1])
+
+    # The coordinates themselves are ASCII, so the records can be split
+    # without knowing how the other fields are encoded
+
+    if isinstance(table, GazetteerTableCSV):
+        def split(record):
+            return next(csv.reader(
+                [record.decode('ISO-8859-1')], delimiter=table.sep,
+                quotechar=table.quote,
+                escapechar=table.escape
+                if table.escape != table.quote else None,
+                doublequote=table.escape == table.quote))
+    else:
+        split = table.split_record
+
+    def key(record):
+        try:
+            fields = split(record)
+            return hilbert_key(float(fields[lat_index]),
+                               float(fields[long_index]))
+        except (IndexError, ValueError, OverflowError, StopIteration):
+            return no_coordinates_key
+
+    return key
+
+
+def _write_run(run):
+    '''Sort a list of (key, record) pairs and write them to a temporary file,
+    which is returned ready to be read back'''
+
+    run.sort(key=operator.itemgetter(0))
+
+    run_file = tempfile.TemporaryFile()
+    for key, record in run:
+        run_file.write(run_header.pack(key, len(record)))
+        run_file.write(record)
+    run_file.seek(0)
+    return run_file
+
+
+def _read_run(run_file):
+    '''Yield the (key, record) pairs written to a temporary file by
+    _write_run, closing it at the end'''
+
+    with run_file:
+        while True:
+            header = run_file.read(run_header.size)
+            if not header:
+                return
+            key, length = run_header.unpack(header)
+            yield key, run_file.read(length)
+
+
+def cluster_records(table, fileobj, memory_mb=256, header=False):
+    '''Return a binary file object that gives the records of the table from
+    the binary file object fileobj sorted by the Hilbert curve key of their
+    coordinates. Records with the same key stay in their original order. If
+    header is set, the first line is a header and is returned first. All of
+    fileobj is read before this returns. The records are sorted in memory
+    unless they need more than about memory_mb MB, in which case sorted runs
+    are written to temporary files and merged as the result is read.'''
+
+    key = record_key_function(table)
+    limit = memory_mb * 1024 * 1024
+    header_line = fileobj.readline() if header else b''
+
+    runs = []
+    run = []
+    run_size = 0
+
+    for record in table.iter_records(fileobj):
+
+        # The last record may not end with a line break, but it might not be
+        # last once sorted
+
+        if not record.endswith(b'\n'):
+            record += b'\n'
+
+        run.append((key(record), record))
+        run_size += len(record) + record_overhead
+        if run_size >= limit:
+            runs.append(_write_run(run))
+            run = []
+            run_size = 0
+
+    if runs:
+        if run:
+            runs.append(_write_run(run))
+        merged = heapq.merge(*[_read_run(i) for i in runs],
+                             key=operator.itemgetter(0))
+    else:
+        run.sort(key=operator.itemgetter(0))
+        merged = iter(run)
+
+    def records():
+        if header_line:
+            yield header_line
+        for _, record in merged:
+            yield record
+
+    return io.BufferedReader(RecordStream(records(),
+                                          getattr(fileobj, 'name', None)))
@@ -0,0 +1,226 @@
+# gazetteer.columnar
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Reading of gazetteer data files into batches of typed columns, so that the
+data can be checked or analysed without uploading it to a database. This
+requires NumPy.'''
+
+import csv
+import io
+import locale
+import re
+
+from .tables import GazetteerTableCSV, GazetteerTableInserted
+
+
+class ColumnBatch:
+    '''A batch of rows from a gazetteer data file held as a NumPy array for
+    each field, keyed by the SQL name of the field, along with a Boolean
+    array for each that is True where the value is NULL. first_row is the
+    number of the first row in the batch, counting from 0 after the
+    header.'''
+
+    def __init__(self, table, first_row, rows, columns, masks):
+        self.table = table
+        self.first_row = first_row
+        self.rows = rows
+        self.columns = columns
+        self.masks = masks
+
+    def null_violations(self):
+        '''Yield the row number and field name of each NULL value in a field
+        that is not nullable'''
+
+        for field in self.table.fields:
+            if not field.nullable:
+                for row in self.masks[field.sql_name].nonzero()[0]:
+                    yield self.first_row + int(row), field.field_name
+
+
+# The characters that backslash escapes in COPY text format stand for, apart
+# from octal and hexadecimal escapes. A backslash followed by any other
+# character stands for that character.
+
+copy_text_escapes = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t',
+                     'v': '\v'}
+
+
+def _unescape(escape):
+    '''Return the character that a COPY text format backslash escape stands
+    for'''
+
+    code = escape[1:]
+    if code[0] in '01234567':
+        return chr(int(code, 8))
+    if code[0] == 'x' and len(code) > 1:
+        return chr(int(code[1:], 16))
+    return copy_text_escapes.get(code, code)
+
+
+def split_copy_text(line, sep):
+    '''Split a line of COPY text format data (without its line break) into
+    fields, interpreting backslash escapes as PostgreSQL does, so an escaped
+    separator does not split a field. Octal and hexadecimal escapes are taken
+    as Unicode code points, which is only exact for ASCII characters.'''
+
+    if '\\' not in line:
+        return line.split(sep)
+
+    tokens = re.compile(r'\\(?:[0-7]{1,3}|x[0-9a-fA-F]{1,2}|.)|' +
+                        re.escape(sep), re.DOTALL)
+
+    fields = []
+    field = []
+    pos = 0
+
+    for match in tokens.finditer(line):
+        field.append(line[pos:match.start()])
+        if match.group() == sep:
+            fields.append(''.join(field))
+            field = []
+        else:
+            field.append(_unescape(match.group()))
+        pos = match.end()
+
+    field.append(line[pos:])
+    fields.append(''.join(field))
+    return fields
+
+
+def iter_rows(table, fileobj, header=True):
+    '''Yield the values in each row of the binary file object fileobj as a
+    list of strings, decoded and split as PostgreSQL would for the table,
+    including the interpretation of backslash escapes in COPY text format.
+    NULL values are returned as empty strings. Raise ValueError if the
+    header is not correct or a row has the wrong number of fields. The rows
+    are split one at a time in Python, so reading is bound by the speed of
+    Python rather than of memory.'''
+
+    csv_mode = isinstance(table, GazetteerTableCSV)
+    text = io.TextIOWrapper(fileobj,
+                            encoding=table.encoding or
+                            locale.getpreferredencoding(False),
+                            newline='' if csv_mode else None)
+
+    if header and not table.check_header(text.readline()):
+        raise ValueError('File does not have the correct header for {}'
+                         .format(table.full_table_name))
+
+    if csv_mode:
+        rows = csv.reader(text, delimiter=table.sep, quotechar=table.quote,
+                          escapechar=table.escape
+                          if table.escape != table.quote else None,
+                          doublequote=table.escape == table.quote)
+        if table.null is not None:
+            rows = ([('' if i == table.null else i) for i in row]
+                    for row in rows)
+    elif isinstance(table, GazetteerTableInserted):
+        rows = (line.rstrip('\r\n').replace('\x00', '').split(table.sep)
+                for line in text)
+    else:
+        rows = (split_copy_text(line.rstrip('\r\n'), table.sep)
+                for line in text)
+
+    field_count = len(table.fields)
+    for number, row in enumerate(rows):
+        if len(row) != field_count:
+            raise ValueError('Row {} has {} fields but {} were expected'
+                             .format(number, len(row), field_count))
+        yield row
+
+
+def iter_batches(table, fileobj, batch_rows=65536, header=True):
+    '''Yield ColumnBatch objects of up to batch_rows rows each from the binary
+    file object fileobj, with each field converted to its NumPy type. Raise
+    ValueError if a value cannot be converted.'''
+
+    first_row = 0
+    batch = []
+
+    for row in iter_rows(table, fileobj, header):
+        batch.append(row)
+        if len(batch) == batch_rows:
+            yield _convert(table, first_row, batch)
+            first_row += len(batch)
+            batch = []
+
+    if batch or first_row == 0:
+        yield _convert(table, first_row, batch)
+
+
+def _convert(table, first_row, rows):
+    '''Convert a list of rows of strings into a ColumnBatch'''
+
+    if rows:
+        values = list(zip(*rows))
+    else:
+        values = [() for i in table.fields]
+
+    columns = {}
+    masks = {}
+
+    for field, column in zip(table.fields, values):
+        try:
+            columns[field.sql_name], masks[field.sql_name] = \
+                field.convert_batch(column, table.datestyle)
+        except ValueError as err:
+            raise ValueError('In the batch starting at row {}: {}'
+                             .format(first_row, err)) from None
+
+    return ColumnBatch(table, first_row, len(rows), columns, masks)
+
+
+def check_file(table, fileobj, batch_rows=65536, header=True):
+    '''Check that all of the data in the binary file object fileobj could be
+    uploaded to the table, without using a database. Return the number of
+    rows read and a list of messages describing any problems found. Values
+    that cannot be converted are reported for each batch, but a problem with
+    the header or the number of fields stops the check.'''
+
+    rows = 0
+    problems = []
+    batch = []
+    first_row = 0
+
+    def check_batch():
+        try:
+            converted = _convert(table, first_row, batch)
+        except ValueError as err:
+            problems.append(str(err))
+        else:
+            problems.extend('Row {}: NULL value in field {}'.format(row, name)
+                            for row, name in converted.null_violations())
+
+    try:
+        for row in iter_rows(table, fileobj, header):
+            batch.append(row)
+            rows += 1
+            if len(batch) == batch_rows:
+                check_batch()
+                first_row = rows
+                batch = []
+    except ValueError as err:
+        problems.append(str(err))
+        return rows, problems
+
+    if batch:
+        check_batch()
+
+    return rows, problems
@@ -0,0 +1,215 @@
+# gazetteer.delta
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Support for uploading only the rows of a gazetteer data file that have
+changed since the previous upload, by comparing hashes of each row with those
+recorded in the database.'''
+
+import array
+import bisect
+import hashlib
+import io
+
+from .streams import RecordStream
+
+
+def row_hash(record):
+    '''Return a signed 64-bit hash of a record, ignoring the line ending'''
+
+    return int.from_bytes(
+        hashlib.blake2b(record.rstrip(b'\r\n'), digest_size=8).digest(),
+        'big', signed=True)
+
+
+class HashReader:
+    '''A write-only file-like object that parses the output of a COPY TO
+    command that returns a single BIGINT column into an array.'''
+
+    def __init__(self, name):
+        self.name = name
+        self.hashes = array.array('q')
+        self._partial = b''
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('ASCII')
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        self.hashes.extend(int(i) for i in lines)
+
+
+class DeltaLoad:
+    '''This class handles uploading the changes in a gazetteer data file to a
+    table. A hash of each row uploaded is kept in a side table in the
+    database. Rows whose hash is not already known are copied into a
+    temporary staging table, and when all of the files for the table have
+    been processed these are merged into the table with INSERT ... ON
+    CONFLICT. Rows that were previously uploaded but are no longer present
+    are deleted. Rows already in the table when delta uploads are first used
+    are updated if they are present, but never deleted. If dictionary is
+    set, the table's dictionary encoded fields hold keys (see
+    gazetteer.dictionary) and the rows uploaded must already be encoded.'''
+
+    hash_column = 'gazetteer_row_hash'
+
+    def __init__(self, table, dictionary=False):
+        self.table = table
+        self.hash_table_name = table.full_table_name + '_row_hashes'
+        self.staging_table_name = 'gazetteer_delta_' + table.table_name
+        self.new_hashes_table_name = 'gazetteer_delta_hashes_' + \
+            table.table_name
+
+        self.pk_columns = [i.strip().lower() for i in table.pk.split(',')]
+        self.columns = table.column_names(dictionary)
+        self.other_columns = [i for i in self.columns
+                              if i not in self.pk_columns]
+
+        self.known_hashes = array.array('q')
+        self.new_hashes = array.array('q')
+        self.rows_changed = 0
+
+    def generate_hash_table_sql(self):
+        '''Return the SQL that will create the table of row hashes if it does
+        not already exist'''
+
+        result = 'CREATE TABLE IF NOT EXISTS {} (\n'\
+                 .format(self.hash_table_name)
+
+        for i in self.table.fields:
+            if i.sql_name in self.pk_columns:
+                result += '    ' + i.generate_sql() + ',\n'
+
+        result += '    {} BIGINT NOT NULL,\n'.format(self.hash_column)
+        result += '    PRIMARY KEY({})\n);\n'\
+                  .format(', '.join(self.pk_columns))
+
+        return result
+
+    def generate_drop_sql(self):
+        '''Return the SQL that will drop the table of row hashes, which must
+        be done whenever the table is emptied or reloaded by other means'''
+
+        return 'DROP TABLE IF EXISTS {};\n'.format(self.hash_table_name)
+
+    def begin(self, cur):
+        '''Create the temporary tables needed for the upload and fetch the
+        hashes of the rows already uploaded using the cursor cur'''
+
+        cur.execute(self.generate_hash_table_sql())
+
+        # A generated geography column must remain generated in the copy, or
+        # COPY would expect data for it
+
+        cur.execute('CREATE TEMPORARY TABLE {0} '
+                    '(LIKE {1} INCLUDING GENERATED) ON COMMIT DROP;\n'
+                    'ALTER TABLE {0} ADD COLUMN {2} BIGINT;\n'
+                    .format(self.staging_table_name,
+                            self.table.full_table_name,
+                            self.hash_column))
+
+        cur.execute('CREATE TEMPORARY TABLE {} ({} BIGINT) ON COMMIT DROP;'
+                    .format(self.new_hashes_table_name, self.hash_column))
+
+        # The hashes are returned in order so they can be searched with bisect
+        # without sorting a copy of them
+
+        reader = HashReader(self.hash_table_name)
+        cur.copy_expert(sql='COPY (SELECT {0} FROM {1} ORDER BY {0}) '
+                            'TO STDOUT;'.format(self.hash_column,
+                                                self.hash_table_name),
+                        file=reader)
+        self.known_hashes = reader.hashes
+
+    def filter(self, fileobj):
+        '''Return a binary file object that gives the records from the table's
+        data in fileobj which are new or changed, with the hash of each
+        appended as an extra field'''
+
+        sep = self.table.sep.encode('ASCII')
+
+        def changed_records():
+            known_hashes = self.known_hashes
+            for record in self.table.iter_records(fileobj):
+                record_hash = row_hash(record)
+                self.new_hashes.append(record_hash)
+                i = bisect.bisect_left(known_hashes, record_hash)
+                if i == len(known_hashes) or known_hashes[i] != record_hash:
+                    self.rows_changed += 1
+                    yield record.rstrip(b'\r\n') + sep + \
+                        str(record_hash).encode('ASCII') + b'\n'
+
+        return io.BufferedReader(RecordStream(changed_records(),
+                                              getattr(fileobj, 'name', None)))
+
+    def apply(self, cur):
+        '''Merge the changed rows into the table, delete the rows that have
+        gone and update the hashes in the database using the cursor cur'''
+
+        new_hashes = io.BufferedReader(RecordStream(
+            (str(i).encode('ASCII') + b'\n' for i in self.new_hashes),
+            self.new_hashes_table_name))
+        cur.copy_expert(sql='COPY {} FROM STDIN;'
+                        .format(self.new_hashes_table_name),
+                        file=new_hashes)
+
+        cur.execute('ANALYZE {};'.format(self.staging_table_name))
+        cur.execute('ANALYZE {};'.format(self.new_hashes_table_name))
+
+        columns = ', '.join(self.columns)
+        pk = ', '.join(self.pk_columns)
+
+        sql = 'INSERT INTO {0} ({1})\nSELECT {1} FROM {2}\nON CONFLICT ({3}) '\
+              .format(self.table.full_table_name, columns,
+                      self.staging_table_name, pk)
+        if self.other_columns:
+            sql += 'DO UPDATE SET ' + \
+                   ', '.join('{0} = EXCLUDED.{0}'.format(i)
+                             for i in self.other_columns) + ';'
+        else:
+            sql += 'DO NOTHING;'
+        cur.execute(sql)
+
+        def pk_match(a, b):
+            return ' AND '.join('{0}.{2} = {1}.{2}'.format(a, b, i)
+                                for i in self.pk_columns)
+
+        cur.execute('DELETE FROM {0} t USING {1} h\n'
+                    'WHERE {2}\n'
+                    'AND NOT EXISTS (SELECT 1 FROM {3} n '
+                    'WHERE n.{4} = h.{4})\n'
+                    'AND NOT EXISTS (SELECT 1 FROM {5} s WHERE {6});'
+                    .format(self.table.full_table_name, self.hash_table_name,
+                            pk_match('t', 'h'),
+                            self.new_hashes_table_name, self.hash_column,
+                            self.staging_table_name, pk_match('s', 't')))
+
+        cur.execute('DELETE FROM {0} h\n'
+                    'WHERE NOT EXISTS (SELECT 1 FROM {1} n '
+                    'WHERE n.{2} = h.{2});'
+                    .format(self.hash_table_name,
+                            self.new_hashes_table_name, self.hash_column))
+
+        cur.execute('INSERT INTO {0} ({1}, {2})\nSELECT {1}, {2} FROM {3}\n'
+                    'ON CONFLICT ({1}) DO UPDATE SET {2} = EXCLUDED.{2};'
+                    .format(self.hash_table_name, pk, self.hash_column,
+                            self.staging_table_name))
+
+        cur.execute('DROP TABLE {}, {};'.format(self.staging_table_name,
+                                                self.new_hashes_table_name))
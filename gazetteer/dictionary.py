@@ -0,0 +1,205 @@
+# gazetteer.dictionary
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Support for uploading gazetteer data with the dictionary encoded fields of
+a table replaced by integer keys, with the distinct values held in a separate
+dictionary table for each field (see GazetteerTable.generate_dictionary_sql).
+The keys are assigned as the data is read, so the dictionaries must be saved
+in the same transaction as the data or before it. Each dictionary is locked
+from when it is loaded until all of the new values have been saved, so that
+other processes uploading to the same table cannot assign the same keys.'''
+
+import io
+import locale
+import threading
+
+from .streams import RecordStream
+
+key_limits = {'SMALLINT': 2**15 - 1, 'INTEGER': 2**31 - 1,
+              'BIGINT': 2**63 - 1}
+
+
+class DictionaryReader:
+    '''A write-only file-like object that parses the output of a COPY TO
+    command that returns the key and value columns of a dictionary table into
+    a dict mapping the raw values to the keys.'''
+
+    def __init__(self, name, sep, encoding):
+        self.name = name
+        self.sep = sep
+        self.encoding = encoding
+        self.keys = {}
+        self._partial = b''
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode(self.encoding)
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        for i in lines:
+            key, _, value = i.partition(self.sep)
+            self.keys[value] = key
+
+
+class ColumnDictionary:
+    '''The dictionary for one dictionary encoded field of a table, mapping
+    each value as it appears in the data file to its key. It can be shared
+    by several threads uploading files for the same table.'''
+
+    def __init__(self, table, field):
+        self.table = table
+        self.field = field
+        self.full_table_name = table.dictionary_table_name(field)
+        self.max_key = key_limits[table.dictionary_fields[field.sql_name]
+                                  .upper()]
+
+        self.sep = table.sep.encode('ASCII')
+        self.keys = {}
+        self.next_key = 1
+        self.new_values = []
+        self.lock = threading.Lock()
+
+    def _copy_options(self):
+        return "FORMAT TEXT, DELIMITER '{}', ENCODING '{}'".format(
+            self.table.sep, self.table.copy_encoding())
+
+    def load(self, cur):
+        '''Lock the dictionary table for this session and fetch the values
+        already in it using the cursor cur. The lock, keyed by the OID of the
+        table, is held until release is called or the connection is closed,
+        so that no other process can add values in the meantime. The values
+        are returned in the same format as the data files, so they can be
+        compared without being decoded.'''
+
+        cur.execute('SELECT pg_advisory_lock(%s::regclass::oid::bigint);',
+                    (self.full_table_name,))
+
+        reader = DictionaryReader(self.full_table_name, self.sep,
+                                  self.table.encoding or
+                                  locale.getpreferredencoding(False))
+        cur.copy_expert(sql='COPY {} TO STDOUT WITH ({});'
+                        .format(self.full_table_name, self._copy_options()),
+                        file=reader)
+
+        self.keys = reader.keys
+        self.next_key = max((int(i) for i in self.keys.values()),
+                            default=0) + 1
+
+    def encode(self, value):
+        '''Return the key for a value as bytes, assigning a new key if the
+        value has not been seen before'''
+
+        key = self.keys.get(value)
+        if key is None:
+            with self.lock:
+                key = self.keys.get(value)
+                if key is None:
+                    if self.next_key > self.max_key:
+                        raise ValueError('Field {} of {} has too many values '
+                                         'for its dictionary'
+                                         .format(self.field.field_name,
+                                                 self.table.full_table_name))
+                    key = str(self.next_key).encode('ASCII')
+                    self.next_key += 1
+                    self.keys[value] = key
+                    self.new_values.append(value)
+        return key
+
+    def save(self, cur):
+        '''Add the values that have been given new keys to the dictionary
+        table using the cursor cur'''
+
+        with self.lock:
+            values = self.new_values
+            self.new_values = []
+
+        if values:
+            data = io.BufferedReader(RecordStream(
+                (self.keys[i] + self.sep + i + b'\n' for i in values),
+                self.full_table_name))
+            cur.copy_expert(sql='COPY {} FROM STDIN WITH ({});'
+                            .format(self.full_table_name,
+                                    self._copy_options()),
+                            file=data)
+
+    def release(self, cur):
+        '''Release the lock taken on the dictionary table when it was loaded,
+        using the cursor cur. Any new values must already have been saved and
+        committed.'''
+
+        cur.execute('SELECT pg_advisory_unlock(%s::regclass::oid::bigint);',
+                    (self.full_table_name,))
+
+
+class DictionaryEncoding:
+    '''This class handles replacing the values of the dictionary encoded
+    fields of a table by their keys as the data files are uploaded. Only
+    tables that use the COPY text format are supported. A partitioned table
+    and its partitions share the same dictionaries.'''
+
+    def __init__(self, table):
+        self.table = table.parent or table
+        self.dictionaries = {}
+
+        for index, field in enumerate(self.table.fields):
+            if field.sql_name in self.table.dictionary_fields:
+                self.dictionaries[index] = ColumnDictionary(self.table, field)
+
+    def begin(self, cur):
+        '''Create the dictionary tables if necessary, then lock them and
+        fetch the values already in them using the cursor cur. When several
+        tables are uploaded they must be begun in order of their names, so
+        that two processes cannot each wait for a lock the other holds.'''
+
+        cur.execute(self.table.generate_dictionary_sql())
+        for i in self.dictionaries.values():
+            i.load(cur)
+
+    def filter(self, fileobj):
+        '''Return a binary file object that gives the records from the table's
+        data in fileobj with the values of the encoded fields replaced by
+        their keys. NULL values are left as they are.'''
+
+        sep = self.table.sep.encode('ASCII')
+
+        def encoded_records():
+            for record in self.table.iter_records(fileobj):
+                values = self.table.split_record(record.rstrip(b'\r\n'))
+                for index, dictionary in self.dictionaries.items():
+                    if index < len(values) and values[index] != b'':
+                        values[index] = dictionary.encode(values[index])
+                yield sep.join(values) + b'\n'
+
+        return io.BufferedReader(RecordStream(encoded_records(),
+                                              getattr(fileobj, 'name', None)))
+
+    def save(self, cur):
+        '''Add any new values to the dictionary tables using the cursor
+        cur'''
+
+        for i in self.dictionaries.values():
+            i.save(cur)
+
+    def release(self, cur):
+        '''Release the locks on the dictionary tables using the cursor cur,
+        once all of the new values have been saved and committed'''
+
+        for i in self.dictionaries.values():
+            i.release(cur)
@@ -23,12 +23,83 @@ with information on their SQL equivalents'''
 
 import abc
 
+# NumPy is only needed to convert columns of data in bulk
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _prepare_batch(values):
+    '''Return the stripped values as a NumPy string array, along with a mask
+    that is True where they are empty'''
+
+    if numpy is None:
+        raise ImportError('NumPy is required to convert batches of values')
+
+    strings = numpy.char.strip(numpy.asarray(values, dtype=str))
+    return strings, strings == ''
+
+
+def _invalid_value(field, values, strings, mask, check):
+    '''Raise a ValueError identifying the first of the values that check
+    rejects, as it appeared in the original strings'''
+
+    for row, value in enumerate(values):
+        if not mask[row]:
+            try:
+                check(value)
+            except ValueError:
+                raise ValueError('Invalid value {!r} in row {} of field {}'
+                                 .format(str(strings[row]), row,
+                                         field.field_name)) from None
+
+    raise ValueError('Invalid value in field {}'.format(field.field_name))
+
+
+def _check_width(field, values, mask, width):
+    '''Raise a ValueError if any of the values that are not masked are
+    longer than width characters'''
+
+    too_long = (numpy.char.str_len(numpy.asarray(values, dtype=str)) >
+                width) & ~mask
+    if too_long.any():
+        row = int(numpy.argmax(too_long))
+        raise ValueError('Value {!r} in row {} of field {} is longer than {} '
+                         'characters'.format(values[row], row,
+                                             field.field_name, width))
+
+
+def _iso_dates(strings, datestyle):
+    '''Rewrite an array of dates in the given PostgreSQL date style as ISO
+    8601 dates. As in PostgreSQL, dates already in ISO format are accepted
+    whatever the date style.'''
+
+    if datestyle == 'ISO':
+        return strings
+
+    first, _, rest = numpy.moveaxis(numpy.char.partition(strings, '/'), -1, 0)
+    second, _, year = numpy.moveaxis(numpy.char.partition(rest, '/'), -1, 0)
+
+    if datestyle == 'DMY':
+        first, second = second, first
+
+    iso = numpy.char.add(numpy.char.add(numpy.char.add(year, '-'),
+                                        numpy.char.zfill(first, 2)),
+                         numpy.char.add('-', numpy.char.zfill(second, 2)))
+
+    return numpy.where(numpy.char.find(strings, '/') >= 0, iso, strings)
+
 
 class GazetteerField(metaclass=abc.ABCMeta):
     '''An abstract class that defines a field/column in a gazetteer data
     table.'''
 
     sql_type_name = 'NONE'
+    sqlite_type_name = 'TEXT'
+    numpy_dtype = 'object'
+    arrow_type_name = 'string'
 
     def __init__(self, field_name, sql_name='', nullable=True):
         self.field_name = field_name
@@ -46,29 +117,100 @@ class GazetteerField(metaclass=abc.ABCMeta):
         else:
             return self.sql_name + ' ' + self.sql_type_name + ' NOT NULL'
 
+    def sql_type(self):
+        '''Return the SQL type of the field'''
+        return self.sql_type_name
+
+    def convert_batch(self, values, datestyle='ISO'):
+        '''Convert a sequence of strings from a data file into a NumPy array
+        of the appropriate type, returning it along with a Boolean array that
+        is True where the value is NULL (empty or blank). datestyle is the
+        PostgreSQL date style used by the file. Raise ValueError if a value
+        cannot be converted.'''
+
+        strings, mask = _prepare_batch(values)
+        result = numpy.array(values, dtype=object)
+        result[mask] = None
+        return result, mask
+
+
+class _IntegerTypeField(GazetteerField):
+    '''An abstract class for gazetteer fields that hold integers.'''
+
+    sqlite_type_name = 'INTEGER'
+    numpy_dtype = 'int64'
+    arrow_type_name = 'int64'
 
-class BigIntField(GazetteerField):
+    def convert_batch(self, values, datestyle='ISO'):
+        strings, mask = _prepare_batch(values)
+        filled = numpy.where(mask, '0', strings)
+
+        try:
+            result = filled.astype(numpy.int64)
+        except (ValueError, OverflowError):
+            _invalid_value(self, filled, strings, mask, int)
+
+        limits = numpy.iinfo(self.numpy_dtype)
+        out_of_range = (result < limits.min) | (result > limits.max)
+        if out_of_range.any():
+            row = int(numpy.argmax(out_of_range))
+            raise ValueError('Value {} in row {} of field {} is out of range'
+                             .format(result[row], row, self.field_name))
+
+        return result.astype(self.numpy_dtype), mask
+
+
+class BigIntField(_IntegerTypeField):
     '''A gazetteer field corresponding to the SQL type BIGINT.'''
 
     sql_type_name = 'BIGINT'
+    numpy_dtype = 'int64'
+    arrow_type_name = 'int64'
 
 
-class IntegerField(GazetteerField):
+class IntegerField(_IntegerTypeField):
     '''A gazetteer field corresponding to the SQL type INTEGER.'''
 
     sql_type_name = 'INTEGER'
+    numpy_dtype = 'int32'
+    arrow_type_name = 'int32'
 
 
-class SmallIntField(GazetteerField):
+class SmallIntField(_IntegerTypeField):
     '''A gazetteer field corresponding to the SQL type SMALLINT.'''
 
     sql_type_name = 'SMALLINT'
+    numpy_dtype = 'int16'
+    arrow_type_name = 'int16'
 
 
 class DoubleField(GazetteerField):
     '''A gazetteer field corresponding to the SQL type DOUBLE PRECISION.'''
 
     sql_type_name = 'DOUBLE PRECISION'
+    sqlite_type_name = 'REAL'
+    numpy_dtype = 'float64'
+    arrow_type_name = 'float64'
+
+    def convert_batch(self, values, datestyle='ISO'):
+        strings, mask = _prepare_batch(values)
+        filled = numpy.where(mask, 'nan', strings)
+
+        try:
+            result = filled.astype(self.numpy_dtype)
+        except ValueError:
+            _invalid_value(self, filled, strings, mask, float)
+
+        return result, mask
+
+
+class RealField(DoubleField):
+    '''A gazetteer field corresponding to the SQL type REAL, which holds
+    about six significant decimal digits exactly.'''
+
+    sql_type_name = 'REAL'
+    numpy_dtype = 'float32'
+    arrow_type_name = 'float32'
 
 
 class TextField(GazetteerField):
@@ -92,17 +234,61 @@ class FixedTextField(GazetteerField):
             return self.sql_name + ' CHARACTER VARYING({})'.format(self.width)\
              + ' NOT NULL'
 
+    def sql_type(self):
+        return 'CHARACTER VARYING({})'.format(self.width)
+
+    def convert_batch(self, values, datestyle='ISO'):
+        result, mask = super().convert_batch(values, datestyle)
+        _check_width(self, values, mask, self.width)
+        return result, mask
+
 
 class DateField(GazetteerField):
     '''A gazetteer field corresponding to the SQL type DATE.'''
 
     sql_type_name = 'DATE'
+    numpy_dtype = 'datetime64[D]'
+    arrow_type_name = 'date32'
+
+    def convert_batch(self, values, datestyle='ISO'):
+        strings, mask = _prepare_batch(values)
+        filled = numpy.where(mask, 'NaT', _iso_dates(strings, datestyle))
+
+        try:
+            result = filled.astype(self.numpy_dtype)
+        except ValueError:
+            _invalid_value(self, filled, strings, mask,
+                           lambda x: numpy.datetime64(x, 'D'))
+
+        return result, mask
 
 
 class TimeStampField(GazetteerField):
     '''A gazetteer field corresponding to the SQL type TIMESTAMP.'''
 
     sql_type_name = 'TIMESTAMP'
+    numpy_dtype = 'datetime64[us]'
+    arrow_type_name = 'timestamp[us]'
+
+    def convert_batch(self, values, datestyle='ISO'):
+        strings, mask = _prepare_batch(values)
+
+        date, _, time = numpy.moveaxis(
+            numpy.char.partition(numpy.char.replace(strings, 'T', ' '), ' '),
+            -1, 0)
+        date = _iso_dates(date, datestyle)
+        timestamps = numpy.where(time == '', date,
+                                 numpy.char.add(numpy.char.add(date, 'T'),
+                                                time))
+        filled = numpy.where(mask, 'NaT', timestamps)
+
+        try:
+            result = filled.astype(self.numpy_dtype)
+        except ValueError:
+            _invalid_value(self, filled, strings, mask,
+                           lambda x: numpy.datetime64(x, 'us'))
+
+        return result, mask
 
 
 class FlagField(GazetteerField):
@@ -113,3 +299,22 @@ class FlagField(GazetteerField):
     takes up one byte.'''
 
     sql_type_name = 'CHARACTER VARYING(1)'
+
+    def convert_batch(self, values, datestyle='ISO'):
+        result, mask = super().convert_batch(values, datestyle)
+        _check_width(self, values, mask, 1)
+        return result, mask
+
+
+class CharField(GazetteerField):
+    '''A gazetteer field corresponding to the internal PostgreSQL type "char"
+    (with the quotations), which holds a single byte without the length
+    header of the other text types. It is only suitable for single ASCII
+    characters.'''
+
+    sql_type_name = '"char"'
+
+    def convert_batch(self, values, datestyle='ISO'):
+        result, mask = super().convert_batch(values, datestyle)
+        _check_width(self, values, mask, 1)
+        return result, mask
@@ -0,0 +1,154 @@
+# gazetteer.fingerprints
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Fingerprints of the contents of the data files uploaded to each table,
+kept in a table in the database, so that files which have not changed since
+they were last uploaded can be skipped when a new release of a .zip archive
+is uploaded. The load options that change which rows or values are uploaded
+are part of the fingerprint, so a file is only skipped if it was uploaded
+with the same options.'''
+
+import datetime
+import hashlib
+import os
+
+from .journal import journal_schema
+
+fingerprint_table_name = 'file_fingerprints'
+fingerprint_full_table_name = journal_schema + '.' + fingerprint_table_name
+
+
+def member_fingerprint(info):
+    '''Return the fingerprint of a member of a .zip archive, described by a
+    zipfile.ZipInfo object, made from its CRC and size so that the member
+    does not have to be read'''
+
+    return 'crc32:{:08x}:{}'.format(info.CRC, info.file_size)
+
+
+def file_fingerprint(path):
+    '''Return the fingerprint of a data file, made from a hash of its
+    contents and its size. The whole file is read.'''
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1024*1024), b''):
+            digest.update(block)
+
+    return 'blake2b:{}:{}'.format(digest.hexdigest(), os.path.getsize(path))
+
+
+def options_fingerprint(options):
+    '''Return the fingerprint of the load options used to upload a file,
+    given as a dict mapping the names of the options to their values, made
+    from a hash of the options that are set. An empty string is returned if
+    none of them are set, so that a plain upload of a file has the same
+    fingerprint as the file itself.'''
+
+    used = sorted((name, value) for name, value in options.items()
+                  if value is not None and value is not False)
+    if not used:
+        return ''
+
+    digest = hashlib.blake2b(repr(used).encode('UTF-8'), digest_size=8)
+    return 'options:{}'.format(digest.hexdigest())
+
+
+class FingerprintCache:
+    '''This class records the fingerprint of each file uploaded to a table,
+    by table and file name, and finds the files that are unchanged since they
+    were uploaded. A file is recorded using the same cursor as its data, so
+    the record is only kept if the data is. The fingerprint of the load
+    options (see options_fingerprint) is recorded along with the fingerprint
+    of the file.'''
+
+    def __init__(self):
+        self.fingerprints = {}
+
+    @staticmethod
+    def generate_create_sql():
+        '''Return the SQL that creates the fingerprint table if it does not
+        already exist'''
+
+        return 'CREATE SCHEMA IF NOT EXISTS {0};\n'\
+               'CREATE TABLE IF NOT EXISTS {1} (\n'\
+               '    table_name TEXT NOT NULL,\n'\
+               '    member TEXT NOT NULL,\n'\
+               '    parent_table_name TEXT,\n'\
+               '    fingerprint TEXT NOT NULL,\n'\
+               '    archive TEXT,\n'\
+               '    loaded TIMESTAMP WITH TIME ZONE NOT NULL,\n'\
+               '    PRIMARY KEY(table_name, member)\n);\n'\
+               .format(journal_schema, fingerprint_full_table_name)
+
+    def load(self, cur):
+        '''Fetch the fingerprints of all of the files uploaded so far using
+        the cursor cur'''
+
+        cur.execute('SELECT table_name, member, fingerprint FROM {};'
+                    .format(fingerprint_full_table_name))
+        self.fingerprints = {(table_name, member): fingerprint
+                             for table_name, member, fingerprint
+                             in cur.fetchall()}
+
+    @staticmethod
+    def _combine(fingerprint, options):
+        return fingerprint + ':' + options if options else fingerprint
+
+    def unchanged(self, table_name, member, fingerprint, options=''):
+        '''Return a Boolean that indicates if the file member was last
+        uploaded to the table with the same fingerprint and load options'''
+
+        return fingerprint is not None and \
+            self.fingerprints.get((table_name, member)) == \
+            self._combine(fingerprint, options)
+
+    def record(self, cur, table_name, member, fingerprint,
+               parent_table_name=None, archive=None, options=''):
+        '''Record the fingerprint of a file uploaded to a table (or a
+        partition of the table parent_table_name) from the archive with the
+        load options given by their fingerprint, using the cursor cur'''
+
+        fingerprint = self._combine(fingerprint, options)
+
+        cur.execute('INSERT INTO {} (table_name, member, parent_table_name, '
+                    'fingerprint, archive, loaded)\n'
+                    'VALUES (%s, %s, %s, %s, %s, %s)\n'
+                    'ON CONFLICT (table_name, member) DO UPDATE SET\n'
+                    '    parent_table_name = EXCLUDED.parent_table_name, '
+                    'fingerprint = EXCLUDED.fingerprint,\n'
+                    '    archive = EXCLUDED.archive, '
+                    'loaded = EXCLUDED.loaded;'
+                    .format(fingerprint_full_table_name),
+                    (table_name, member, parent_table_name, fingerprint,
+                     archive, datetime.datetime.now(datetime.timezone.utc)))
+        self.fingerprints[(table_name, member)] = fingerprint
+
+    def forget(self, cur, table_name):
+        '''Remove the fingerprints of the files uploaded to a table, or to
+        any of its partitions, using the cursor cur. This is needed when the
+        contents of the table are replaced.'''
+
+        cur.execute('DELETE FROM {} WHERE table_name = %s OR '
+                    'parent_table_name = %s;'
+                    .format(fingerprint_full_table_name),
+                    (table_name, table_name))
+        self.fingerprints = {i: j for i, j in self.fingerprints.items()
+                             if i[0] != table_name}
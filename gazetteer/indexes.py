@@ -22,11 +22,15 @@
 information on generating appropriate SQL'''
 
 
-class GazetteerBTreeIndex:
-    '''This class defines basic btree indexes on a table'''
+class GazetteerIndex:
+    '''This class defines indexes on a table using any of the PostgreSQL
+    index access methods. If the index needs a PostgreSQL extension, it is
+    created along with the index if it does not already exist.'''
 
-    def __init__(self, name, schema, table_name, columns,
-                 unique=False, where=None, fillfactor=100):
+    extension = None
+
+    def __init__(self, name, schema, table_name, columns, method='btree',
+                 unique=False, where=None, fillfactor=None):
 
         self.name = name
         self.schema = schema
@@ -36,6 +40,7 @@ class GazetteerBTreeIndex:
             self.columns = (columns, )
         else:
             self.columns = columns
+        self.method = method
         self.unique = unique
         self.where = where
         self.fillfactor = fillfactor
@@ -49,19 +54,26 @@ class GazetteerBTreeIndex:
         if drop_existing:
             result += self.generate_drop_sql()
 
+        if self.extension is not None:
+            result += 'CREATE EXTENSION IF NOT EXISTS {};\n\n'\
+                      .format(self.extension)
+
         unique_text = 'UNIQUE' if self.unique else ''
 
         result += 'CREATE {0} INDEX IF NOT EXISTS {1} ON {2}.{3} '\
-                  'USING btree\n    ('.format(unique_text,
-                                              self.name,
-                                              self.schema,
-                                              self.table_name)
+                  'USING {4}\n    ('.format(unique_text,
+                                            self.name,
+                                            self.schema,
+                                            self.table_name,
+                                            self.method)
 
         for c in self.columns[:-1]:
             result += c + ',\n    '
-        result += self.columns[-1] + '\n    )\n'
+        result += self.columns[-1] + '\n    )'
 
-        result += 'WITH (fillfactor = {})'.format(self.fillfactor)
+        storage_parameters = self.storage_parameters()
+        if storage_parameters:
+            result += '\nWITH ({})'.format(', '.join(storage_parameters))
 
         if self.where is not None:
             result += '\n' + self.where
@@ -70,6 +82,13 @@ class GazetteerBTreeIndex:
 
         return result
 
+    def storage_parameters(self):
+        '''Return a list of the storage parameters to set on the index'''
+
+        if self.fillfactor is not None:
+            return ['fillfactor = {}'.format(self.fillfactor), ]
+        return []
+
     def generate_drop_sql(self):
         '''Return the text of a SQL statement that will drop the index.'''
 
@@ -77,6 +96,80 @@ class GazetteerBTreeIndex:
                .format(self.schema, self.name)
 
 
+class GazetteerBTreeIndex(GazetteerIndex):
+    '''This class defines basic btree indexes on a table'''
+
+    def __init__(self, name, schema, table_name, columns,
+                 unique=False, where=None, fillfactor=100):
+        super().__init__(name, schema, table_name, columns, 'btree', unique,
+                         where, fillfactor)
+
+
+class GazetteerGiSTIndex(GazetteerIndex):
+    '''This class defines GiST indexes on a table, or SP-GiST indexes if
+    spgist is set. On a PostGIS geography column these support radius and
+    nearest-neighbour searches.'''
+
+    def __init__(self, name, schema, table_name, columns, spgist=False,
+                 where=None, fillfactor=None):
+        super().__init__(name, schema, table_name, columns,
+                         'spgist' if spgist else 'gist', False, where,
+                         fillfactor)
+
+
+class GazetteerBRINIndex(GazetteerIndex):
+    '''This class defines BRIN indexes on a table, which only record the
+    range of values found in each block of pages_per_range pages (by default
+    128). They are a tiny fraction of the size of a btree index, but are only
+    useful where the values are correlated with where the rows are stored,
+    such as the coordinates of data uploaded with gazetteer_extract.py
+    --cluster.'''
+
+    def __init__(self, name, schema, table_name, columns,
+                 pages_per_range=None, where=None):
+        super().__init__(name, schema, table_name, columns, 'brin', False,
+                         where)
+        self.pages_per_range = pages_per_range
+
+    def storage_parameters(self):
+        if self.pages_per_range is not None:
+            return ['pages_per_range = {}'.format(self.pages_per_range), ]
+        return []
+
+
+class GazetteerTrigramIndex(GazetteerIndex):
+    '''This class defines pg_trgm trigram indexes on a text column, which
+    support LIKE and ILIKE searches for a pattern anywhere in the text and
+    similarity searches with the % operator, so that misspelt names can be
+    found. The index is a GIN index, or a GiST index if gist is set, which
+    is larger but can also find the closest matches in order using the <->
+    operator.'''
+
+    extension = 'pg_trgm'
+
+    def __init__(self, name, schema, table_name, column, gist=False,
+                 where=None):
+        super().__init__(name, schema, table_name,
+                         column + (' gist_trgm_ops' if gist
+                                   else ' gin_trgm_ops'),
+                         'gist' if gist else 'gin', False, where)
+
+
+class GazetteerTextSearchIndex(GazetteerIndex):
+    '''This class defines GIN indexes on the tsvector of a text column, for
+    full text searches on the words in it. Searches must use the same
+    expression as the index, for example
+    to_tsvector('simple', column) @@ plainto_tsquery('simple', 'words').
+    The simple configuration does no stemming, which suits place names in
+    many languages.'''
+
+    def __init__(self, name, schema, table_name, column, config='simple',
+                 where=None):
+        super().__init__(name, schema, table_name,
+                         "to_tsvector('{}', {})".format(config, column),
+                         'gin', False, where)
+
+
 class GazetteerForeignKey:
     '''This class defines foreign keys on a table'''
 
@@ -100,9 +193,10 @@ class GazetteerForeignKey:
         else:
             self.foreign_columns = foreign_columns
 
-    def generate_sql(self, drop_existing=False):
+    def generate_sql(self, drop_existing=False, not_valid=False):
         '''Return the text of a SQL statement that will create the index. If
-        specified, drop the existing index first.'''
+        specified, drop the existing index first. If not_valid is set, the
+        existing data is not checked until generate_validate_sql is used.'''
 
         result = ''
 
@@ -121,12 +215,40 @@ class GazetteerForeignKey:
 
         for c in self.foreign_columns[:-1]:
             result += c + ',\n    '
-        result += self.foreign_columns[-1] + ');\n'
+        result += self.foreign_columns[-1] + ')'
+
+        if not_valid:
+            result += ' NOT VALID'
+
+        result += ';\n'
 
         return result
 
+    def generate_validate_sql(self):
+        '''Return the text of a SQL statement that will check the existing
+        data against a foreign key created with not_valid set.'''
+
+        return 'ALTER TABLE {0} VALIDATE CONSTRAINT {1};\n' \
+               .format(self.full_table_name, self.name)
+
     def generate_drop_sql(self):
         '''Return the text of a SQL statement that will drop the index.'''
 
         return 'ALTER TABLE {0} DROP CONSTRAINT IF EXISTS {1} CASCADE;\n\n' \
                .format(self.full_table_name, self.name)
+
+
+def existing_foreign_keys(cur, foreign_keys):
+    '''Return a list of the GazetteerForeignKey objects in foreign_keys that
+    already exist in the database, found using the cursor cur'''
+
+    result = []
+
+    for i in foreign_keys:
+        cur.execute("SELECT conname FROM pg_constraint WHERE contype = 'f' "
+                    "AND conrelid = to_regclass(%s) AND conname = lower(%s);",
+                    (i.full_table_name, i.name))
+        if cur.fetchall():
+            result.append(i)
+
+    return result
@@ -0,0 +1,143 @@
+# gazetteer.journal
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''A journal of the files uploaded from each data file or .zip archive,
+kept in a table in the database. Each file is recorded in the same
+transaction as its data, so the journal shows exactly which files have been
+committed and an interrupted upload can be resumed. A large file can also be
+committed in chunks, with the offset reached recorded after each one.'''
+
+import datetime
+import hashlib
+import os
+import zipfile
+
+journal_schema = 'gazetteer_etl'
+journal_table_name = 'load_journal'
+journal_full_table_name = journal_schema + '.' + journal_table_name
+
+# The status of a file whose data has been uploaded, one that was not
+# uploaded because it duplicates another, one whose upload failed, one that
+# has been partly uploaded in chunks and one that was not uploaded because it
+# is unchanged since it was last uploaded (see gazetteer.fingerprints)
+
+status_loaded = 'loaded'
+status_skipped = 'skipped'
+status_failed = 'failed'
+status_partial = 'partial'
+status_unchanged = 'unchanged'
+
+
+def archive_identity(path):
+    '''Return a string that identifies a data file or .zip archive by its
+    name, size and contents. For a .zip archive the contents are described by
+    the names and CRCs of its members, which are quick to read. For other
+    files the modification time is used, to avoid reading the whole file.'''
+
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(digest_size=8)
+
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path, 'r') as inputs:
+            for i in inputs.infolist():
+                digest.update('{}:{:08x}:{}\n'.format(
+                    i.filename, i.CRC, i.file_size).encode('UTF-8'))
+    else:
+        digest.update(str(os.stat(path).st_mtime_ns).encode('ASCII'))
+
+    return '{}:{}:{}'.format(os.path.basename(path), size, digest.hexdigest())
+
+
+class LoadJournal:
+    '''This class records the files uploaded from the archive with the given
+    identity (see archive_identity) in the load journal table. The journal is
+    shared by all of the connections used for an upload, and each file is
+    recorded using the same cursor as its data.'''
+
+    def __init__(self, archive):
+        self.archive = archive
+
+    @staticmethod
+    def generate_create_sql():
+        '''Return the SQL that creates the load journal table if it does not
+        already exist'''
+
+        return 'CREATE SCHEMA IF NOT EXISTS {0};\n'\
+               'CREATE TABLE IF NOT EXISTS {1} (\n'\
+               '    archive TEXT NOT NULL,\n'\
+               '    member TEXT NOT NULL,\n'\
+               '    crc BIGINT,\n'\
+               '    table_name TEXT,\n'\
+               '    row_count BIGINT,\n'\
+               '    status TEXT NOT NULL,\n'\
+               '    message TEXT,\n'\
+               '    started TIMESTAMP WITH TIME ZONE NOT NULL,\n'\
+               '    seconds DOUBLE PRECISION,\n'\
+               '    byte_offset BIGINT,\n'\
+               '    PRIMARY KEY(archive, member)\n);\n'\
+               'ALTER TABLE {1} ADD COLUMN IF NOT EXISTS '\
+               'byte_offset BIGINT;\n'\
+               .format(journal_schema, journal_full_table_name)
+
+    @staticmethod
+    def start():
+        '''Return the time at which the upload of a file starts, to be passed
+        to record'''
+
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def members(self, cur):
+        '''Return a dict giving the CRC, status, byte offset and row count
+        recorded for each member of the archive in the journal, fetched using
+        the cursor cur. The CRC is None for a file that is not in a .zip
+        archive. The byte offset is the number of bytes of a member that
+        have been committed, if it has only been partly uploaded.'''
+
+        cur.execute('SELECT member, crc, status, byte_offset, row_count '
+                    'FROM {} WHERE archive = %s;'
+                    .format(journal_full_table_name), (self.archive, ))
+        return {row[0]: tuple(row[1:]) for row in cur.fetchall()}
+
+    def record(self, cur, member, crc, table_name, row_count, status,
+               started, message=None, byte_offset=None):
+        '''Record the upload of a member of the archive that started at the
+        time started (see start) using the cursor cur, replacing any earlier
+        record of it. byte_offset can give the number of bytes of the member
+        that have been committed.'''
+
+        seconds = (datetime.datetime.now(datetime.timezone.utc) -
+                   started).total_seconds()
+
+        cur.execute('INSERT INTO {} (archive, member, crc, table_name, '
+                    'row_count, status, message, started, seconds, '
+                    'byte_offset)\n'
+                    'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)\n'
+                    'ON CONFLICT (archive, member) DO UPDATE SET\n'
+                    '    crc = EXCLUDED.crc, '
+                    'table_name = EXCLUDED.table_name,\n'
+                    '    row_count = EXCLUDED.row_count, '
+                    'status = EXCLUDED.status,\n'
+                    '    message = EXCLUDED.message, '
+                    'started = EXCLUDED.started,\n'
+                    '    seconds = EXCLUDED.seconds, '
+                    'byte_offset = EXCLUDED.byte_offset;'
+                    .format(journal_full_table_name),
+                    (self.archive, member, crc, table_name, row_count,
+                     status, message, started, seconds, byte_offset))
@@ -0,0 +1,160 @@
+# gazetteer.metrics
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Timers and counters that measure the throughput of an upload, with a live
+progress line and a machine-readable report.'''
+
+import contextlib
+import datetime
+import io
+import json
+import threading
+import time
+
+from .streams import MeasuredStream
+
+
+class LoadMetrics:
+    '''This class collects the time spent in each phase of an upload and the
+    amount of data read from each file. Phases can be attributed to a file
+    or table, and the totals for each phase are also kept. If progress is a
+    text file object, a progress line is written to it at most once every
+    interval seconds. All methods can be used from multiple threads.'''
+
+    def __init__(self, progress=None, interval=1.0):
+        self.progress = progress
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.started = datetime.datetime.now()
+        self.start_time = time.perf_counter()
+        self.last_progress = self.start_time
+        self.phases = {}
+        self.items = {}
+        self.total_bytes = 0
+        self.total_lines = 0
+
+    def _item(self, name):
+        if name not in self.items:
+            self.items[name] = {'name': name, 'bytes': 0, 'lines': 0,
+                                'read_seconds': 0.0, 'phases': {}}
+        return self.items[name]
+
+    @contextlib.contextmanager
+    def phase(self, phase, name=None):
+        '''A context manager that times a phase of the upload, optionally
+        attributing it to the file or table name'''
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+                if name is not None:
+                    phases = self._item(name)['phases']
+                    phases[phase] = phases.get(phase, 0.0) + elapsed
+
+    def measure(self, fileobj, name):
+        '''Return a buffered binary file object that reads from fileobj and
+        counts the data read against name'''
+
+        with self.lock:
+            self._item(name)
+
+        return io.BufferedReader(MeasuredStream(fileobj, name, self))
+
+    def count(self, name, size, lines, read_seconds):
+        '''Record that size bytes containing the given number of lines were
+        read for name, taking read_seconds'''
+
+        with self.lock:
+            item = self._item(name)
+            item['bytes'] += size
+            item['lines'] += lines
+            item['read_seconds'] += read_seconds
+            self.total_bytes += size
+            self.total_lines += lines
+
+            now = time.perf_counter()
+            if self.progress is not None and \
+                    now - self.last_progress >= self.interval:
+                self.last_progress = now
+                self._write_progress(now)
+
+    def set_info(self, name, **kwargs):
+        '''Record extra information such as the destination table for name.
+        If header_lines is given, that many lines are not counted as rows.'''
+
+        with self.lock:
+            self._item(name).update(kwargs)
+
+    def _write_progress(self, now):
+        elapsed = now - self.start_time
+        self.progress.write('\r{:,} lines, {:.1f} MB, {:,.0f} lines/s, '
+                            '{:.2f} MB/s   '
+                            .format(self.total_lines,
+                                    self.total_bytes / 1e6,
+                                    self.total_lines / elapsed,
+                                    self.total_bytes / 1e6 / elapsed))
+        self.progress.flush()
+
+    def finish_progress(self):
+        '''Write a final progress line and end it'''
+
+        if self.progress is not None:
+            with self.lock:
+                self._write_progress(time.perf_counter())
+            self.progress.write('\n')
+            self.progress.flush()
+
+    def report(self):
+        '''Return a dict summarising the upload, suitable for JSON output'''
+
+        with self.lock:
+            elapsed = time.perf_counter() - self.start_time
+            items = []
+            for i in self.items.values():
+                item = dict(i, phases=dict(i['phases']))
+                if 'header_lines' in item:
+                    item['rows'] = max(item['lines'] -
+                                       item.pop('header_lines'), 0)
+                copy_seconds = item['phases'].get('copy')
+                if copy_seconds and 'rows' in item:
+                    item['rows_per_second'] = item['rows'] / copy_seconds
+                    item['mb_per_second'] = item['bytes'] / 1e6 / copy_seconds
+                    item['server_seconds'] = \
+                        max(copy_seconds - item['read_seconds'], 0.0)
+                items.append(item)
+
+            return {'started': self.started.isoformat(),
+                    'elapsed_seconds': elapsed,
+                    'bytes': self.total_bytes,
+                    'lines': self.total_lines,
+                    'lines_per_second': self.total_lines / elapsed,
+                    'mb_per_second': self.total_bytes / 1e6 / elapsed,
+                    'phases': dict(self.phases),
+                    'items': items}
+
+    def write_report(self, fileobj):
+        '''Write the report to the text file object fileobj as JSON'''
+
+        json.dump(self.report(), fileobj, indent=2)
+        fileobj.write('\n')
@@ -20,15 +20,40 @@
 
 ''' mockdb.py - a mock DB API connection and cursor definition'''
 
+import csv
+import re
 import sys
+import time
+
+from .staging import StagingTable
+from .streams import csv_quote_state
+
+
+class DataError(Exception):
+    '''An exception raised when data sent to the mock database does not have
+    the expected number of fields'''
+
+    pass
+
+
+copy_table_re = re.compile(r'COPY\s+(\S+)\s+FROM\s+STDIN', re.IGNORECASE)
+copy_option_re = re.compile(r"(FORMAT|DELIMITER|QUOTE|ESCAPE)\s+'?(\w+|[^']*)",
+                            re.IGNORECASE)
+text_escape_re = re.compile(rb'\\.', re.DOTALL)
+like_table_re = re.compile(r'CREATE\s+TEMPORARY\s+TABLE\s+(\S+)\s+'
+                           r'\(LIKE\s+([^\s)]+)(\s+INCLUDING\s+GENERATED)?\)',
+                           re.IGNORECASE)
+add_column_re = re.compile(r'ALTER\s+TABLE\s+(\S+)\s+ADD\s+COLUMN\s',
+                           re.IGNORECASE)
 
 
 class Cursor(object):
     '''A dummy database cursor object that implements a subset of DB-API
     methods and outputs the requests to a file or stdout.'''
 
-    def __init__(self, log_file=sys.stdout):
+    def __init__(self, log_file=sys.stdout, connection=None):
         self.log_file = log_file
+        self.connection = connection
 
     def __enter__(self):
         return self
@@ -41,6 +66,9 @@ class Cursor(object):
 
         self.log_file.write("Executed SQL: '{}' with params '{}'\n"
                             .format(sql, repr(params)))
+        if self.connection is not None:
+            self.connection.record_tables(sql)
+            self.connection.wait()
 
     def copy_from(self, file, table, sep='\t',
                   null='\\N', size=8192, columns=None):
@@ -54,6 +82,13 @@ class Cursor(object):
                                     repr((sep, null, size, columns)))
                             )
 
+        if self.connection is not None and self.connection.consume:
+            if columns is not None:
+                field_count = len(columns)
+            else:
+                field_count = self.connection.field_count(table)
+            self._consume(file, size, table, sep.encode('ASCII'), field_count)
+
     def copy_expert(self, sql, file, size=8192):
         '''Log a request to execute a COPY command to upload bulk data. This
         is a Postgresql-specific command'''
@@ -65,6 +100,114 @@ class Cursor(object):
                                     repr(size))
                             )
 
+        match = copy_table_re.search(sql)
+        if self.connection is not None and self.connection.consume and match:
+            options = dict((k.upper(), v) for k, v in
+                           copy_option_re.findall(sql))
+            csv_mode = options.get('FORMAT', 'TEXT').upper() == 'CSV'
+            sep = options.get('DELIMITER', ',' if csv_mode else '\t')
+
+            if csv_mode:
+                quote = options.get('QUOTE', '"')
+                csv_options = {'quotechar': quote,
+                               'escapechar': options.get('ESCAPE', quote)}
+            else:
+                csv_options = None
+
+            self._consume(file, size, match.group(1), sep.encode('ASCII'),
+                          self.connection.field_count(match.group(1)),
+                          csv_options)
+
+    def _consume(self, file, size, table, sep, field_count,
+                 csv_options=None):
+        '''Read all of the data from file in chunks of size, counting the
+        bytes and rows and checking that each row has field_count fields if
+        it is not None. csv_options gives the quote and escape characters if
+        the data is in CSV format.'''
+
+        rows = 0
+        total = 0
+        partial = b''
+        in_quotes = False
+
+        if csv_options is not None:
+            quote = csv_options['quotechar'].encode('ASCII')
+            escape = csv_options['escapechar'].encode('ASCII')
+
+        while True:
+            data = file.read(size)
+            if not data:
+                break
+            if isinstance(data, str):
+                data = data.encode('UTF-8')
+
+            total += len(data)
+            self.connection.transfer(len(data))
+
+            if field_count is None and csv_options is None:
+                rows += data.count(b'\n')
+                partial = data[-1:].strip(b'\n')
+                continue
+
+            lines = (partial + data).split(b'\n')
+            partial = lines.pop()
+
+            for line in lines:
+                if csv_options is not None:
+                    record_start = not in_quotes
+                    in_quotes = csv_quote_state(line + b'\n', in_quotes,
+                                                quote, escape)
+                    if record_start:
+                        record = []
+                    record.append(line)
+                    if in_quotes:
+                        continue
+                    line = b'\n'.join(record)
+
+                rows += 1
+                if field_count is not None:
+                    self._check_fields(line, sep, field_count, csv_options,
+                                       table, rows)
+
+        if partial:
+            rows += 1
+            if field_count is not None and partial.strip(b'\r'):
+                self._check_fields(partial, sep, field_count, csv_options,
+                                   table, rows)
+
+        self.connection.record_copy(rows, total)
+        self.log_file.write("Consumed {} rows and {} bytes\n"
+                            .format(rows, total))
+
+    @staticmethod
+    def _check_fields(line, sep, field_count, csv_options, table, row):
+        '''Raise DataError if a row does not have the expected number of
+        fields'''
+
+        line = line.rstrip(b'\r')
+
+        if csv_options is None:
+            fields = text_escape_re.sub(b'', line).count(sep) + 1
+        else:
+            fields = len(next(csv.reader(
+                [line.decode('ISO-8859-1')], delimiter=sep.decode('ASCII'),
+                doublequote=csv_options['quotechar'] ==
+                csv_options['escapechar'], **csv_options)))
+
+        if fields != field_count:
+            raise DataError('COPY to {}, row {}: expected {} fields but found '
+                            '{}'.format(table, row, field_count, fields))
+
+    def fetchone(self):
+        '''Return None, as there are never any query results'''
+
+        return None
+
+    def fetchall(self):
+        '''Return an empty list, as there are never any query results'''
+
+        return []
+
     def close(self):
         '''Close the dummy database cursor object. Does not close the
         associated output file.'''
@@ -74,11 +217,27 @@ class Cursor(object):
 
 class Connection(object):
     '''A dummy database object that implements a subset of DB-API methods and
-    outputs the requests to a file or stdout.'''
+    outputs the requests to a file or stdout. If consume is set, the data
+    passed to COPY commands is read in full and the rows and bytes are
+    counted. If tables is a dict of GazetteerTable objects, the number of
+    fields in each row copied to one of them is also checked, as it is for
+    temporary tables created LIKE one of them. geography indicates that the
+    tables have PostGIS geography columns, as created by gazetteer_schema.py
+    --postgis. latency is the time in seconds to wait after each statement
+    and bandwidth is the rate in bytes per second at which data is read.'''
 
-    def __init__(self, log_file=sys.stdout):
+    def __init__(self, log_file=sys.stdout, consume=False, tables=None,
+                 latency=0.0, bandwidth=None, geography=False):
         self.log_file = log_file
         self._autocommit = False
+        self.consume = consume or tables is not None or bool(bandwidth)
+        self.tables = tables
+        self.geography = geography
+        self.temporary_tables = {}
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.copy_rows = 0
+        self.copy_bytes = 0
 
     def set_autocommit(self, value):
         '''Log an attempt to change the autocommit mode of the mock database
@@ -93,13 +252,99 @@ class Connection(object):
     def cursor(self):
         '''Create a dummy cursor which uses the same output file.'''
 
-        return Cursor(self.log_file)
+        return Cursor(self.log_file, self)
 
     def commit(self):
         '''Log a request to commit a transaction.'''
 
         self.log_file.write("Committed transaction\n")
         self.log_file.flush()
+        self.wait()
+
+    def rollback(self):
+        '''Log a request to roll back a transaction.'''
+
+        self.log_file.write("Rolled back transaction\n")
+        self.log_file.flush()
+        self.wait()
+
+    def wait(self):
+        '''Simulate the round trip time for a statement'''
+
+        if self.latency:
+            time.sleep(self.latency)
+
+    def transfer(self, size):
+        '''Simulate the time taken to send size bytes to the server'''
+
+        if self.bandwidth:
+            time.sleep(size / self.bandwidth)
+
+    def record_copy(self, rows, size):
+        '''Add the rows and bytes read by a COPY to the totals for the
+        connection'''
+
+        self.copy_rows += rows
+        self.copy_bytes += size
+        self.wait()
+
+    def record_tables(self, sql):
+        '''Note the number of columns of any temporary tables created LIKE
+        another table by the SQL, and of any columns added to them. As in
+        PostgreSQL, a generated geography column is only generated in the
+        copy if INCLUDING GENERATED is given, and otherwise is an ordinary
+        column that a COPY without a column list expects data for.'''
+
+        if self.tables is None:
+            return
+
+        for match in like_table_re.finditer(sql):
+            field_count = self.field_count(match.group(2))
+            if field_count is not None and self.geography and \
+                    not match.group(3) and \
+                    self._table(match.group(2)).coordinates is not None:
+                field_count += 1
+            self.temporary_tables[match.group(1)] = field_count
+
+        for match in add_column_re.finditer(sql):
+            if self.temporary_tables.get(match.group(1)) is not None:
+                self.temporary_tables[match.group(1)] += 1
+
+    def _table(self, table):
+        '''Return the GazetteerTable for a table name, or None. A staging copy
+        of a table is described by the table, and a partition by the
+        partitioned table.'''
+
+        if table not in self.tables and table.endswith(StagingTable.suffix):
+            table = table[:-len(StagingTable.suffix)]
+
+        if table in self.tables:
+            return self.tables[table]
+
+        for i in self.tables.values():
+            if hasattr(i, 'partitions') and i.parent is None and \
+                    table in (j.full_table_name for j in i.partitions()):
+                return i
+
+        return None
+
+    def field_count(self, table):
+        '''Return the number of fields expected in a COPY to table, or None
+        if it is not known or is not to be checked. A staging copy of a
+        table, or a partition of it, expects the same number of fields as the
+        table.'''
+
+        if self.tables is None:
+            return None
+
+        if table in self.temporary_tables:
+            return self.temporary_tables[table]
+
+        gazetteer_table = self._table(table)
+        if gazetteer_table is not None:
+            return len(gazetteer_table.fields)
+
+        return None
 
     def close(self):
         '''Close the dummy database object. Closes the file associated with
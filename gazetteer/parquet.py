@@ -0,0 +1,159 @@
+# gazetteer.parquet
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Writing of gazetteer data to Parquet files, optionally partitioned by the
+value of one field in the directory layout used by Hive, Spark and DuckDB.
+This requires PyArrow and NumPy.'''
+
+import os
+import urllib.parse
+
+import pyarrow
+import pyarrow.compute
+import pyarrow.parquet
+
+null_partition = '__HIVE_DEFAULT_PARTITION__'
+
+
+def arrow_schema(table, exclude=()):
+    '''Return a PyArrow schema for the table, leaving out the fields whose SQL
+    names are in exclude'''
+
+    return pyarrow.schema(
+        [pyarrow.field(i.sql_name, pyarrow.type_for_alias(i.arrow_type_name),
+                       nullable=i.nullable)
+         for i in table.fields if i.sql_name not in exclude])
+
+
+def batch_to_arrow(batch, schema):
+    '''Return a PyArrow Table holding the columns of a ColumnBatch that are
+    named in the schema'''
+
+    return pyarrow.Table.from_arrays(
+        [pyarrow.array(batch.columns[i.name], type=i.type,
+                       mask=batch.masks[i.name])
+         for i in schema], schema=schema)
+
+
+class ParquetTableWriter:
+    '''This class writes batches of data for a GazetteerTable to Parquet files
+    in a directory. If partition_by is the name of a field, there is a
+    subdirectory for each of its values and the field itself is not stored in
+    the files. Rows are buffered until there are row_group_rows for a
+    partition, so that each row group is of a useful size. If the total
+    number of rows buffered exceeds max_buffered_rows, the largest buffer is
+    written out early to keep the memory used bounded.'''
+
+    def __init__(self, table, directory, partition_by=None,
+                 row_group_rows=131072, compression='zstd',
+                 max_buffered_rows=1048576):
+        self.table = table
+        self.directory = directory
+        self.row_group_rows = row_group_rows
+        self.compression = compression
+        self.max_buffered_rows = max_buffered_rows
+
+        self.partition_field = None
+        if partition_by is not None:
+            for i in table.fields:
+                if partition_by.lower() in (i.field_name.lower(), i.sql_name):
+                    self.partition_field = i
+
+        self.schema = arrow_schema(table)
+        if self.partition_field is not None:
+            self.file_schema = arrow_schema(
+                table, exclude=(self.partition_field.sql_name, ))
+        else:
+            self.file_schema = self.schema
+
+        self.writers = {}
+        self.buffers = {}
+        self.buffered_rows = 0
+        self.rows_written = 0
+
+    def _path(self, partition):
+        if self.partition_field is None:
+            directory = self.directory
+        else:
+            if partition is None:
+                value = null_partition
+            else:
+                value = urllib.parse.quote(str(partition), safe=' ')
+            directory = os.path.join(self.directory, '{}={}'.format(
+                self.partition_field.sql_name, value))
+
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, 'part-0.parquet')
+
+    def write_batch(self, batch):
+        '''Add the rows in a ColumnBatch to the output'''
+
+        data = batch_to_arrow(batch, self.schema)
+
+        if self.partition_field is None:
+            self._buffer(None, data)
+        else:
+            column = data.column(self.partition_field.sql_name)
+            data = data.drop_columns([self.partition_field.sql_name])
+
+            for value in pyarrow.compute.unique(column).to_pylist():
+                if value is None:
+                    selected = pyarrow.compute.is_null(column)
+                else:
+                    selected = pyarrow.compute.equal(column, value)
+                self._buffer(value, data.filter(selected))
+
+        while self.buffered_rows > self.max_buffered_rows:
+            self._flush(max(self.buffers,
+                            key=lambda x: sum(len(i) for i in
+                                              self.buffers[x])))
+
+    def _buffer(self, partition, data):
+        buffer = self.buffers.setdefault(partition, [])
+        buffer.append(data)
+        self.buffered_rows += len(data)
+
+        if sum(len(i) for i in buffer) >= self.row_group_rows:
+            self._flush(partition)
+
+    def _flush(self, partition):
+        '''Write out the rows buffered for a partition'''
+
+        data = pyarrow.concat_tables(self.buffers.pop(partition))
+        self.buffered_rows -= len(data)
+
+        if partition not in self.writers:
+            self.writers[partition] = pyarrow.parquet.ParquetWriter(
+                self._path(partition), self.file_schema,
+                compression=self.compression)
+
+        self.writers[partition].write_table(data,
+                                            row_group_size=self.row_group_rows)
+        self.rows_written += len(data)
+
+    def close(self):
+        '''Write out any buffered rows and close the files'''
+
+        for partition in list(self.buffers):
+            self._flush(partition)
+
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
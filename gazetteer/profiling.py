@@ -0,0 +1,259 @@
+# gazetteer.profiling
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Profiling of the values in gazetteer data files, to find the narrowest
+field types that can hold the data. The files are streamed, so only a small
+summary of each column is kept in memory, with the number of distinct values
+estimated by a HyperLogLog sketch.'''
+
+import copy
+import hashlib
+import math
+
+from .columnar import iter_rows
+from .fields import BigIntField, IntegerField, SmallIntField
+from .fields import DoubleField, RealField, TextField, FixedTextField
+from .fields import FlagField, CharField
+
+# Text fields whose values are no longer than this are treated as codes and
+# given a fixed width
+
+code_width = 8
+
+# The number of significant decimal digits that a REAL always holds exactly
+
+real_digits = 6
+
+integer_types = ((SmallIntField, -2**15, 2**15 - 1),
+                 (IntegerField, -2**31, 2**31 - 1),
+                 (BigIntField, -2**63, 2**63 - 1))
+
+integer_fields = tuple(i[0] for i in integer_types)
+
+
+class HyperLogLog:
+    '''A HyperLogLog sketch that estimates the number of distinct strings
+    added to it, using 2**precision one-byte registers. The standard error
+    of the estimate is about 1.04 / sqrt(2**precision), or 1.6% with the
+    default precision.'''
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        '''Add a string to the sketch'''
+
+        value_hash = int.from_bytes(
+            hashlib.blake2b(value.encode('UTF-8'), digest_size=8).digest(),
+            'big')
+        bits = 64 - self.precision
+        index = value_hash >> bits
+        rank = bits - (value_hash & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        '''Return the estimated number of distinct strings added'''
+
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / \
+            sum(2.0 ** -i for i in self.registers)
+
+        # Small numbers are estimated more accurately from the number of
+        # registers still empty
+
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+
+        return int(round(estimate))
+
+
+def significant_digits(value):
+    '''Return the number of significant decimal digits in a number written
+    as a string, or a large number if it is in exponent form or is not
+    finite'''
+
+    text = value.strip().lstrip('+-').lower()
+    if 'e' in text or 'n' in text:
+        return 17
+    if '.' in text:
+        text = text.rstrip('0')
+    return max(len(text.replace('.', '').lstrip('0')), 1)
+
+
+class ColumnProfile:
+    '''A summary of the values in one field of a data file: the number of
+    rows and NULL values, the minimum and maximum values (compared as numbers
+    for numeric fields and as text otherwise), the maximum length, the
+    estimated number of distinct values and the number of values that could
+    not be read as the type of the field.'''
+
+    def __init__(self, field):
+        self.field = field
+        self.rows = 0
+        self.nulls = 0
+        self.invalid = 0
+        self.minimum = None
+        self.maximum = None
+        self.max_length = 0
+        self.max_digits = 0
+        self.ascii = True
+        self.distinct = HyperLogLog()
+
+        if isinstance(field, integer_fields):
+            self.parse = int
+        elif isinstance(field, DoubleField):
+            self.parse = float
+        elif isinstance(field, (TextField, FixedTextField, FlagField,
+                                CharField)):
+            self.parse = str
+        else:
+            self.parse = None
+
+    def add(self, value):
+        '''Add a value from the data file, where an empty string is NULL'''
+
+        self.rows += 1
+        if value == '':
+            self.nulls += 1
+            return
+
+        self.distinct.add(value)
+        self.max_length = max(self.max_length, len(value))
+        if self.ascii and not value.isascii():
+            self.ascii = False
+
+        if self.parse is None:
+            return
+
+        try:
+            parsed = self.parse(value)
+        except ValueError:
+            self.invalid += 1
+            return
+
+        if self.parse is float:
+            if not math.isfinite(parsed):
+                self.invalid += 1
+                return
+            self.max_digits = max(self.max_digits, significant_digits(value))
+
+        if self.minimum is None or parsed < self.minimum:
+            self.minimum = parsed
+        if self.maximum is None or parsed > self.maximum:
+            self.maximum = parsed
+
+    def cardinality(self):
+        '''Return the estimated number of distinct values, other than NULL'''
+
+        return min(self.distinct.count(), self.rows - self.nulls)
+
+    def null_rate(self):
+        '''Return the fraction of the values that are NULL'''
+
+        return self.nulls / self.rows if self.rows else 0.0
+
+    def recommend(self):
+        '''Return the narrowest field that can hold all of the values seen,
+        which is the original field if no narrower one is safe'''
+
+        field = self.field
+        if self.rows == self.nulls or self.invalid:
+            return field
+
+        if isinstance(field, integer_fields):
+            for field_type, low, high in integer_types:
+                if low <= self.minimum and self.maximum <= high:
+                    if isinstance(field, field_type):
+                        return field
+                    return field_type(field.field_name, field.sql_name,
+                                      field.nullable)
+
+        elif isinstance(field, DoubleField):
+            if self.max_digits <= real_digits and \
+                    not isinstance(field, RealField):
+                return RealField(field.field_name, field.sql_name,
+                                 field.nullable)
+
+        elif self.parse is str:
+            if self.max_length == 1 and self.ascii:
+                if isinstance(field, CharField):
+                    return field
+                return CharField(field.field_name, field.sql_name,
+                                 field.nullable)
+            if isinstance(field, TextField) and \
+                    self.max_length <= code_width:
+                return FixedTextField(field.field_name, self.max_length,
+                                      field.sql_name, field.nullable)
+
+        return field
+
+
+class TableProfile:
+    '''A summary of the values in each field of the data files for a
+    table'''
+
+    def __init__(self, table):
+        self.table = table
+        self.files = 0
+        self.rows = 0
+        self.columns = [ColumnProfile(i) for i in table.fields]
+
+    def add_file(self, fileobj, header=True):
+        '''Add the rows of the binary file object fileobj. Raise ValueError
+        if the file does not match the table.'''
+
+        self.files += 1
+        for row in iter_rows(self.table, fileobj, header):
+            self.rows += 1
+            for column, value in zip(self.columns, row):
+                column.add(value)
+
+    def recommended_fields(self):
+        '''Return a tuple of the narrowest fields that can hold the data'''
+
+        return tuple(i.recommend() for i in self.columns)
+
+    def recommended_table(self):
+        '''Return a copy of the table with the recommended fields'''
+
+        result = copy.copy(self.table)
+        result.fields = self.recommended_fields()
+        return result
+
+    def generate_alter_sql(self):
+        '''Return the SQL that changes the type of each field of the table in
+        the database that has a narrower recommended type, or None if there
+        are none. Values that do not fit the new types cause an error rather
+        than being truncated.'''
+
+        changes = []
+        for old, new in zip(self.table.fields, self.recommended_fields()):
+            if new is not old:
+                changes.append('ALTER COLUMN {0} TYPE {1} USING {0}::{1}'
+                               .format(new.sql_name, new.sql_type()))
+
+        if not changes:
+            return None
+
+        return 'ALTER TABLE {}\n    {};\n'.format(
+            self.table.full_table_name, ',\n    '.join(changes))
@@ -0,0 +1,213 @@
+# gazetteer.projection
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Load profiles, which upload only some of the fields of a table and only
+the rows that have particular values in some of the fields. The fields left
+out are removed from the table and from the data as it is streamed, so they
+never reach the database.'''
+
+import copy
+import io
+import json
+import locale
+import re
+
+from .indexes import GazetteerForeignKey
+from .streams import RecordStream
+from .tables import GazetteerTableDuplicate
+
+
+def read_load_profiles(fileobj):
+    '''Return a list of LoadProfile objects read from a JSON text file object.
+    The file holds an object with a member for each table, named as
+    SCHEMA.TABLE, with optional "columns", "exclude" and "where" members as
+    described for LoadProfile. Raise ValueError if the file is not valid.'''
+
+    data = json.load(fileobj)
+    if not isinstance(data, dict):
+        raise ValueError('A load profile file must hold a JSON object')
+
+    result = []
+    for name, options in data.items():
+        if not isinstance(options, dict) or \
+                not set(options) <= {'columns', 'exclude', 'where'}:
+            raise ValueError('The load profile for {} may only have '
+                             '"columns", "exclude" and "where" members'
+                             .format(name))
+        result.append(LoadProfile(name, options.get('columns'),
+                                  options.get('exclude', ()),
+                                  options.get('where')))
+    return result
+
+
+class LoadProfile:
+    '''This class describes which parts of the data for the table
+    full_table_name are uploaded. columns can list the SQL names of the
+    fields to keep, in which case the others are left out, and exclude can
+    list fields to leave out. where can map SQL field names to a list of
+    values, and only rows that have one of the values in each of these
+    fields are kept. Fields in the primary key or that partition the table
+    cannot be left out.'''
+
+    def __init__(self, full_table_name, columns=None, exclude=(), where=None):
+        self.full_table_name = full_table_name
+        self.columns = None if columns is None else \
+            set(i.lower() for i in columns)
+        self.exclude = set(i.lower() for i in exclude)
+        self.where = {}
+        for name, values in (where or {}).items():
+            if isinstance(values, str):
+                values = (values, )
+            self.where[name.lower()] = frozenset(str(i) for i in values)
+
+    def dropped_fields(self, table):
+        '''Return the set of the SQL names of the fields of the table that
+        are left out'''
+
+        return set(i.sql_name for i in table.fields
+                   if (self.columns is not None and
+                       i.sql_name not in self.columns) or
+                   i.sql_name in self.exclude)
+
+    def apply(self, table):
+        '''Return a copy of the table with only the fields kept, which reads
+        the data files with all of their fields (see filter). Raise
+        ValueError if the profile does not fit the table. A
+        GazetteerTableDuplicate is returned as it is.'''
+
+        if isinstance(table, GazetteerTableDuplicate):
+            return table
+
+        names = set(i.sql_name for i in table.fields)
+        unknown = ((self.columns or set()) | self.exclude |
+                   set(self.where)) - names
+        if unknown:
+            raise ValueError('{} has no fields named {}'.format(
+                table.full_table_name, ', '.join(sorted(unknown))))
+
+        dropped = self.dropped_fields(table)
+        required = set(i.strip().lower() for i in table.pk.split(',')
+                       if i.strip())
+        if getattr(table, 'partition_by', None):
+            required.add(table.partition_by.lower())
+        if dropped & required:
+            raise ValueError('The fields {} of {} are needed to identify or '
+                             'partition the rows, so cannot be left out'
+                             .format(', '.join(sorted(dropped & required)),
+                                     table.full_table_name))
+
+        result = copy.copy(table)
+        result.fields = tuple(i for i in table.fields
+                              if i.sql_name not in dropped)
+        result.file_fields = table.file_fields or table.fields
+        result.load_profile = self
+
+        if table.coordinates is not None and \
+                set(table.coordinates) & dropped:
+            result.coordinates = None
+        result.name_fields = tuple(i for i in table.name_fields
+                                   if i not in dropped)
+        result.dictionary_fields = {i: j for i, j
+                                    in table.dictionary_fields.items()
+                                    if i not in dropped}
+
+        if getattr(table, 'force_null', None) is not None:
+            force_null = [i.strip() for i in table.force_null.split(',')
+                          if i.strip().lower() not in dropped]
+            result.force_null = ', '.join(force_null) if force_null else None
+
+        return result
+
+    def uses_dropped_fields(self, table, index):
+        '''Return a Boolean that indicates if a GazetteerIndex or
+        GazetteerForeignKey refers to any of the fields of the table that are
+        left out'''
+
+        dropped = self.dropped_fields(table)
+        if not dropped:
+            return False
+
+        expressions = []
+        if index.full_table_name == table.full_table_name:
+            expressions.extend(index.columns)
+            if getattr(index, 'where', None) is not None:
+                expressions.append(index.where)
+        if isinstance(index, GazetteerForeignKey) and \
+                index.foreign_schema + '.' + index.foreign_table_name == \
+                table.full_table_name:
+            expressions.extend(index.foreign_columns)
+
+        dropped_re = re.compile(r'\b({})\b'.format('|'.join(
+            re.escape(i) for i in dropped)), re.IGNORECASE)
+        return any(dropped_re.search(i) for i in expressions)
+
+    def filter(self, table, fileobj, header=False):
+        '''Return a binary file object that gives the records in fileobj for
+        a table returned by apply, leaving out the rows that do not match and
+        the fields that are not kept. If header is set, the first line is a
+        header and is passed on unchanged. Records with the wrong number of
+        fields are also passed on unchanged, so that the database rejects
+        them.'''
+
+        sep = table.sep.encode('ASCII')
+        quote, escape = table.record_quoting()
+        encoding = table.encoding or locale.getpreferredencoding(False)
+
+        file_names = [i.sql_name for i in table.file_fields]
+        field_count = len(file_names)
+        keep = [file_names.index(i.sql_name) for i in table.fields]
+        if keep == list(range(field_count)):
+            keep = None
+
+        predicates = [(file_names.index(name),
+                       frozenset(i.encode(encoding) for i in values))
+                      for name, values in self.where.items()]
+        if quote is not None:
+            predicates = [(index, values |
+                           frozenset(quote_value(i, quote, escape)
+                                     for i in values))
+                          for index, values in predicates]
+
+        def records():
+            if header:
+                yield fileobj.readline()
+
+            for record in table.iter_records(fileobj):
+                fields = table.split_record(record.rstrip(b'\r\n'))
+                if len(fields) != field_count:
+                    yield record
+                elif all(fields[i] in values for i, values in predicates):
+                    if keep is None:
+                        yield record
+                    else:
+                        yield sep.join([fields[i] for i in keep]) + b'\n'
+
+        return io.BufferedReader(RecordStream(records(),
+                                              getattr(fileobj, 'name', None)))
+
+
+def quote_value(value, quote, escape):
+    '''Return a value (as bytes) as it appears in a CSV file when it is
+    quoted'''
+
+    if escape is None or escape == quote:
+        return quote + value.replace(quote, quote + quote) + quote
+    return quote + value.replace(escape, escape + escape) \
+        .replace(quote, escape + quote) + quote
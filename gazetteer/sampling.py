@@ -0,0 +1,245 @@
+# gazetteer.sampling
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Deterministic sampling of the rows in gazetteer data files, so that a
+small but representative database can be built quickly for development and
+testing. Rows can be sampled by a hash of a key field, which keeps the same
+keys in every table that has the field, or by taking every Nth row. The
+number of rows kept for each value of a field can also be capped. The rows
+that foreign keys refer to are kept, so that the foreign keys can still be
+built on the sample.'''
+
+import hashlib
+import io
+import threading
+
+from .streams import RecordStream
+
+
+class RowSampler:
+    '''This class selects the rows to keep from the records of any of the
+    tables. If fraction is given, a row is kept if the hash of its key field
+    falls in that fraction of the possible hashes. The key field is key if
+    the table has a field with that SQL name, and otherwise the first field
+    of the primary key, or the whole record if there is no primary key. If
+    every is given, every Nth row of each file is kept instead, starting with
+    the first. If stratum and cap are given, at most cap rows are kept for
+    each value of the field stratum in each table, counted across all of the
+    files uploaded. Tables can be uploaded in full, or have further fields
+    hashed, so that the rows that foreign keys refer to are kept (see
+    follow_foreign_keys). The sampler can be shared by several threads.'''
+
+    def __init__(self, fraction=None, every=None, key=None, stratum=None,
+                 cap=None):
+        if fraction is not None and every is not None:
+            raise ValueError('Rows can be sampled by a fraction of the keys '
+                             'or every Nth row, but not both')
+        if fraction is not None and not 0.0 < fraction <= 1.0:
+            raise ValueError('The fraction of keys to sample must be greater '
+                             'than 0 and no more than 1')
+        if every is not None and every < 1:
+            raise ValueError('The interval between sampled rows must be at '
+                             'least 1')
+        if cap is not None and cap < 0:
+            raise ValueError('The number of rows to keep for each value '
+                             'cannot be negative')
+
+        self.threshold = None if fraction is None else \
+            int(fraction * 2**64)
+        self.every = every
+        self.key = None if key is None else key.lower()
+        self.stratum = None if stratum is None else stratum.lower()
+        self.cap = cap
+
+        self.full_tables = set()
+        self.hashed_fields = {}
+
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def key_field(self, table):
+        '''Return the SQL name of the key field of the table, or None if the
+        whole record is hashed'''
+
+        names = [i.sql_name for i in table.fields]
+        if self.key in names:
+            return self.key
+
+        pk = table.pk.split(',')[0].strip().lower()
+        if pk in names:
+            return pk
+        return None
+
+    def follow_foreign_keys(self, tables, foreign_keys):
+        '''Choose how to sample the tables, given as a dict mapping their
+        names to GazetteerTable objects, so that the rows referred to by the
+        GazetteerForeignKey objects foreign_keys are kept. When rows are
+        sampled by their keys, a foreign key on a field of the primary key of
+        a table, whose rows belong to the row they refer to, is followed by
+        also hashing that field, so a row is only kept if the row it refers
+        to is. This needs the table referred to to be sampled on just the
+        field referred to. The tables referred to by any other foreign keys,
+        such as the tables of codes, are uploaded in full, as are the tables
+        that the rows of those tables refer to.'''
+
+        def referred(foreign_key):
+            return foreign_key.foreign_schema + '.' + \
+                foreign_key.foreign_table_name
+
+        foreign_keys = [i for i in foreign_keys
+                        if i.full_table_name in tables and
+                        referred(i) in tables]
+
+        def followed(foreign_key, full):
+            table = tables[foreign_key.full_table_name]
+            pk = [i.strip().lower() for i in table.pk.split(',')]
+            return self.threshold is not None and \
+                foreign_key.full_table_name not in full and \
+                referred(foreign_key) not in full and \
+                len(foreign_key.columns) == 1 and \
+                foreign_key.columns[0].lower() in pk
+
+        # Uploading a table in full can only mean that more tables must be
+        # uploaded in full, so this is repeated until no more are found
+
+        full = set()
+        while True:
+            hashed = {name: {self.key_field(table)}
+                      for name, table in tables.items()}
+            for i in foreign_keys:
+                if followed(i, full):
+                    hashed[i.full_table_name].add(i.columns[0].lower())
+
+            found = set()
+            for i in foreign_keys:
+                table = tables[referred(i)]
+                names = [j.sql_name for j in table.fields]
+                column = i.foreign_columns[0].lower()
+                if referred(i) not in full and not (
+                        followed(i, full) and
+                        len(i.foreign_columns) == 1 and
+                        hashed[referred(i)] == {column} and
+                        self.key_field(table) == column and
+                        (self.cap is None or self.stratum not in names)):
+                    found.add(referred(i))
+
+            if not found:
+                break
+            full |= found
+
+        self.full_tables = full
+        self.hashed_fields = {name: fields for name, fields in hashed.items()
+                              if name not in full}
+
+    def sampled(self, value):
+        '''Return a Boolean that indicates if a key value (as bytes) is in the
+        sample'''
+
+        value_hash = int.from_bytes(
+            hashlib.blake2b(value, digest_size=8).digest(), 'big')
+        return value_hash < self.threshold
+
+    def within_cap(self, table, value):
+        '''Return a Boolean that indicates if another row with a value (as
+        bytes) of the stratum field of the table can be kept, counting it if
+        so'''
+
+        stratum = ((table.parent or table).full_table_name, value)
+        with self.lock:
+            count = self.counts.get(stratum, 0)
+            if count >= self.cap:
+                return False
+            self.counts[stratum] = count + 1
+        return True
+
+    def filter(self, table, fileobj, header=False):
+        '''Return a binary file object that gives the records in fileobj
+        that are in the sample. If header is set, the first line is a header
+        and is passed on unchanged. Records with too few fields to find the
+        key or stratum are also passed on, so that the database rejects
+        them. The records of a table that is uploaded in full are all passed
+        on.'''
+
+        name = (table.parent or table).full_table_name
+        if name in self.full_tables:
+            return fileobj
+
+        quote, _ = table.record_quoting()
+
+        names = [i.sql_name for i in table.fields]
+        key = self.key_field(table)
+        key_index = None if key is None else names.index(key)
+        referring_indexes = [] if self.threshold is None else \
+            sorted(names.index(i)
+                   for i in self.hashed_fields.get(name, ())
+                   if i in names and i != key)
+        stratum_index = names.index(self.stratum) \
+            if self.cap is not None and self.stratum in names else None
+
+        indexes = list(referring_indexes)
+        if self.threshold is not None and key_index is not None:
+            indexes.append(key_index)
+        if stratum_index is not None:
+            indexes.append(stratum_index)
+
+        def value(fields, index):
+            result = fields[index].strip()
+            if quote is not None and len(result) >= 2 and \
+                    result.startswith(quote) and result.endswith(quote):
+                result = result[1:-1]
+            return result
+
+        def records():
+            if header:
+                yield fileobj.readline()
+
+            for number, record in enumerate(table.iter_records(fileobj)):
+                if self.every is not None and number % self.every:
+                    continue
+
+                line = record.rstrip(b'\r\n')
+                if indexes:
+                    fields = table.split_record(line)
+                    if max(indexes) >= len(fields):
+                        yield record
+                        continue
+
+                if self.threshold is not None and not self.sampled(
+                        line if key_index is None
+                        else value(fields, key_index)):
+                    continue
+
+                # The rows referred to by the other fields hashed must also
+                # be in the sample. Empty fields are NULL, so do not refer to
+                # a row.
+
+                if not all(value(fields, i) == b'' or
+                           self.sampled(value(fields, i))
+                           for i in referring_indexes):
+                    continue
+
+                if stratum_index is not None and not self.within_cap(
+                        table, value(fields, stratum_index)):
+                    continue
+
+                yield record
+
+        return io.BufferedReader(RecordStream(records(),
+                                              getattr(fileobj, 'name', None)))
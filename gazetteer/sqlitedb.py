@@ -0,0 +1,228 @@
+# gazetteer.sqlitedb
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Creation and loading of a single SQLite database file holding gazetteer
+data, for use where there is no PostgreSQL server. SQLite has no schemas, so
+each table is named SCHEMA_TABLE. As well as the B-tree indexes registered for
+each table, tables with coordinates can have an R*Tree index named
+SCHEMA_TABLE_rtree and tables with name fields an FTS5 index named
+SCHEMA_TABLE_fts. These refer to the rows of the table through an explicit
+INTEGER PRIMARY KEY column, as VACUUM can renumber an implicit rowid. Loading
+data requires NumPy.'''
+
+import re
+import sqlite3
+
+from .columnar import iter_batches
+
+# NumPy is only needed to load data
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+opclass_re = re.compile(r'\s+\w+_ops$')
+
+# The INTEGER PRIMARY KEY column added to each table, which is an alias for
+# its rowid that VACUUM keeps unchanged
+
+row_id_column = 'row_id'
+
+
+def connect(path, cache_mb=256):
+    '''Return a connection to the SQLite database in the file at path,
+    creating it if necessary. The connection does not start transactions
+    implicitly. The rollback journal and syncing to disk are switched off, as
+    the database is built in bulk and can be rebuilt from the original files,
+    so an upload that fails part way through can leave the database
+    corrupt.'''
+
+    connection = sqlite3.connect(path, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=OFF;')
+    connection.execute('PRAGMA synchronous=OFF;')
+    connection.execute('PRAGMA temp_store=MEMORY;')
+    connection.execute('PRAGMA cache_size={};'.format(-cache_mb * 1024))
+    return connection
+
+
+def table_name(table):
+    '''Return the name used in SQLite for a GazetteerTable or the table of a
+    GazetteerBTreeIndex'''
+
+    return table.schema + '_' + table.table_name
+
+
+def index_name(index):
+    '''Return the name used in SQLite for a GazetteerBTreeIndex, which must
+    be unique in the database rather than in its schema'''
+
+    return index.schema + '_' + index.name
+
+
+def generate_sql_ddl(table, if_not_exists=False):
+    '''Return the SQLite statement that creates the table. The PostgreSQL
+    types are mapped onto the SQLite storage classes, with dates and times
+    stored as ISO 8601 text. The first column is the row id that the R*Tree
+    and FTS5 indexes refer to, so the primary key of the table is declared as
+    a unique constraint.'''
+
+    columns = [row_id_column + ' INTEGER PRIMARY KEY']
+    columns += [i.sql_name + ' ' + i.sqlite_type_name +
+                ('' if i.nullable else ' NOT NULL') for i in table.fields]
+    if table.pk != '':
+        columns.append('UNIQUE({})'.format(table.pk))
+
+    return 'CREATE TABLE {}{} (\n    {}\n);'.format(
+        'IF NOT EXISTS ' if if_not_exists else '', table_name(table),
+        ',\n    '.join(columns))
+
+
+def generate_index_sql(index):
+    '''Return the SQLite statement that creates a GazetteerBTreeIndex. The
+    PostgreSQL operator classes and storage parameters are left out, as
+    SQLite can use any index on text for prefix searches where the collation
+    is suitable.'''
+
+    return 'CREATE {}INDEX IF NOT EXISTS {} ON {} (\n    {}\n){};'.format(
+        'UNIQUE ' if index.unique else '', index_name(index),
+        table_name(index),
+        ',\n    '.join(opclass_re.sub('', i) for i in index.columns),
+        '\n' + index.where if index.where is not None else '')
+
+
+def generate_drop_index_sql(index):
+    '''Return the SQLite statement that drops a GazetteerBTreeIndex'''
+
+    return 'DROP INDEX IF EXISTS {};'.format(index_name(index))
+
+
+def generate_search_sql(table):
+    '''Return a list of the SQLite statements that create and fill the
+    R*Tree and FTS5 indexes for the table, if it has coordinates or name
+    fields. The R*Tree index has an entry for each point, with its id equal
+    to the row id of the row in the table. Its bounds are stored as 32-bit
+    floating point numbers rounded outwards, so the coordinates in the table
+    should be checked for exact matches. The FTS5 index refers to the table
+    for its content, rather than holding another copy of the names.'''
+
+    name = table_name(table)
+    result = []
+
+    if table.coordinates is not None:
+        lat, long = table.coordinates
+        result.append('CREATE VIRTUAL TABLE {0}_rtree USING rtree(\n'
+                      '    id, min_lat, max_lat, min_long, max_long\n);'
+                      .format(name))
+        result.append('INSERT INTO {0}_rtree\n'
+                      '    SELECT {3}, {1}, {1}, {2}, {2} FROM {0}\n'
+                      '    WHERE {1} IS NOT NULL AND {2} IS NOT NULL;'
+                      .format(name, lat, long, row_id_column))
+
+    if table.name_fields:
+        result.append("CREATE VIRTUAL TABLE {0}_fts USING fts5(\n"
+                      "    {1},\n"
+                      "    content='{0}', content_rowid='{2}',\n"
+                      "    tokenize='unicode61 remove_diacritics 2'\n);"
+                      .format(name, ', '.join(table.name_fields),
+                              row_id_column))
+        result.append("INSERT INTO {0}_fts({0}_fts) VALUES ('rebuild');"
+                      .format(name))
+
+    return result
+
+
+def generate_drop_search_sql(table):
+    '''Return a list of the SQLite statements that drop the R*Tree and FTS5
+    indexes for the table'''
+
+    name = table_name(table)
+    return ['DROP TABLE IF EXISTS {}_rtree;'.format(name),
+            'DROP TABLE IF EXISTS {}_fts;'.format(name)]
+
+
+def search_indexes_exist(connection, table):
+    '''Return a Boolean that indicates if the table has an R*Tree or FTS5
+    index in the database'''
+
+    name = table_name(table)
+    cur = connection.execute(
+        "SELECT count(*) FROM sqlite_master WHERE type='table' AND "
+        "name IN (?, ?);", (name + '_rtree', name + '_fts'))
+    return cur.fetchone()[0] > 0
+
+
+def build_search_indexes(connection, table):
+    '''Drop and recreate the R*Tree and FTS5 indexes for the table. They are
+    not updated as data is loaded, so this must be done after every upload
+    to a table that has them.'''
+
+    for i in generate_drop_search_sql(table) + generate_search_sql(table):
+        connection.execute(i)
+
+
+def truncate_table(connection, table):
+    '''Delete all of the data in the table, along with its R*Tree and FTS5
+    indexes, which are rebuilt by build_search_indexes'''
+
+    for i in generate_drop_search_sql(table):
+        connection.execute(i)
+    connection.execute('DELETE FROM {};'.format(table_name(table)))
+
+
+def _sqlite_values(column, mask):
+    '''Return a NumPy column as a list of values that SQLite can store, with
+    None where the mask is set'''
+
+    if column.dtype.kind == 'M':
+        unit = 'auto'
+        if column.dtype == numpy.dtype('datetime64[us]') and \
+                (column.astype('datetime64[s]') == column)[~mask].all():
+            unit = 's'
+        column = numpy.char.replace(numpy.datetime_as_string(column, unit),
+                                    'T', ' ')
+
+    values = column.tolist()
+    for i in mask.nonzero()[0].tolist():
+        values[i] = None
+    return values
+
+
+def load_file(connection, table, fileobj, batch_rows=65536, header=True):
+    '''Insert the data in the binary file object fileobj into the table,
+    converting it in batches of batch_rows rows. The rows are inserted in
+    the current transaction, which should be a large one, as SQLite commits
+    are expensive. Return the number of rows inserted. Raise ValueError if
+    the data cannot be read or converted, or sqlite3.IntegrityError if it
+    does not fit the constraints on the table.'''
+
+    sql = 'INSERT INTO {} ({}) VALUES ({});'.format(
+        table_name(table), ', '.join(i.sql_name for i in table.fields),
+        ', '.join('?' for i in table.fields))
+    rows = 0
+
+    for batch in iter_batches(table, fileobj, batch_rows, header):
+        columns = [_sqlite_values(batch.columns[i.sql_name],
+                                  batch.masks[i.sql_name])
+                   for i in table.fields]
+        connection.executemany(sql, zip(*columns))
+        rows += batch.rows
+
+    return rows
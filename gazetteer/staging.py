@@ -0,0 +1,261 @@
+# gazetteer.staging
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Support for uploading data into staging copies of the gazetteer tables,
+which are then indexed and swapped in place of the live tables so that
+readers never see an empty or partially loaded table.'''
+
+import copy
+
+from .indexes import GazetteerIndex, GazetteerForeignKey
+
+
+class StagingTable:
+    '''This class defines an UNLOGGED staging copy of a GazetteerTable. Data
+    is uploaded to it without a primary key or indexes. Once the upload is
+    complete these are built, the table is switched to being logged and it
+    can then be swapped in place of the live table. If geography is set, the
+    table has a PostGIS geography column and an index on it, as created by
+    gazetteer_schema.py with --postgis. If dictionary is set, the table's
+    dictionary encoded fields hold keys and the view that decodes them is
+    recreated when the table is swapped. A partition of a
+    GazetteerPartitionedTable can be staged and swapped on its own, in which
+    case the indexes given should be those of the partitioned table. A whole
+    GazetteerPartitionedTable is staged as a staging copy of each partition,
+    attached to an empty partitioned table that routes the rows uploaded to
+    them. They are detached from it before they are indexed, and then each
+    is swapped in place of its partition.'''
+
+    suffix = '_staging'
+
+    def __init__(self, table, indexes=(), geography=False,
+                 dictionary=False):
+        self.table = table
+        self.geography = geography and table.coordinates is not None
+        self.dictionary = dictionary and bool(table.dictionary_fields)
+        self.schema = table.schema
+        self.table_name = table.table_name + self.suffix
+        self.full_table_name = table.full_table_name + self.suffix
+
+        # Only the indexes are built on the staging table. Foreign keys are
+        # added when the table is swapped in, as the names of the tables they
+        # refer to may change at the same time.
+
+        if self.geography:
+            indexes = list(indexes) + \
+                [(table.parent or table).geography_index(), ]
+
+        # The indexes on a partition are attached to the indexes on the
+        # partitioned table, so they need names of their own. They are named
+        # in the same way as PostgreSQL names the indexes it creates on the
+        # partitions.
+
+        self.indexes = []
+        for i in indexes:
+            if isinstance(i, GazetteerIndex):
+                if table.parent is not None:
+                    i = copy.copy(i)
+                    if i.name.startswith(table.parent.table_name + '_'):
+                        i.name = table.table_name + \
+                            i.name[len(table.parent.table_name):]
+                    else:
+                        i.name = table.table_name + '_' + i.name
+                    i.table_name = table.table_name
+                    i.full_table_name = table.full_table_name
+
+                staging_index = copy.copy(i)
+                staging_index.name = i.name + self.suffix
+                staging_index.table_name = self.table_name
+                staging_index.full_table_name = self.full_table_name
+                self.indexes.append((i, staging_index))
+
+        self.foreign_keys = [i for i in indexes
+                             if isinstance(i, GazetteerForeignKey)]
+
+        if table.parent is None and hasattr(table, 'partitions'):
+            self.partitions = [StagingTable(i, indexes, geography, dictionary)
+                               for i in table.partitions()]
+        else:
+            self.partitions = []
+
+    def generate_create_sql(self):
+        '''Return the SQL that will create an empty staging table, dropping
+        any left over from a previous failed upload.'''
+
+        if self.partitions:
+            result = 'DROP TABLE IF EXISTS {} CASCADE;\n'\
+                     .format(self.full_table_name)
+            for i in self.partitions:
+                result += i.generate_create_sql()
+            result += self.table.generate_sql_ddl(table_name=self.table_name,
+                                                  primary_key=False,
+                                                  geography=self.geography,
+                                                  dictionary=self.dictionary)
+            for i in self.partitions:
+                result += 'ALTER TABLE {0} ATTACH PARTITION {1}\n    {2};\n'\
+                          .format(self.full_table_name, i.full_table_name,
+                                  i.table.generate_bound_sql())
+            return result
+
+        return 'DROP TABLE IF EXISTS {} CASCADE;\n'\
+               .format(self.full_table_name) + \
+               self.table.generate_sql_ddl(table_name=self.table_name,
+                                           unlogged=True,
+                                           primary_key=False,
+                                           geography=self.geography,
+                                           dictionary=self.dictionary)
+
+    def generate_index_sql(self):
+        '''Return the SQL that will build the primary key and indexes on the
+        staging table and then make it a normal logged table. The staging
+        partitions of a partitioned table are first detached, and the table
+        that routed the rows to them is dropped.'''
+
+        if self.partitions:
+            result = ''
+            for i in self.partitions:
+                result += 'ALTER TABLE {} DETACH PARTITION {};\n'\
+                          .format(self.full_table_name, i.full_table_name)
+            result += 'DROP TABLE {};\n'.format(self.full_table_name)
+            for i in self.partitions:
+                result += i.generate_index_sql()
+            return result
+
+        result = ''
+
+        if self.table.pk != '':
+            result += 'ALTER TABLE {0} ADD CONSTRAINT {1}_pkey '\
+                      'PRIMARY KEY ({2});\n\n'.format(self.full_table_name,
+                                                      self.table_name,
+                                                      self.table.pk)
+
+        for _, staging_index in self.indexes:
+            result += staging_index.generate_sql()
+
+        result += 'ALTER TABLE {} SET LOGGED;\n'.format(self.full_table_name)
+
+        return result
+
+    def generate_swap_sql(self):
+        '''Return the SQL that will drop the live table and rename the staging
+        table and its indexes to take its place. The view that decodes any
+        dictionary encoded fields is dropped first and recreated afterwards.
+        Foreign keys that refer to the live table must already have been
+        dropped (see swap_staging_tables). Any other objects that depend on
+        the live table, such as views created by users, prevent it being
+        dropped, so the swap fails rather than silently dropping them. A
+        staging partition is instead attached to the partitioned table, and a
+        partitioned table is swapped one partition at a time. The foreign
+        keys of the partitioned table must already have been dropped, so
+        that attaching the partitions does not check their rows.'''
+
+        if self.partitions:
+            return ''.join(i.generate_swap_sql() for i in self.partitions)
+
+        result = ''
+
+        if self.table.parent is None and self.table.dictionary_fields:
+            result += 'DROP VIEW IF EXISTS {}_decoded;\n'\
+                      .format(self.table.full_table_name)
+
+        result += 'DROP TABLE IF EXISTS {};\n'\
+                  .format(self.table.full_table_name)
+
+        result += 'ALTER TABLE {0} RENAME TO {1};\n'\
+                  .format(self.full_table_name, self.table.table_name)
+
+        if self.table.pk != '':
+            result += 'ALTER TABLE {0} RENAME CONSTRAINT {1}_pkey TO '\
+                      '{2}_pkey;\n'.format(self.table.full_table_name,
+                                           self.table_name,
+                                           self.table.table_name)
+
+        for index, staging_index in self.indexes:
+            result += 'ALTER INDEX {0}.{1} RENAME TO {2};\n'\
+                      .format(self.schema, staging_index.name, index.name)
+
+        # The constraint added to a staging partition means that PostgreSQL
+        # does not need to check the data when it is attached
+
+        if self.table.parent is not None:
+            result += 'ALTER TABLE {0} ATTACH PARTITION {1}\n    {2};\n'\
+                      .format(self.table.parent.full_table_name,
+                              self.table.full_table_name,
+                              self.table.generate_bound_sql())
+            result += 'ALTER TABLE {0} DROP CONSTRAINT {1}_partition_check;\n'\
+                      .format(self.table.full_table_name, self.table_name)
+
+        elif self.dictionary:
+            result += self.table.generate_view_sql(self.geography)
+
+        return result
+
+
+def swap_staging_tables(staging_tables, foreign_keys, cur,
+                        partitioned_tables=()):
+    '''Swap a sequence of StagingTable objects in place of the live tables
+    using the cursor cur. foreign_keys is a sequence of all the known
+    GazetteerForeignKey objects, and partitioned_tables the names of the
+    partitioned tables. The foreign keys of the swapped tables are
+    recreated, as are any foreign keys on other tables that referred to the
+    live tables, which are dropped before the live tables. They are created
+    NOT VALID so the swap can be committed quickly, and a list of them is
+    returned so that they can be validated afterwards, once the new data is
+    live. PostgreSQL cannot create NOT VALID foreign keys on a partitioned
+    table, and would check the rows of each partition attached against its
+    foreign keys, so these are only dropped. A second list of them is
+    returned so that they can be created once the swap has been committed.
+    The two lists are returned as a tuple.'''
+
+    swapped = set(i.table.full_table_name for i in staging_tables)
+
+    affected_keys = [i for i in foreign_keys
+                     if i.full_table_name in swapped or
+                     i.foreign_schema + '.' + i.foreign_table_name in swapped]
+
+    # Note which of the foreign keys exist before anything is dropped.
+    # PostgreSQL folds the unquoted constraint names to lower case.
+
+    existing_keys = set()
+    for i in set(j.full_table_name for j in affected_keys):
+        cur.execute("SELECT conname FROM pg_constraint WHERE contype = 'f' "
+                    "AND conrelid = to_regclass(%s);", (i, ))
+        existing_keys.update((i, row[0]) for row in cur.fetchall())
+
+    for i in affected_keys:
+        if (i.full_table_name, i.name.lower()) in existing_keys:
+            cur.execute(i.generate_drop_sql())
+
+    for i in staging_tables:
+        cur.execute(i.generate_swap_sql())
+
+    recreated_keys = []
+    deferred_keys = []
+    for i in affected_keys:
+        if i.full_table_name in swapped or \
+                (i.full_table_name, i.name.lower()) in existing_keys:
+            if i.full_table_name in partitioned_tables:
+                deferred_keys.append(i)
+            else:
+                cur.execute(i.generate_sql(drop_existing=True,
+                                           not_valid=True))
+                recreated_keys.append(i)
+
+    return recreated_keys, deferred_keys
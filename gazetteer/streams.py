@@ -0,0 +1,357 @@
+# gazetteer.streams
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''File-like objects that sit between gazetteer data files and the database
+COPY command, rewriting or measuring the data as it is streamed.'''
+
+import io
+import re
+import time
+
+
+class SanitisedCopyStream:
+    '''A read-only file-like object that takes lines from a text file object
+    and rewrites them into valid PostgreSQL COPY text format. Backslashes are
+    escaped so they are not treated as escape characters, NUL bytes are
+    removed and empty fields are marked as NULL. Only one line at a time is
+    held in memory beyond the requested read size.'''
+
+    # Applied to each line before it is split into fields, so the NULL marker
+    # added afterwards is not itself escaped.
+    translation = str.maketrans({'\\': '\\\\',
+                                 '\x00': None,
+                                 '\r': '\\r',
+                                 '\n': '\\n'})
+
+    null = '\\N'
+
+    def __init__(self, fileobj, sep):
+        self.fileobj = fileobj
+        self.sep = sep
+        self.name = getattr(fileobj, 'name', repr(fileobj))
+        self._buffer = ''
+
+    def sanitise(self, line):
+        '''Return a single line of input rewritten in COPY text format'''
+
+        fields = line.rstrip('\r\n').translate(self.translation) \
+            .split(self.sep)
+
+        return self.sep.join(self.null if x.strip() == '' else x
+                             for x in fields) + '\n'
+
+    def read(self, size=-1):
+        '''Return up to size characters of sanitised data, or all of the
+        remaining data if size is negative'''
+
+        chunks = [self._buffer]
+        length = len(self._buffer)
+
+        while size < 0 or length < size:
+            line = self.fileobj.readline()
+            if not line:
+                break
+            line = self.sanitise(line)
+            chunks.append(line)
+            length += len(line)
+
+        data = ''.join(chunks)
+
+        if size < 0:
+            self._buffer = ''
+            return data
+
+        self._buffer = data[size:]
+        return data[:size]
+
+    def readline(self):
+        '''Return the next line of sanitised data'''
+
+        # Sanitised lines always end with a newline, so anything left in the
+        # buffer by read() is the end of a complete line.
+
+        if self._buffer:
+            line, _, self._buffer = self._buffer.partition('\n')
+            return line + '\n'
+
+        line = self.fileobj.readline()
+        return self.sanitise(line) if line else ''
+
+
+def csv_quote_state(data, in_quotes, quote=b'"', escape=b'\\'):
+    '''Return whether the end of the bytes data is inside a quoted CSV value,
+    given whether the start of it was. An escape character inside quotes
+    prevents a following quote or escape character being interpreted.'''
+
+    if escape is None or escape == quote:
+        # Doubled quotes toggle the state twice, so only the parity matters
+        return in_quotes ^ (data.count(quote) % 2 == 1)
+
+    pos = 0
+    while True:
+        next_quote = data.find(quote, pos)
+        if next_quote < 0:
+            return in_quotes
+
+        if in_quotes:
+            next_escape = data.find(escape, pos, next_quote)
+            if next_escape >= 0:
+                if data[next_escape+1:next_escape+2] in (quote, escape):
+                    pos = next_escape + 2
+                else:
+                    pos = next_escape + 1
+                continue
+
+        in_quotes = not in_quotes
+        pos = next_quote + 1
+
+
+def split_fields(record, sep, quote=None, escape=None, backslash=False):
+    '''Split a record (as bytes, without its line break) into a list of the
+    raw bytes of each field. If a quote character is given, separators
+    inside quoted values do not split them, as in CSV files. If backslash is
+    set, a backslash escapes the character after it, as in the COPY text
+    format, so an escaped separator does not split a field. Quotes and
+    escapes are left in place, so the fields can be joined again without
+    changing the record.'''
+
+    if backslash and b'\\' in record:
+        result = []
+        start = 0
+        for match in re.finditer(rb'\\.|' + re.escape(sep), record,
+                                 re.DOTALL):
+            if match.group() == sep:
+                result.append(record[start:match.start()])
+                start = match.end()
+        result.append(record[start:])
+        return result
+
+    pieces = record.split(sep)
+    if quote is None or quote not in record:
+        return pieces
+
+    result = []
+    in_quotes = False
+
+    for piece in pieces:
+        if in_quotes:
+            result[-1] += sep + piece
+        else:
+            result.append(piece)
+        if quote in piece:
+            in_quotes = csv_quote_state(piece, in_quotes, quote, escape)
+
+    return result
+
+
+def iter_records(fileobj, quote=None, escape=None):
+    '''Yield each record from the binary file object fileobj as bytes. If a
+    quote character is given, line breaks inside quoted values are assumed to
+    be part of the record, as in CSV files.'''
+
+    if quote is None:
+        yield from fileobj
+        return
+
+    record = []
+    in_quotes = False
+
+    for line in fileobj:
+        record.append(line)
+        if quote in line:
+            in_quotes = csv_quote_state(line, in_quotes, quote, escape)
+        if not in_quotes:
+            yield b''.join(record)
+            record = []
+
+    if record:
+        yield b''.join(record)
+
+
+def iter_chunks(records, max_rows=None, max_bytes=None, name=None):
+    '''Group an iterable of records (as bytes) into chunks of at most
+    max_rows records and at most max_bytes bytes, although a chunk always
+    holds at least one record. Yield a tuple for each chunk of a binary file
+    object that reads it, its size in bytes and the number of records in
+    it.'''
+
+    chunk = []
+    size = 0
+
+    for record in records:
+        if chunk and ((max_rows is not None and len(chunk) >= max_rows) or
+                      (max_bytes is not None and
+                       size + len(record) > max_bytes)):
+            yield io.BufferedReader(RecordStream(chunk, name)), size, \
+                len(chunk)
+            chunk = []
+            size = 0
+        chunk.append(record)
+        size += len(record)
+
+    if chunk:
+        yield io.BufferedReader(RecordStream(chunk, name)), size, len(chunk)
+
+
+def skip_bytes(fileobj, size):
+    '''Move the binary file object fileobj on by size bytes, seeking if
+    possible and otherwise reading and discarding the data'''
+
+    if fileobj.seekable():
+        fileobj.seek(size, io.SEEK_CUR)
+        return
+
+    while size > 0:
+        data = fileobj.read(min(size, 1024*1024))
+        if not data:
+            break
+        size -= len(data)
+
+
+def find_split_points(buf, start, parts, quote=None, escape=None):
+    '''Return a list of offsets that split the bytes in buf from start to the
+    end into roughly equal parts on record boundaries. The list begins with
+    start and ends with the length of buf. If a quote character is given, line
+    breaks inside quoted values are not treated as record boundaries. The
+    whole of buf is then scanned, so this is only suitable for CSV files of
+    moderate size.'''
+
+    length = len(buf)
+    result = [start, ]
+    in_quotes = False
+    pos = start
+
+    for i in range(1, parts):
+        target = start + (length - start) * i // parts
+        if target <= pos:
+            continue
+
+        newline = buf.find(b'\n', target)
+        if newline < 0:
+            break
+
+        if quote is not None:
+            in_quotes = csv_quote_state(buf[pos:newline+1], in_quotes,
+                                        quote, escape)
+            while in_quotes:
+                pos = newline + 1
+                newline = buf.find(b'\n', pos)
+                if newline < 0:
+                    break
+                in_quotes = csv_quote_state(buf[pos:newline+1], in_quotes,
+                                            quote, escape)
+            if newline < 0:
+                break
+
+        pos = newline + 1
+        if pos < length:
+            result.append(pos)
+
+    result.append(length)
+    return result
+
+
+class MemoryRange(io.RawIOBase):
+    '''A read-only raw binary stream over the bytes from start to end of a
+    buffer such as a mmap object. Wrap it in an io.BufferedReader (see
+    open_range) to get the full file object interface.'''
+
+    def __init__(self, buf, start, end, name=None):
+        super().__init__()
+        self.buf = buf
+        self.pos = start
+        self.end = end
+        self.name = name
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        size = min(len(b), self.end - self.pos)
+        b[:size] = self.buf[self.pos:self.pos+size]
+        self.pos += size
+        return size
+
+
+def open_range(buf, start, end, name=None):
+    '''Return a buffered binary file object that reads the bytes from start
+    to end of buf'''
+
+    return io.BufferedReader(MemoryRange(buf, start, end, name))
+
+
+class RecordStream(io.RawIOBase):
+    '''A read-only raw binary stream that returns the bytes from an iterable
+    of records in turn. Wrap it in an io.BufferedReader to get the full file
+    object interface.'''
+
+    def __init__(self, records, name=None):
+        super().__init__()
+        self.records = iter(records)
+        self.name = name
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        filled = 0
+
+        while filled < len(b):
+            if not self._pending:
+                try:
+                    self._pending = next(self.records)
+                except StopIteration:
+                    break
+
+            size = min(len(b) - filled, len(self._pending))
+            b[filled:filled+size] = self._pending[:size]
+            self._pending = self._pending[size:]
+            filled += size
+
+        return filled
+
+
+class MeasuredStream(io.RawIOBase):
+    '''A read-only raw binary stream that passes on the data from a binary
+    file object, reporting the bytes and lines read and the time spent waiting
+    for the underlying file object (for example, inflating a .zip member) to
+    the count method of a metrics object such as gazetteer.metrics.LoadMetrics
+    under the name item.'''
+
+    def __init__(self, fileobj, item, metrics):
+        super().__init__()
+        self.fileobj = fileobj
+        self.name = getattr(fileobj, 'name', None)
+        self.item = item
+        self.metrics = metrics
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        start = time.perf_counter()
+        data = self.fileobj.read(len(b))
+        elapsed = time.perf_counter() - start
+
+        size = len(data)
+        b[:size] = data
+        self.metrics.count(self.item, size, data.count(b'\n'), elapsed)
+        return size
@@ -21,15 +21,67 @@
 '''Descriptions of the tables in Gazetteer data files, along with information
 on generating appropriate SQL'''
 
+import codecs
+import copy
+import io
+import locale
 import re
 
+from .indexes import GazetteerGiSTIndex
+from .streams import SanitisedCopyStream, RecordStream, iter_records, \
+    find_split_points, split_fields
+
+
+# The PostgreSQL names of the Python encodings whose names PostgreSQL does not
+# recognise
+
+postgresql_encodings = {'ascii': 'SQL_ASCII', 'cp932': 'SJIS', 'cp936': 'GBK',
+                        'cp949': 'UHC', 'cp950': 'BIG5'}
+
+
+def postgresql_encoding(encoding):
+    '''Return the name that PostgreSQL uses for a Python encoding'''
+
+    name = codecs.lookup(encoding).name
+    if name in postgresql_encodings:
+        return postgresql_encodings[name]
+    if re.fullmatch(r'cp\d+', name):
+        return 'WIN' + name[2:]
+    return name
+
 
 class GazetteerTable:
     '''This class defines both a file that can be read, and a database table
-    that the data can be uploaded to.'''
+    that the data can be uploaded to. coordinates can give the SQL names of
+    the latitude and longitude fields in decimal degrees, and name_fields the
+    SQL names of the fields that hold place names, for use by spatial and
+    text search indexes. dictionary_fields can map the SQL names of text
+    fields with few distinct values to the SQL integer type used for their
+    keys if they are dictionary encoded (see generate_dictionary_sql). These
+    must not be part of the primary key, indexes or foreign keys.'''
+
+    geography_column = 'geog'
+    dictionary_key_suffix = '_id'
+    dictionary_fields = {}
+
+    # The table that this is a partition of, if any
+
+    parent = None
+
+    # The fields in the data files and the LoadProfile that selects the
+    # fields of the table from them, if only some of them are uploaded
+
+    file_fields = None
+    load_profile = None
+
+    # Whether a backslash in the data files escapes the character after it,
+    # as it does in the COPY text format
+
+    backslash_escapes = True
 
     def __init__(self, filename_regexp, schema, table_name,
-                 fields, pk, sep='|', encoding=None, datestyle='MDY'):
+                 fields, pk, sep='|', encoding=None, datestyle='MDY',
+                 coordinates=None, name_fields=(), dictionary_fields=None):
         self.filename_regexp = re.compile(filename_regexp)
         self.schema = schema
         self.table_name = table_name
@@ -39,6 +91,9 @@ class GazetteerTable:
         self.sep = sep
         self.encoding = encoding
         self.datestyle = datestyle
+        self.coordinates = coordinates
+        self.name_fields = name_fields
+        self.dictionary_fields = dict(dictionary_fields or {})
 
     def match_name(self, filename):
         '''Return a Boolean that indicates if the filename matches the pattern
@@ -50,15 +105,16 @@ class GazetteerTable:
         '''Return a Boolean value based on whether the provided header row
         matches the expectation in the code'''
 
+        fields = self.file_fields or self.fields
         columns = header.strip('\ufeff\n ').split(self.sep)
-        if len(columns) != len(self.fields):
+        if len(columns) != len(fields):
             if print_debug:
                 print('Wrong number of columns: {} expected : {}'
-                      .format(len(columns), len(self.fields)))
+                      .format(len(columns), len(fields)))
             return False
 
         for i in range(0, len(columns)):
-            if self.fields[i].field_name != columns[i].strip('" '):
+            if fields[i].field_name != columns[i].strip('" '):
                 if print_debug:
                     print('Unknown column name: {}'
                           .format(columns[i].strip('"')))
@@ -66,16 +122,40 @@ class GazetteerTable:
 
         return True
 
-    def generate_sql_ddl(self):
-        '''Return the SQL describing a table of this sort'''
-
-        result = 'CREATE TABLE {} (\n'.format(self.full_table_name)
-        for i in self.fields[:-1]:
-            result += '    ' + i.generate_sql() + ',\n'
-
-        result += '    ' + self.fields[-1].generate_sql()
-
-        if self.pk != '':
+    def generate_sql_ddl(self, table_name=None, unlogged=False,
+                         primary_key=True, if_not_exists=False,
+                         geography=False, dictionary=False):
+        '''Return the SQL describing a table of this sort. A different table
+        name in the same schema can be given, the table can be made UNLOGGED
+        and the primary key can be left out so it can be added later. If
+        geography is set and the table has coordinates, a PostGIS geography
+        column is added (see generate_geography_sql). If dictionary is set,
+        the dictionary encoded fields hold keys rather than values.'''
+
+        if table_name is None:
+            full_table_name = self.full_table_name
+        else:
+            full_table_name = self.schema + '.' + table_name
+
+        result = 'CREATE {}TABLE {}{} (\n'.format(
+            'UNLOGGED ' if unlogged else '',
+            'IF NOT EXISTS ' if if_not_exists else '',
+            full_table_name)
+        columns = []
+        for i in self.fields:
+            if dictionary and i.sql_name in self.dictionary_fields:
+                columns.append('{}{} {}{}'.format(
+                    i.sql_name, self.dictionary_key_suffix,
+                    self.dictionary_fields[i.sql_name],
+                    '' if i.nullable else ' NOT NULL'))
+            else:
+                columns.append(i.generate_sql())
+        if geography and self.coordinates is not None:
+            columns.append(self.generate_geography_sql())
+
+        result += '    ' + ',\n    '.join(columns)
+
+        if self.pk != '' and primary_key:
             result += ', \n    PRIMARY KEY({})\n'.format(self.pk)
         else:
             result += '\n'
@@ -83,27 +163,224 @@ class GazetteerTable:
         result += ');\n'
         return result
 
-    def copy_data(self, fileobj, cur):
-        '''Copy data from the file object fileobj to the database using the
-        cursor cur'''
+    def column_names(self, dictionary=False):
+        '''Return a list of the names of the columns that hold the fields in
+        the database, which for dictionary encoded fields are the columns
+        holding the keys if dictionary is set'''
+
+        return [i.sql_name + self.dictionary_key_suffix
+                if dictionary and i.sql_name in self.dictionary_fields
+                else i.sql_name for i in self.fields]
+
+    def dictionary_table_name(self, field):
+        '''Return the full name of the table holding the dictionary for a
+        dictionary encoded field, which is shared by all of the partitions of
+        a partitioned table'''
+
+        return '{}_{}_dict'.format((self.parent or self).full_table_name,
+                                   field.sql_name)
+
+    def generate_dictionary_sql(self):
+        '''Return the SQL that creates the tables holding the dictionaries for
+        the dictionary encoded fields if they do not already exist. Each
+        holds the distinct values of a field with the integer key stored in
+        the table in place of each.'''
+
+        result = ''
+        for i in self.fields:
+            if i.sql_name in self.dictionary_fields:
+                result += 'CREATE TABLE IF NOT EXISTS {} (\n'\
+                          '    id {} PRIMARY KEY,\n'\
+                          '    value {} NOT NULL UNIQUE\n);\n'\
+                          .format(self.dictionary_table_name(i),
+                                  self.dictionary_fields[i.sql_name],
+                                  i.sql_type())
+        return result
+
+    def generate_view_sql(self, geography=False):
+        '''Return the SQL that creates or replaces a view of a table with
+        dictionary encoded fields, named after the table with _decoded
+        appended, which has the same columns as the table would have without
+        the encoding'''
+
+        table = self.parent or self
+        columns = []
+        joins = ''
+
+        for i in self.fields:
+            if i.sql_name in self.dictionary_fields:
+                columns.append('{0}_dict.value AS {0}'.format(i.sql_name))
+                joins += '\nLEFT JOIN {0} {1}_dict ON {1}_dict.id = t.{1}{2}'\
+                         .format(self.dictionary_table_name(i), i.sql_name,
+                                 self.dictionary_key_suffix)
+            else:
+                columns.append('t.' + i.sql_name)
+        if geography and self.coordinates is not None:
+            columns.append('t.' + self.geography_column)
+
+        return 'CREATE OR REPLACE VIEW {0}_decoded AS\nSELECT {1}\n'\
+               'FROM {0} t{2};\n'.format(table.full_table_name,
+                                         ',\n    '.join(columns), joins)
+
+    def generate_geography_sql(self):
+        '''Return the SQL describing a PostGIS geography column holding the
+        coordinates of each row as a point. It is a generated column, so it
+        is filled in by PostgreSQL as the data is copied in and is left out
+        of COPY commands that do not list the columns.'''
+
+        latitude, longitude = self.coordinates
+        return '{} geography(Point, 4326) GENERATED ALWAYS AS '\
+               '(ST_SetSRID(ST_MakePoint({}, {}), 4326)::geography) STORED'\
+               .format(self.geography_column, longitude, latitude)
+
+    def geography_index(self, spgist=False):
+        '''Return a GazetteerGiSTIndex on the geography column of the
+        table'''
+
+        return GazetteerGiSTIndex(
+            name='{}_{}_idx'.format(self.table_name, self.geography_column),
+            schema=self.schema,
+            table_name=self.table_name,
+            columns=self.geography_column,
+            spgist=spgist)
+
+    def copy_encoding(self):
+        '''Return the encoding to give to COPY for the data files. If the
+        table does not specify one, the files are in the encoding of the
+        locale, which is what the header line is decoded with.'''
+
+        if self.encoding is not None:
+            return self.encoding
+        return postgresql_encoding(locale.getpreferredencoding(False))
+
+    def copy_data(self, fileobj, cur, target=None, freeze=False):
+        '''Copy data from the binary file object fileobj to the database using
+        the cursor cur. The raw bytes are sent to the server, which is told
+        the encoding of the file so no decoding is done in Python. The data
+        is copied to the table target if given, rather than to the table
+        itself. If freeze is set, the rows are loaded already frozen, which
+        is only possible if the table was created or truncated in the current
+        transaction.'''
 
         cur.execute('SET DATESTYLE=%s;', (self.datestyle, ))
 
-        cur.copy_from(
-            file=fileobj,
-            table=self.full_table_name,
-            sep=self.sep,
-            null=''
-            )
+        sql = '''COPY {} FROM STDIN WITH (FORMAT TEXT, DELIMITER '{}', ''' \
+              .format(target or self.full_table_name, self.sep)
+
+        sql += '''ENCODING '{}', '''.format(self.copy_encoding())
+
+        if freeze:
+            sql += 'FREEZE, '
+
+        sql += "NULL '');"
+
+        cur.copy_expert(sql=sql, file=fileobj)
+
+    def record_quoting(self):
+        '''Return the quote and escape characters (as bytes) that can make a
+        line break part of a record rather than the end of it, or None.'''
+
+        return None, None
+
+    def split_record(self, record):
+        '''Split a record (as bytes, without its line break) into a list of
+        the raw bytes of each field, taking account of any quotes or escapes
+        in the data files, which are left in place'''
+
+        quote, escape = self.record_quoting()
+        return split_fields(record, self.sep.encode('ASCII'), quote, escape,
+                            self.backslash_escapes)
+
+    def iter_records(self, fileobj):
+        '''Yield each record in the binary file object fileobj as bytes'''
+
+        quote, escape = self.record_quoting()
+        return iter_records(fileobj, quote, escape)
+
+    def find_split_points(self, buf, start, parts):
+        '''Return a list of offsets that split the data in buf from start
+        into the given number of parts on record boundaries'''
+
+        quote, escape = self.record_quoting()
+        return find_split_points(buf, start, parts, quote, escape)
+
+    def copy_data_tolerant(self, fileobj, cur, reject_file, chunk_rows=10000,
+                           target=None):
+        '''Copy data from the binary file object fileobj to the database using
+        the cursor cur, in chunks of chunk_rows records each protected by a
+        savepoint. A chunk that fails is split in half repeatedly until the
+        records responsible are found, and these are written to the binary
+        file object reject_file after a comment line giving the error. Return
+        the number of records rejected. The target table can be given as for
+        copy_data.'''
+
+        name = getattr(fileobj, 'name', repr(fileobj))
+        rejected = 0
+        chunk = []
+
+        for record in self.iter_records(fileobj):
+            chunk.append(record)
+            if len(chunk) == chunk_rows:
+                rejected += self._copy_chunk(chunk, name, cur, reject_file,
+                                             target)
+                chunk = []
+
+        if chunk:
+            rejected += self._copy_chunk(chunk, name, cur, reject_file, target)
+
+        return rejected
+
+    def _copy_chunk(self, records, name, cur, reject_file, target):
+        '''Copy a list of records inside a savepoint, bisecting the list if
+        the copy fails. Return the number of records rejected.'''
+
+        chunk_file = io.BytesIO(b''.join(records))
+        chunk_file.name = name
+
+        cur.execute('SAVEPOINT gazetteer_chunk;')
+
+        # The database module is not known here, so any exception is taken to
+        # mean the data was rejected. If the connection itself has failed, the
+        # ROLLBACK will raise in turn.
+
+        try:
+            self.copy_data(chunk_file, cur, target)
+        except Exception as err:
+            cur.execute('ROLLBACK TO SAVEPOINT gazetteer_chunk;')
+            cur.execute('RELEASE SAVEPOINT gazetteer_chunk;')
+
+            if len(records) == 1:
+                # The last record of a file may have no line break, which
+                # would join it to the next comment line
+
+                message = ' '.join(str(err).split())
+                record = records[0]
+                if not record.endswith(b'\n'):
+                    record += b'\n'
+                reject_file.write('# {}: {}\n'.format(name, message)
+                                  .encode('UTF-8') + record)
+                return 1
+
+            middle = len(records) // 2
+            return self._copy_chunk(records[:middle], name, cur,
+                                    reject_file, target) + \
+                self._copy_chunk(records[middle:], name, cur, reject_file,
+                                 target)
+
+        cur.execute('RELEASE SAVEPOINT gazetteer_chunk;')
+        return 0
 
 
 class GazetteerTableCSV(GazetteerTable):
     '''This is a child class of GazetteerTable that uses the CSV mode of
     PostgreSQL's copy command, for the few files that are provided as CSV.'''
 
+    backslash_escapes = False
+
     def __init__(self, filename_regexp, schema, table_name, fields, pk,
                  sep=',', escape='\\', quote='"', null=None, encoding=None,
-                 datestyle='MDY', force_null=None):
+                 datestyle='MDY', force_null=None, coordinates=None,
+                 name_fields=()):
         self.filename_regexp = re.compile(filename_regexp)
         self.schema = schema
         self.table_name = table_name
@@ -117,15 +394,18 @@ class GazetteerTableCSV(GazetteerTable):
         self.encoding = encoding
         self.datestyle = datestyle
         self.force_null = force_null
+        self.coordinates = coordinates
+        self.name_fields = name_fields
 
-    def copy_data(self, fileobj, cur):
-        '''Copy data from the file object fileobj to the database using the
-        cursor cur'''
+    def copy_data(self, fileobj, cur, target=None, freeze=False):
+        '''Copy data from the binary file object fileobj to the database using
+        the cursor cur, optionally to the table target and with the rows
+        frozen'''
 
         cur.execute('SET DATESTYLE=%s;', (self.datestyle, ))
 
         sql = '''COPY {} FROM STDIN WITH (FORMAT CSV, DELIMITER '{}', ''' \
-              .format(self.full_table_name, self.sep)
+              .format(target or self.full_table_name, self.sep)
 
         if self.null is not None:
             sql += '''NULL '{}', '''.format(self.null)
@@ -133,41 +413,215 @@ class GazetteerTableCSV(GazetteerTable):
         if self.force_null is not None:
             sql += '''FORCE_NULL ({}), '''.format(self.force_null)
 
+        sql += '''ENCODING '{}', '''.format(self.copy_encoding())
+
+        if freeze:
+            sql += 'FREEZE, '
+
         sql += ''' ESCAPE '{}', QUOTE '{}');'''.format(self.escape, self.quote)
 
         cur.copy_expert(sql=sql, file=fileobj)
 
+    def record_quoting(self):
+        return self.quote.encode('ASCII'), self.escape.encode('ASCII')
+
 
 class GazetteerTableInserted(GazetteerTable):
     '''This functions like the GazetteerTable, except that data is manually
-    split in Python and uploaded using a PREPAREd INSERT statement. This is
-    slower but works around files with dodgy characters that confuse
+    split in Python and rewritten into valid COPY text format as it is
+    streamed to the database. This is slower than passing the file straight
+    to COPY but works around files with dodgy characters that confuse
     PostgreSQL.'''
 
-    def copy_data(self, fileobj, cur):
-        '''Copy data from the file object fileobj to the database using the
-        cursor cur'''
+    backslash_escapes = False
+
+    def copy_data(self, fileobj, cur, target=None, freeze=False):
+        '''Copy data from the binary file object fileobj to the database using
+        the cursor cur, optionally to the table target and with the rows
+        frozen'''
 
         cur.execute('SET DATESTYLE=%s;', (self.datestyle, ))
 
-        prepared_name = 'insert_' + self.table_name.replace('.', '_')
-        num_fields = len(self.fields)
+        text_fileobj = io.TextIOWrapper(fileobj, encoding=self.encoding)
+
+        sql = "COPY {} FROM STDIN WITH (FORMAT TEXT, DELIMITER '{}', " \
+              "NULL '{}'".format(target or self.full_table_name, self.sep,
+                                 SanitisedCopyStream.null)
+
+        if freeze:
+            sql += ', FREEZE'
+
+        sql += ');'
+
+        cur.copy_expert(sql=sql,
+                        file=SanitisedCopyStream(text_fileobj, self.sep))
 
-        sql_prepare_params = ",".join(["$"+str(x)
-                                       for x in range(1, num_fields+1)])
-        cur.execute('''PREPARE {0} AS INSERT INTO {1} VALUES ({2});'''
-                    .format(prepared_name,
-                            self.full_table_name,
-                            sql_prepare_params))
 
-        sql_insert_params = ",".join(["%s" for x in range(1, num_fields+1)])
-        sql_insert = 'EXECUTE {0} ({1});'.format(prepared_name,
-                                                 sql_insert_params)
+class GazetteerPartitionedTable(GazetteerTable):
+    '''This is a child class of GazetteerTable for tables that are split into
+    partitions by the value of the field partition_by, using PostgreSQL's
+    list partitioning. There is a partition for each of partition_values,
+    named after the table with the value in lower case appended, and a
+    default partition for any other values. The primary key must include
+    partition_by. If filename_regexp has a group, it matches the value that
+    the rows in the file are expected to have, so that the data can be
+    uploaded straight into its partition (see partition_for_file and
+    partition_filter).'''
 
-        for line in fileobj:
-            params = [(None if x.strip() == '' else x)
-                      for x in line.split(self.sep)]
-            cur.execute(sql_insert, params)
+    def __init__(self, partition_by, partition_values, **kwargs):
+        super().__init__(**kwargs)
+        self.partition_by = partition_by
+        self.partition_values = tuple(partition_values)
+        self.partition_value = None
+
+    def partition(self, value=None):
+        '''Return a copy of the table that describes the partition for value,
+        or the default partition if value is None'''
+
+        result = copy.copy(self)
+        result.parent = self
+        result.partition_value = value
+        result.table_name = '{}_{}'.format(
+            self.table_name, 'default' if value is None else value.lower())
+        result.full_table_name = self.schema + '.' + result.table_name
+        return result
+
+    def partitions(self):
+        '''Return a list of all of the partitions, including the default'''
+
+        return [self.partition(i) for i in self.partition_values] + \
+            [self.partition(), ]
+
+    def partition_for_file(self, filename):
+        '''Return the partition that all of the data in a file belongs to, or
+        None if the data is for the whole table. Files for values that do not
+        have a partition of their own belong to the default partition.'''
+
+        match = self.filename_regexp.fullmatch(filename)
+        if self.parent is not None or match is None or not match.groups():
+            return None
+
+        value = match.group(1).upper()
+        if value not in self.partition_values:
+            value = None
+        return self.partition(value)
+
+    def partition_filter(self, fileobj, diverted=None):
+        '''Return a binary file object that gives the records in fileobj for
+        a partition that belong in it. Any records that belong in other
+        partitions are appended to the list diverted, so that they can be
+        uploaded through the partitioned table afterwards, or if diverted is
+        None, ValueError is raised.'''
+
+        quote, _ = self.record_quoting()
+        index = [i.sql_name for i in self.fields].index(
+            self.partition_by.lower())
+        values = set(i.encode('ASCII') for i in self.partition_values)
+        value = None if self.partition_value is None \
+            else self.partition_value.encode('ASCII')
+        name = getattr(fileobj, 'name', None)
+
+        def belongs(field):
+            if quote is not None and len(field) >= 2 and \
+                    field.startswith(quote) and field.endswith(quote):
+                field = field[1:-1]
+            if value is None:
+                return field not in values
+            return field == value
+
+        def records():
+            for number, record in enumerate(self.iter_records(fileobj)):
+                fields = self.split_record(record.rstrip(b'\r\n'))
+
+                # Records with too few fields are left for the database to
+                # reject
+
+                if len(fields) <= index or belongs(fields[index]):
+                    yield record
+                elif diverted is not None:
+                    diverted.append(record)
+                else:
+                    raise ValueError(
+                        'Row {} of {} has {} {}, so does not belong in the '
+                        'partition {}'.format(
+                            number + 1, name, self.partition_by,
+                            fields[index].decode('ASCII', 'replace'),
+                            self.full_table_name))
+
+        return io.BufferedReader(RecordStream(records(), name))
+
+    def generate_bound_sql(self):
+        '''Return the SQL describing the values held by a partition'''
+
+        if self.partition_value is None:
+            return 'DEFAULT'
+        return "FOR VALUES IN ('{}')".format(self.partition_value)
+
+    def generate_constraint_sql(self):
+        '''Return a SQL condition that is true for the rows that belong in a
+        partition'''
+
+        if self.partition_value is None:
+            return '{0} IS NULL OR {0} NOT IN ({1})'.format(
+                self.partition_by,
+                ', '.join("'{}'".format(i) for i in self.partition_values))
+        return "{0} IS NOT NULL AND {0} = '{1}'".format(
+            self.partition_by, self.partition_value)
+
+    def generate_sql_ddl(self, table_name=None, unlogged=False,
+                         primary_key=True, if_not_exists=False,
+                         geography=False, dictionary=False):
+        '''Return the SQL describing the partitioned table and all of its
+        partitions, which cannot be UNLOGGED. If a different table name is
+        given, the partitioned table is created without any partitions, so
+        that staging copies of the partitions can be attached to it (see
+        gazetteer.staging). For a partition, return the SQL that creates it
+        as a partition of the existing table, or if a different table name
+        is given, the SQL that creates a separate table with a constraint
+        that allows it to be attached as the partition later without the
+        data being checked.'''
+
+        if self.parent is None:
+            if unlogged:
+                raise ValueError('The partitioned table {} cannot be '
+                                 'UNLOGGED, only its partitions'
+                                 .format(self.full_table_name))
+
+            result = super().generate_sql_ddl(
+                table_name=table_name, primary_key=primary_key,
+                if_not_exists=if_not_exists, geography=geography,
+                dictionary=dictionary)
+            result = result[:-len(');\n')] + ') PARTITION BY LIST ({});\n'\
+                .format(self.partition_by)
+
+            if table_name is None:
+                for i in self.partitions():
+                    result += i.generate_sql_ddl(if_not_exists=if_not_exists)
+
+            return result
+
+        if table_name is None:
+            return 'CREATE TABLE {}{} PARTITION OF {}\n    {};\n'.format(
+                'IF NOT EXISTS ' if if_not_exists else '',
+                self.full_table_name, self.parent.full_table_name,
+                self.generate_bound_sql())
+
+        result = super().generate_sql_ddl(table_name, unlogged, primary_key,
+                                          if_not_exists, geography,
+                                          dictionary)
+        result += 'ALTER TABLE {0}.{1} ADD CONSTRAINT {1}_partition_check '\
+                  'CHECK ({2});\n'.format(self.schema, table_name,
+                                          self.generate_constraint_sql())
+        return result
+
+    def copy_data(self, fileobj, cur, target=None, freeze=False):
+        '''Copy data from the binary file object fileobj to the database using
+        the cursor cur, optionally to the table target. The rows can only be
+        frozen when copying straight into a partition, as PostgreSQL cannot
+        freeze rows routed through the partitioned table.'''
+
+        super().copy_data(fileobj, cur, target,
+                          freeze and self.parent is not None)
 
 
 class GazetteerTableDuplicate(GazetteerTable):
@@ -182,12 +636,20 @@ class GazetteerTableDuplicate(GazetteerTable):
         self.table_name = table_name
         self.full_table_name = schema + '.' + table_name
         self.encoding = 'UTF-8'
+        self.coordinates = None
+        self.name_fields = ()
 
     def check_header(self, header, print_debug=False):
         return True
 
-    def generate_sql_ddl(self):
+    def generate_sql_ddl(self, table_name=None, unlogged=False,
+                         primary_key=True, if_not_exists=False,
+                         geography=False, dictionary=False):
         return ''
 
-    def copy_data(self, fileobj, cur):
+    def copy_data(self, fileobj, cur, target=None, freeze=False):
         pass
+
+    def copy_data_tolerant(self, fileobj, cur, reject_file, chunk_rows=10000,
+                           target=None):
+        return 0
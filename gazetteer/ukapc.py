@@ -25,7 +25,8 @@ Place-names Committee.'''
 from .fields import SmallIntField, IntegerField, DoubleField, DateField
 from .fields import TextField, FlagField, TimeStampField
 from .tables import GazetteerTableCSV
-from .indexes import GazetteerBTreeIndex
+from .indexes import GazetteerBTreeIndex, GazetteerTrigramIndex
+from .indexes import GazetteerTextSearchIndex
 
 BAT = GazetteerTableCSV(
     filename_regexp=r'apip_bat_gazetteer.csv',
@@ -49,7 +50,9 @@ BAT = GazetteerTableCSV(
             ),
     pk='id',
     encoding='UTF-8',
-    datestyle='DMY'
+    datestyle='DMY',
+    coordinates=('lat', 'lon'),
+    name_fields=('placename', 'previousname')
     )
 
 BATPlacenameIndex = GazetteerBTreeIndex(
@@ -59,10 +62,26 @@ BATPlacenameIndex = GazetteerBTreeIndex(
     columns='placename text_pattern_ops'
     )
 
+BATPlacenameTrigramIndex = GazetteerTrigramIndex(
+    name='bat_placename_trgm_idx',
+    schema='ukapc',
+    table_name='bat',
+    column='placename'
+    )
+
+BATPlacenameTextSearchIndex = GazetteerTextSearchIndex(
+    name='bat_placename_tsv_idx',
+    schema='ukapc',
+    table_name='bat',
+    column='placename'
+    )
+
 tables = (
     BAT,
     )
 
 indexes = (
     BATPlacenameIndex,
+    BATPlacenameTrigramIndex,
+    BATPlacenameTextSearchIndex,
     )
@@ -28,6 +28,7 @@ from .fields import SmallIntField, IntegerField
 from .fields import FixedTextField, TextField, FlagField, TimeStampField
 from .tables import GazetteerTableCSV
 from .indexes import GazetteerBTreeIndex, GazetteerForeignKey
+from .indexes import GazetteerTrigramIndex, GazetteerTextSearchIndex
 
 
 class GazetteerTableCSV_NPTG(GazetteerTableCSV):
@@ -83,7 +84,8 @@ Localities = GazetteerTableCSV(
             ),
     pk='nptglocalitycode',
     encoding='UTF-8',
-    datestyle='ISO'
+    datestyle='ISO',
+    name_fields=('localityname', 'shortname', 'qualifiername')
     )
 
 LocalitiesNameIndex = GazetteerBTreeIndex(
@@ -93,6 +95,20 @@ LocalitiesNameIndex = GazetteerBTreeIndex(
     columns='localityname text_pattern_ops'
     )
 
+LocalitiesNameTrigramIndex = GazetteerTrigramIndex(
+    name='localities_trgm_idx',
+    schema='uknptg',
+    table_name='localities',
+    column='localityname'
+    )
+
+LocalitiesNameTextSearchIndex = GazetteerTextSearchIndex(
+    name='localities_tsv_idx',
+    schema='uknptg',
+    table_name='localities',
+    column='localityname'
+    )
+
 LocalitiesFK1 = GazetteerForeignKey(
     'localitiesFK1',
     'uknptg',
@@ -126,7 +142,8 @@ LocalityAlternativeNames = GazetteerTableCSV_NPTG(
             ),
     pk='nptglocalitycode, oldnptglocalitycode',
     encoding='UTF-8',
-    datestyle='ISO'
+    datestyle='ISO',
+    name_fields=('localityname', 'shortname', 'qualifiername')
     )
 
 LocalityAlternativeNamesFK1 = GazetteerForeignKey(
@@ -251,7 +268,8 @@ AdminAreas = GazetteerTableCSV(
     pk='administrativeareacode',
     encoding='UTF-8',
     datestyle='ISO',
-    force_null='maximumlengthforshortnames'
+    force_null='maximumlengthforshortnames',
+    name_fields=('areaname', 'shortname')
     )
 
 
@@ -280,7 +298,8 @@ Regions = GazetteerTableCSV(
             ),
     pk='regioncode',
     encoding='UTF-8',
-    datestyle='ISO'
+    datestyle='ISO',
+    name_fields=('regionname', )
     )
 
 
@@ -299,7 +318,8 @@ Districts = GazetteerTableCSV(
             ),
     pk='districtcode',
     encoding='UTF-8',
-    datestyle='ISO'
+    datestyle='ISO',
+    name_fields=('districtname', )
     )
 
 
@@ -329,7 +349,8 @@ PlusbusZones = GazetteerTableCSV(
             ),
     pk='plusbuszonecode',
     encoding='UTF-8',
-    datestyle='ISO'
+    datestyle='ISO',
+    name_fields=('name', )
     )
 
 
@@ -377,6 +398,8 @@ tables = (
 
 indexes = (
     LocalitiesNameIndex,
+    LocalitiesNameTrigramIndex,
+    LocalitiesNameTextSearchIndex,
     LocalitiesFK1,
     LocalityAlternativeNamesFK1,
     LocalityAlternativeNamesFK2,
@@ -46,7 +46,9 @@ Counties = GazetteerTable(
             ),
     pk='geoid',
     sep='\t',
-    encoding='ISO-8859-1'
+    encoding='ISO-8859-1',
+    coordinates=('intptlat', 'intptlong'),
+    name_fields=('name', )
     )
 
 
@@ -70,7 +72,9 @@ CountiesSubdivisions = GazetteerTable(
             ),
     pk='geoid',
     sep='\t',
-    encoding='ISO-8859-1'
+    encoding='ISO-8859-1',
+    coordinates=('intptlat', 'intptlong'),
+    name_fields=('name', )
     )
 
 
@@ -95,7 +99,9 @@ Places = GazetteerTable(
             ),
     pk='geoid',
     sep='\t',
-    encoding='ISO-8859-1'
+    encoding='ISO-8859-1',
+    coordinates=('intptlat', 'intptlong'),
+    name_fields=('name', )
     )
 
 
@@ -29,6 +29,8 @@ from .fields import IntegerField, DoubleField, TextField
 from .fields import FixedTextField, DateField, FlagField
 from .tables import GazetteerTable, GazetteerTableCSV, GazetteerTableInserted
 from .indexes import GazetteerBTreeIndex, GazetteerForeignKey
+from .indexes import GazetteerTrigramIndex, GazetteerTextSearchIndex
+from .indexes import GazetteerBRINIndex
 
 
 Features = GazetteerTable(
@@ -59,7 +61,10 @@ Features = GazetteerTable(
             DateField('DATE_EDITED')
             ),
     pk='feature_id, state_numeric',
-    datestyle='MDY'
+    datestyle='MDY',
+    coordinates=('prim_lat_dec', 'prim_long_dec'),
+    name_fields=('feature_name', ),
+    dictionary_fields={'county_name': 'SMALLINT', 'map_name': 'INTEGER'}
     )
 
 FeaturesNameIndex = GazetteerBTreeIndex(
@@ -69,6 +74,27 @@ FeaturesNameIndex = GazetteerBTreeIndex(
     columns='feature_name text_pattern_ops'
     )
 
+FeaturesNameTrigramIndex = GazetteerTrigramIndex(
+    name='features_feature_name_trgm_idx',
+    schema='usgnis',
+    table_name='features',
+    column='feature_name'
+    )
+
+FeaturesNameTextSearchIndex = GazetteerTextSearchIndex(
+    name='features_feature_name_tsv_idx',
+    schema='usgnis',
+    table_name='features',
+    column='feature_name'
+    )
+
+FeaturesCoordinatesIndex = GazetteerBRINIndex(
+    name='features_prim_lat_long_brin_idx',
+    schema='usgnis',
+    table_name='features',
+    columns=('prim_lat_dec', 'prim_long_dec')
+    )
+
 FeaturesStateIndex = GazetteerBTreeIndex(
     name='features_state_idx',
     schema='usgnis',
@@ -108,7 +134,9 @@ FedCodes = GazetteerTable(
             DateField('DATE_EDITED')
             ),
     pk='feature_id, county_sequence',
-    datestyle='MDY'
+    datestyle='MDY',
+    coordinates=('primary_latitude', 'primary_longitude'),
+    name_fields=('feature_name', )
     )
 
 FedCodesFK1 = GazetteerForeignKey(
@@ -124,7 +152,7 @@ AllStatesFedCodes.filename_regexp = \
 # The Feature_Description_History files currently have lines containing a
 # variety of characters, including a '\|' sequence that PostgreSQL's COPY
 # command incorrectly interprets as a literal '|' in the data. This data has
-# to be processed with a slower, prepared INSERT-based routine.
+# to be sanitised in Python as it is streamed to the database.
 
 FeatureDescriptionHistory = GazetteerTableInserted(
     filename_regexp=r'Feature_Description_History_([0-9]{8})\.txt',
@@ -152,11 +180,12 @@ GovtUnits = GazetteerTable(
             TextField('COUNTRY_NAME', nullable=False),
             TextField('FEATURE_NAME', nullable=False),
             ),
-    pk='feature_id, unit_type'
+    pk='feature_id, unit_type',
+    name_fields=('feature_name', )
     )
 
-# Some AllNames files have null bytes in the text, so the slower insert routine
-# is required.
+# Some AllNames files have null bytes in the text, so the data has to be
+# sanitised before it is passed to COPY.
 
 AllNames = GazetteerTableInserted(
     filename_regexp=r'AllNames_([0-9]{8})\.txt',
@@ -169,7 +198,8 @@ AllNames = GazetteerTableInserted(
             DateField('DATE_CREATED')
             ),
     pk='feature_id, feature_name',
-    datestyle='MDY'
+    datestyle='MDY',
+    name_fields=('feature_name', )
     )
 
 AntarcticaFeatures = GazetteerTable(
@@ -191,7 +221,9 @@ AntarcticaFeatures = GazetteerTable(
             DateField('DATE_EDITED')
             ),
     pk='antarctica_feature_id',
-    datestyle='MDY'
+    datestyle='MDY',
+    coordinates=('primary_latitude_dec', 'primary_longitude_dec'),
+    name_fields=('feature_name', )
     )
 
 CensusClassCodeDefinitions = GazetteerTableCSV(
@@ -230,7 +262,10 @@ tables = (
 
 indexes = (
     FeaturesNameIndex,
+    FeaturesNameTrigramIndex,
+    FeaturesNameTextSearchIndex,
     FeaturesStateIndex,
+    FeaturesCoordinatesIndex,
     FeaturesFK1,
     FedCodesFK1
     )
@@ -27,11 +27,36 @@ import re
 
 from .fields import SmallIntField, IntegerField, DoubleField, DateField
 from .fields import FixedTextField, TextField, FlagField
-from .tables import GazetteerTable, GazetteerTableCSV, GazetteerTableDuplicate
+from .tables import GazetteerTableCSV, GazetteerTableDuplicate
+from .tables import GazetteerPartitionedTable
 from .indexes import GazetteerBTreeIndex, GazetteerForeignKey
-
-
-Geonames = GazetteerTable(
+from .indexes import GazetteerTrigramIndex, GazetteerTextSearchIndex
+from .indexes import GazetteerBRINIndex
+
+
+# The geonames table is partitioned by the FIPS 10-4 country codes listed in
+# supplemental/USNGA_Country_Codes.csv, which are also used to name the files
+# in the archives of individual countries. Any other codes go into the
+# default partition.
+
+country_codes = '''
+AA AC AE AF AG AJ AL AM AN AO AQ AR AS AT AU AV AX AY BA BB BC BD BE BF BG BH
+BK BL BM BN BO BP BQ BR BT BU BV BX BY CA CB CD CE CF CG CH CI CJ CK CM CN CO
+CQ CR CS CT CU CV CW CY DA DJ DO DQ DR DX EC EG EI EK EN ER ES ET EZ FG FI FJ
+FK FM FO FP FQ FR FS GA GB GG GH GI GJ GK GL GM GP GQ GR GT GV GY GZ HA HK HM
+HO HQ HR HU IC ID IM IN IO IP IR IS IT IV IZ JA JE JM JN JO JQ KE KG KN KQ KR
+KS KT KU KV KZ LA LE LG LH LI LO LQ LS LT LU LY MA MB MC MD MF MG MH MI MJ MK
+ML MN MO MP MQ MR MT MU MV MX MY MZ NC NE NF NG NH NI NL NM NN NO NP NR NS NU
+NZ OD OS PA PC PE PF PG PK PL PM PO PP PS PU QA RE RI RM RN RO RP RQ RS RW SA
+SB SC SE SF SG SH SI SL SM SN SO SP ST SU SV SW SX SY SZ TB TD TH TI TK TL TN
+TO TP TS TT TU TV TW TX TZ UC UF UG UK UP US UV UY UZ VC VE VI VM VQ VT WA WE
+WF WI WQ WS WZ YM ZA ZI
+'''.split()
+
+
+Geonames = GazetteerPartitionedTable(
+    partition_by='cc1',
+    partition_values=country_codes,
     filename_regexp=r'Countries.txt',
     schema='usnga',
     table_name='geonames',
@@ -72,10 +97,14 @@ Geonames = GazetteerTable(
             DateField('F_EFCTV_DT'),  # Feature Effective Date
             DateField('F_TERM_DT')  # Feature Termination Date
             ),
-    pk='UFI, UNI',
+    pk='UFI, UNI, CC1',
     sep='\t',
     encoding='UTF-8',
-    datestyle='ISO'
+    datestyle='ISO',
+    coordinates=('lat', 'long'),
+    name_fields=('full_name_ro', 'full_name_nd_ro'),
+    dictionary_fields={'adm1': 'SMALLINT', 'lc': 'SMALLINT',
+                       'transl_cd': 'SMALLINT', 'display': 'SMALLINT'}
     )
 
 
@@ -87,7 +116,7 @@ GeonamesDuplicates = GazetteerTableDuplicate(
 
 
 GeonamesCountryFiles = copy.copy(Geonames)
-GeonamesCountryFiles.filename_regexp = re.compile('[a-z]{2}.txt')
+GeonamesCountryFiles.filename_regexp = re.compile('([a-z]{2}).txt')
 
 GeonamesCountryFilesDuplicates = GazetteerTableDuplicate(
     filename_regexp=r'[a-z]{2}_('
@@ -109,6 +138,27 @@ GeonamesFullNameNDROIndex = GazetteerBTreeIndex(
     columns='lower(full_name_nd_ro) text_pattern_ops'
     )
 
+GeonamesFullNameNDROTrigramIndex = GazetteerTrigramIndex(
+    name='geonames_full_name_nd_ro_trgm_idx',
+    schema='usnga',
+    table_name='geonames',
+    column='full_name_nd_ro'
+    )
+
+GeonamesFullNameNDROTextSearchIndex = GazetteerTextSearchIndex(
+    name='geonames_full_name_nd_ro_tsv_idx',
+    schema='usnga',
+    table_name='geonames',
+    column='full_name_nd_ro'
+    )
+
+
+GeonamesCoordinatesIndex = GazetteerBRINIndex(
+    name='geonames_lat_long_brin_idx',
+    schema='usnga',
+    table_name='geonames',
+    columns=('lat', 'long')
+    )
 
 GeonamesCC1Index = GazetteerBTreeIndex(
     name='geonames_cc1_idx',
@@ -260,7 +310,10 @@ tables = (
 
 indexes = (
     GeonamesFullNameNDROIndex,
+    GeonamesFullNameNDROTrigramIndex,
+    GeonamesFullNameNDROTextSearchIndex,
     GeonamesCC1Index,
+    GeonamesCoordinatesIndex,
     GeonamesFKFC,
     GeonamesFKDSG,
     GeonamesFKNT,
@@ -0,0 +1,193 @@
+# gazetteer_bench.py
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+''' gazetteer_bench.py - This program generates synthetic gazetteer data
+files and times how long gazetteer_extract.py takes to upload them, either
+as a dry run or to a local PostgreSQL database.'''
+
+import os
+import sys
+import argparse
+import json
+import subprocess
+import tempfile
+
+import psycopg2
+
+import gazetteer
+import gazetteer.bench
+
+# Parse command line arguments
+
+parser = argparse.ArgumentParser(description='Benchmark the upload of '
+                                 'synthetic gazetteer data')
+parser.add_argument('table',
+                    help='The database schema or table to benchmark, or ALL',
+                    metavar='TABLE', nargs='?', default='ALL')
+
+parser_po = parser.add_argument_group('processing options')
+parser_po.add_argument('--rows', help='Number of rows in each generated file '
+                       '(default 100000)', action='store', type=int,
+                       default=100000)
+parser_po.add_argument('--seed', help='Seed for the random data',
+                       action='store', type=int, default=0)
+parser_po.add_argument('--no-awkward', help='Do not include the problem '
+                       'values found in real files', action='store_true',
+                       default=False)
+parser_po.add_argument('--repeat', help='Number of times to upload each file',
+                       action='store', type=int, default=1)
+parser_po.add_argument('--output', help='Directory to keep the generated '
+                       'files and reports in, rather than a temporary one',
+                       action='store', default=None)
+parser_po.add_argument('--results-file', help='Write the results as JSON to '
+                       'this file', metavar='RESULTS FILE', default=None,
+                       type=argparse.FileType('x'))
+parser_po.add_argument('--extract-args', help='Extra arguments to pass to '
+                       'gazetteer_extract.py, as a single string',
+                       action='store', default='')
+
+parser_db = parser.add_argument_group('database arguments')
+parser_db.add_argument('--postgres', help='Also upload to a PostgreSQL '
+                       'database, if one can be connected to. The tables are '
+                       'dropped and recreated first.', action='store_true',
+                       default=False)
+parser_db.add_argument('--database',
+                       help='PostgreSQL database to use '
+                            '(default gazetteer_bench)',
+                       action='store', default='gazetteer_bench')
+parser_db.add_argument('--user', help='PostgreSQL user for upload',
+                       action='store',
+                       default=os.environ.get('USER', 'postgres'))
+parser_db.add_argument('--password', help='PostgreSQL user password',
+                       action='store', default='')
+parser_db.add_argument('--host', help='PostgreSQL host (if using TCP/IP)',
+                       action='store', default=None)
+parser_db.add_argument('--port', help='PostgreSQL port (if required)',
+                       action='store', type=int, default=5432)
+args = parser.parse_args()
+
+if args.rows < 0 or args.repeat < 1:
+    print('The number of rows cannot be negative and the number of '
+          'repeats must be at least 1')
+    sys.exit(1)
+
+# Identify the required tables
+
+if args.table == 'ALL':
+    tables = list(gazetteer.gazetteer_tables.values())
+elif args.table in gazetteer.gazetteer_schema:
+    tables = [i for i in gazetteer.gazetteer_tables.values()
+              if i.schema == args.table]
+elif args.table in gazetteer.gazetteer_tables:
+    tables = [gazetteer.gazetteer_tables[args.table], ]
+else:
+    print('"{}" is not a recognised table name. Use the "list" action of '
+          'gazetteer_schema.py to list valid table names'.format(args.table))
+    sys.exit(1)
+
+# Check that the database can be used if requested
+
+db_args = ['--database', args.database, '--user', args.user,
+           '--password', args.password]
+if args.host:
+    db_args += ['--host', args.host, '--port', str(args.port)]
+
+use_postgres = False
+if args.postgres:
+    try:
+        if args.host:
+            psycopg2.connect(database=args.database, user=args.user,
+                             password=args.password, host=args.host,
+                             port=args.port).close()
+        else:
+            psycopg2.connect(database=args.database, user=args.user,
+                             password=args.password).close()
+        use_postgres = True
+    except psycopg2.OperationalError as err:
+        print('Cannot connect to PostgreSQL, so only dry runs will be '
+              'timed: {}'.format(' '.join(str(err).split())))
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+extract_args = args.extract_args.split()
+
+# Generate each file and time the uploads
+
+if args.output:
+    os.makedirs(args.output, exist_ok=True)
+    work_dir = args.output
+else:
+    temp_dir = tempfile.TemporaryDirectory()
+    work_dir = temp_dir.name
+
+results = []
+
+print('{:45} {:8} {:>10} {:>10} {:>10} {:>12}'.format(
+    'Table', 'Target', 'Wall (s)', 'Header (s)', 'COPY (s)', 'Rows/s'))
+
+for table in tables:
+    filename = gazetteer.bench.example_filename(table)
+    if filename is None:
+        print('Cannot construct a file name for {}'
+              .format(table.full_table_name))
+        continue
+
+    path = os.path.join(work_dir, filename)
+    if os.path.exists(path):
+        os.remove(path)
+    gazetteer.bench.write_file(table, path, args.rows, args.seed,
+                               not args.no_awkward)
+
+    targets = [('dry-run', None), ]
+    if use_postgres:
+        targets.append(('postgres', db_args))
+
+    for target, target_args in targets:
+        for repeat in range(args.repeat):
+            if target_args is None:
+                log_path = os.path.join(work_dir, filename + '.log')
+                if os.path.exists(log_path):
+                    os.remove(log_path)
+                run_args = ['--dry-run', log_path, '--dry-run-consume']
+            else:
+                subprocess.run([sys.executable,
+                                os.path.join(script_dir,
+                                             'gazetteer_schema.py'),
+                                'create', '--drop-existing',
+                                table.full_table_name] + target_args,
+                               check=True, stdout=subprocess.DEVNULL)
+                run_args = target_args
+
+            elapsed, report = gazetteer.bench.run_extract(
+                path, work_dir, run_args + extract_args)
+            result = gazetteer.bench.summarise(table, args.rows, path,
+                                               elapsed, report)
+            result['target'] = target
+            results.append(result)
+
+            print('{:45} {:8} {:10.3f} {:10.3f} {:10.3f} {:>12}'.format(
+                table.full_table_name, target, elapsed,
+                result['header_seconds'], result['copy_seconds'],
+                '{:,.0f}'.format(result['rows_per_second'])
+                if result['rows_per_second'] else '-'))
+
+if args.results_file:
+    json.dump(results, args.results_file, indent=2)
+    args.results_file.write('\n')
+    args.results_file.close()
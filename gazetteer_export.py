@@ -0,0 +1,174 @@
+# gazetteer_export.py
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+''' gazetteer_export.py - This program extracts gazetteer data files provided
+by various sources and writes them out as Parquet files. Note that this
+program is not associated with or endorsed by any of the supported
+sources.'''
+
+import os
+import sys
+import argparse
+import zipfile
+
+import gazetteer
+import gazetteer.columnar
+import gazetteer.parquet
+import gazetteer.tables
+
+# Parse command line arguments
+
+parser = argparse.ArgumentParser(description='Export gazetteer data to '
+                                 'Parquet files')
+parser.add_argument('file', metavar='FILE',
+                    help='The file to extract and export data from')
+parser.add_argument('output', metavar='OUTPUT',
+                    help='The directory to write the Parquet files to. Each '
+                         'table is written to a SCHEMA/TABLE subdirectory, '
+                         'which must not already exist.')
+parser.add_argument('type', help='Override recognition of the type of file',
+                    metavar='TYPE', nargs='?', default='DEFAULT')
+
+parser.add_argument('--schema',
+                    help='Only search this schema when identifying the type',
+                    action='store', default='ALL')
+
+parser_po = parser.add_argument_group('output options')
+parser_po.add_argument('--partition-by',
+                       help='Write a subdirectory for each value of this '
+                            'field, for example CC1 or STATE_ALPHA. Tables '
+                            'without the field are not partitioned.',
+                       metavar='FIELD', action='store', default=None)
+parser_po.add_argument('--compression', help='Compression to use in the '
+                       'Parquet files (default zstd)',
+                       choices=['zstd', 'snappy', 'gzip', 'brotli', 'lz4',
+                                'none'],
+                       action='store', default='zstd')
+parser_po.add_argument('--row-group-rows',
+                       help='Number of rows in each Parquet row group '
+                            '(default 131072)',
+                       action='store', type=int, default=131072)
+parser_po.add_argument('--batch-rows',
+                       help='Number of rows to read from the data file at a '
+                            'time (default 65536)',
+                       action='store', type=int, default=65536)
+parser_po.add_argument('--max-buffered-rows',
+                       help='Maximum number of rows to hold in memory before '
+                            'writing out partly filled row groups '
+                            '(default 1048576)',
+                       action='store', type=int, default=1048576)
+args = parser.parse_args()
+
+if args.row_group_rows < 1 or args.batch_rows < 1 or \
+        args.max_buffered_rows < 1:
+    print('The numbers of rows must be at least 1')
+    sys.exit(1)
+
+# Process files
+
+
+def identify_table(filename):
+    '''Return the table that a file relates to, exiting if it cannot be
+    identified'''
+
+    if args.type == 'DEFAULT':
+
+        if args.schema == 'ALL':
+            table = gazetteer.find_table(os.path.split(filename)[-1])
+        else:
+            table = gazetteer.find_table(os.path.split(filename)[-1],
+                                         args.schema)
+
+        if table is None:
+            print('Cannot identify the file type for ''{}'''.format(filename))
+            sys.exit(1)
+
+    else:
+        if args.type not in gazetteer.gazetteer_tables:
+            print('Type ''{}'' is not valid'.format(args.type))
+            sys.exit(1)
+
+        table = gazetteer.gazetteer_tables[args.type]
+
+    return table
+
+
+writers = {}
+
+
+def process_file(filename, file_object):
+    '''Process a file and if appropriate write its data to the Parquet files
+    for its table'''
+
+    table = identify_table(filename)
+
+    if isinstance(table, gazetteer.tables.GazetteerTableDuplicate):
+        return
+
+    if table.full_table_name not in writers:
+        directory = os.path.join(args.output, table.schema, table.table_name)
+        if os.path.exists(directory):
+            print('Output directory ''{}'' already exists'.format(directory))
+            sys.exit(1)
+
+        writer = gazetteer.parquet.ParquetTableWriter(
+            table, directory, args.partition_by, args.row_group_rows,
+            args.compression, args.max_buffered_rows)
+        if args.partition_by and writer.partition_field is None:
+            print('Table {} has no field {}, so it will not be partitioned.'
+                  .format(table.full_table_name, args.partition_by))
+        writers[table.full_table_name] = writer
+
+    print('Exporting ''{}'' data from {}.'.format(table.full_table_name,
+                                                  filename))
+
+    try:
+        for batch in gazetteer.columnar.iter_batches(table, file_object,
+                                                     args.batch_rows):
+            # The Parquet files record which fields are NOT NULL
+            violation = next(batch.null_violations(), None)
+            if violation is not None:
+                raise ValueError('Row {}: NULL value in field {}'
+                                 .format(*violation))
+            writers[table.full_table_name].write_batch(batch)
+    except ValueError as err:
+        print('Cannot export ''{}'': {}'.format(filename, err))
+        sys.exit(1)
+
+
+file_ext = os.path.splitext(args.file)[1]
+
+if file_ext == '.txt' or file_ext == '.csv':
+    with open(args.file, 'rb') as fp:
+        process_file(args.file, fp)
+
+elif file_ext == '.zip':
+    with zipfile.ZipFile(args.file, 'r') as inputs:
+        for i in inputs.namelist():
+            with inputs.open(i, 'r') as fp:
+                process_file(i, fp)
+
+else:
+    print('Cannot handle files of this type: {}'.format(file_ext))
+    sys.exit(1)
+
+for name, writer in writers.items():
+    writer.close()
+    print('Wrote {} rows of {} data.'.format(writer.rows_written, name))
@@ -22,16 +22,34 @@
 by various sources and uploads them into a PostgreSQL database. Note that this
 program is not associated with or endorsed by any of the supported sources.'''
 
-import io
 import os
 import sys
 import argparse
+import io
+import locale
+import mmap
+import sqlite3
+import threading
 import zipfile
+import concurrent.futures
 
 import psycopg2
 
 import gazetteer
+import gazetteer.clustering
+import gazetteer.delta
+import gazetteer.dictionary
+import gazetteer.fingerprints
+import gazetteer.indexes
+import gazetteer.journal
+import gazetteer.metrics
 import gazetteer.mockdb
+import gazetteer.projection
+import gazetteer.sampling
+import gazetteer.sqlitedb
+import gazetteer.staging
+import gazetteer.streams
+import gazetteer.tables
 
 # Parse command line arguments
 
@@ -45,12 +63,156 @@ parser.add_argument('type', help='Override recognition of the type of file',
 parser.add_argument('--schema',
                     help='Only search this schema when identifying the type',
                     action='store', default='ALL')
+parser.add_argument('--load-profile',
+                    help='A JSON file giving the fields to upload and the '
+                         'rows to keep for each table',
+                    metavar='PROFILE FILE', default=None,
+                    type=argparse.FileType('r'))
+parser.add_argument('--jobs', help='Number of files in a .zip container, or '
+                    'parts of a single file, to upload in parallel using '
+                    'separate connections',
+                    action='store', type=int, default=1)
+
+parser.add_argument('--swap', help='Upload into an UNLOGGED staging table, '
+                    'build its indexes and then swap it in place of the '
+                    'existing table', action='store_true', default=False)
+
+parser.add_argument('--replace', help='Create or truncate each table in the '
+                    'same transaction as the upload so that the data can be '
+                    'loaded already frozen', action='store_true',
+                    default=False)
+
+parser.add_argument('--delta', help='Only upload rows that have changed since '
+                    'the last delta upload, and delete rows that have gone',
+                    action='store_true', default=False)
+
+parser.add_argument('--dictionary', help='Replace the values of the '
+                    'dictionary encoded fields by keys, for tables created by '
+                    'gazetteer_schema.py --dictionary',
+                    action='store_true', default=False)
+
+parser_clu = parser.add_argument_group('clustering arguments')
+parser_clu.add_argument('--cluster',
+                        help='Sort the rows of each file for a table with '
+                             'coordinates along a Hilbert curve before '
+                             'uploading, so that nearby places are stored '
+                             'together', action='store_true', default=False)
+parser_clu.add_argument('--cluster-memory',
+                        help='Approximate memory in MB to use when sorting '
+                             'each file, beyond which sorted runs are written '
+                             'to temporary files (default 256)',
+                        metavar='MB', action='store', type=int, default=256)
+
+parser_smp = parser.add_argument_group('sampling arguments')
+parser_smp.add_argument('--sample',
+                        help='Only upload the rows whose key is in this '
+                             'fraction of the hashes of the keys, so that '
+                             'related tables keep the same keys',
+                        metavar='FRACTION', action='store', type=float,
+                        default=None)
+parser_smp.add_argument('--sample-every',
+                        help='Only upload every Nth row of each file',
+                        metavar='N', action='store', type=int, default=None)
+parser_smp.add_argument('--sample-key',
+                        help='The field to hash when sampling the tables '
+                             'that have it (default the first field of the '
+                             'primary key)', metavar='FIELD', default=None)
+parser_smp.add_argument('--sample-cap',
+                        help='Upload at most this many rows for each value '
+                             'of a field in each table that has it',
+                        metavar=('FIELD', 'ROWS'), nargs=2, default=None)
+
+parser_rej = parser.add_argument_group('error handling arguments')
+parser_rej.add_argument('--reject-file',
+                        help='Upload in chunks and write any rows that the '
+                             'database rejects to this file rather than '
+                             'failing', metavar='REJECT FILE', default=None,
+                        type=argparse.FileType('xb'))
+parser_rej.add_argument('--chunk-rows',
+                        help='Number of rows in each chunk when using a '
+                             'reject file (default 10000)',
+                        action='store', type=int, default=10000)
+
+parser_jnl = parser.add_argument_group('journal arguments')
+parser_jnl.add_argument('--journal',
+                        help='Record each file uploaded in the '
+                             'gazetteer_etl.load_journal table, in the same '
+                             'transaction as its data',
+                        action='store_true', default=False)
+parser_jnl.add_argument('--commit-each',
+                        help='Commit each file in a .zip container as soon '
+                             'as it is uploaded, rather than all of them at '
+                             'the end', action='store_true', default=False)
+parser_jnl.add_argument('--resume',
+                        help='Skip the files that the journal records as '
+                             'already uploaded from the same file or .zip '
+                             'container, and continue any file that was '
+                             'partly uploaded from the last offset '
+                             'committed. Implies --journal.',
+                        action='store_true', default=False)
+parser_jnl.add_argument('--skip-unchanged',
+                        help='Record a fingerprint of each file uploaded to '
+                             'a table in gazetteer_etl.file_fingerprints, '
+                             'and skip the files that are unchanged since '
+                             'they were last uploaded to the same table',
+                        action='store_true', default=False)
+parser_jnl.add_argument('--commit-rows',
+                        help='Commit each file in chunks of at most this '
+                             'many rows, recording the offset reached in the '
+                             'journal. Implies --journal and --commit-each.',
+                        metavar='ROWS', action='store', type=int,
+                        default=None)
+parser_jnl.add_argument('--commit-mb',
+                        help='Commit each file in chunks of at most this '
+                             'many MB, recording the offset reached in the '
+                             'journal. Implies --journal and --commit-each.',
+                        metavar='MB', action='store', type=float,
+                        default=None)
+
+parser_met = parser.add_argument_group('reporting arguments')
+parser_met.add_argument('--progress',
+                        help='Show a progress line with the upload rate on '
+                             'standard error', action='store_true',
+                        default=False)
+parser_met.add_argument('--metrics-file',
+                        help='Write a JSON report of the time taken by each '
+                             'phase of the upload and the amount of data in '
+                             'each file to this file',
+                        metavar='METRICS FILE', default=None,
+                        type=argparse.FileType('x'))
 
 parser_db = parser.add_argument_group('database arguments')
 parser_db.add_argument('--dry-run', help='Dump commands to a file rather than '
                                          'executing them on the database',
                        nargs='?', metavar='LOG FILE', default=None,
                        type=argparse.FileType('x'))
+parser_db.add_argument('--dry-run-consume',
+                       help='Read all of the data in a dry run and count the '
+                            'rows, as a database would',
+                       action='store_true', default=False)
+parser_db.add_argument('--dry-run-validate',
+                       help='Read all of the data in a dry run and check the '
+                            'number of fields in each row',
+                       action='store_true', default=False)
+parser_db.add_argument('--dry-run-latency',
+                       help='Time in ms to wait after each statement in a '
+                            'dry run', metavar='MS',
+                       action='store', type=float, default=0.0)
+parser_db.add_argument('--dry-run-bandwidth',
+                       help='Limit the rate at which data is read in a dry '
+                            'run to this many MB/s', metavar='MB/S',
+                       action='store', type=float, default=None)
+parser_db.add_argument('--postgis',
+                       help='The tables have PostGIS geography columns, as '
+                            'created by gazetteer_schema.py --postgis. This '
+                            'is needed for tables created by --replace or '
+                            '--swap to match.', action='store_true',
+                       default=False)
+parser_db.add_argument('--sqlite',
+                       help='Upload to this SQLite database file rather than '
+                            'to PostgreSQL, creating the tables if necessary. '
+                            'The file may be left corrupt if the upload '
+                            'fails.', metavar='SQLITE FILE', default=None)
 parser_db.add_argument('--database',
                        help='PostgreSQL database to use (default gazetteer)',
                        action='store', default='gazetteer')
@@ -72,38 +234,168 @@ parser_db.add_argument("--maintenance-work-mem",
                        action="store", type=int, default=0)
 args = parser.parse_args()
 
-# Create database connection and change settings if requested
+# Create database connections and change settings if requested
 
-if args.dry_run:
-    connection = gazetteer.mockdb.Connection(args.dry_run)
-else:
-    if args.host:
-        connection = psycopg2.connect(database=args.database,
-                                      user=args.user,
-                                      password=args.password,
-                                      host=args.host,
-                                      port=args.post)
+
+def connect():
+    '''Return a new database connection (or a mock connection if this is a
+    dry run) with the session settings requested on the command line'''
+
+    if args.dry_run:
+        new_connection = gazetteer.mockdb.Connection(
+            args.dry_run,
+            consume=args.dry_run_consume,
+            tables=gazetteer.gazetteer_tables if args.dry_run_validate
+            else None,
+            latency=args.dry_run_latency / 1000,
+            bandwidth=args.dry_run_bandwidth * 1e6
+            if args.dry_run_bandwidth else None,
+            geography=args.postgis)
     else:
-        connection = psycopg2.connect(database=args.database,
-                                      user=args.user,
-                                      password=args.password)
+        if args.host:
+            new_connection = psycopg2.connect(database=args.database,
+                                              user=args.user,
+                                              password=args.password,
+                                              host=args.host,
+                                              port=args.port)
+        else:
+            new_connection = psycopg2.connect(database=args.database,
+                                              user=args.user,
+                                              password=args.password)
 
-with connection.cursor() as cur:
-    if args.no_sync_commit:
-        cur.execute("SET SESSION synchronous_commit=off;")
+    with new_connection.cursor() as cur:
+        if args.no_sync_commit:
+            cur.execute("SET SESSION synchronous_commit=off;")
+
+        if args.work_mem != 0:
+            cur.execute("SET SESSION work_mem=%s;", (args.work_mem*1024,))
+
+        if args.maintenance_work_mem != 0:
+            cur.execute("SET SESSION maintenance_work_mem=%s;",
+                        (args.maintenance_work_mem*1024,))
+
+    return new_connection
+
+
+if args.jobs < 1:
+    print('The number of jobs must be at least 1')
+    sys.exit(1)
+
+if args.replace + args.swap + args.delta > 1:
+    print('Only one of the --replace, --swap and --delta options can be used')
+    sys.exit(1)
+
+if args.chunk_rows < 1:
+    print('The number of rows in each chunk must be at least 1')
+    sys.exit(1)
+
+if args.cluster_memory < 1:
+    print('The memory used for clustering must be at least 1 MB')
+    sys.exit(1)
+
+if (args.commit_rows is not None and args.commit_rows < 1) or \
+        (args.commit_mb is not None and args.commit_mb <= 0):
+    print('The size of each chunk to commit must be positive')
+    sys.exit(1)
+
+chunked_commits = args.commit_rows is not None or args.commit_mb is not None
+
+if chunked_commits:
+    args.commit_each = True
+    args.journal = True
+
+if args.resume:
+    args.journal = True
 
-    if args.work_mem != 0:
-        cur.execute("SET SESSION work_mem=%s;", (args.work_mem*1024,))
+if args.sqlite and (args.jobs > 1 or args.swap or args.delta or
+                    args.reject_file or args.dry_run or args.postgis or
+                    args.dictionary or args.journal or args.commit_each or
+                    args.skip_unchanged):
+    print('The --jobs, --swap, --delta, --reject-file, --dry-run, '
+          '--postgis, --dictionary, --journal, --commit-each, --resume, '
+          '--commit-rows, --commit-mb and --skip-unchanged options cannot be '
+          'used with --sqlite')
+    sys.exit(1)
+
+# Tables that are replaced, swapped or uploaded as deltas must have all of
+# their data uploaded in one transaction
+
+if (args.commit_each or args.resume) and \
+        (args.replace or args.swap or args.delta):
+    print('The --commit-each, --resume, --commit-rows and --commit-mb '
+          'options cannot be used with --replace, --swap or --delta')
+    sys.exit(1)
 
-    if args.maintenance_work_mem != 0:
-        cur.execute("SET SESSION maintenance_work_mem=%s;",
-                    (args.maintenance_work_mem*1024,))
+# The offset recorded after each chunk is an offset into the original file,
+# so the rows cannot be reordered or diverted before they are committed
+
+if chunked_commits and (args.cluster or args.reject_file):
+    print('The --commit-rows and --commit-mb options cannot be used with '
+          '--cluster or --reject-file')
+    sys.exit(1)
+
+# The rows chosen by --sample-every and --sample-cap depend on the order they
+# are read in, which is only fixed when each file is read from start to end
+# in one pass by a single job
+
+if (args.sample_every is not None or args.sample_cap is not None) and \
+        (args.jobs > 1 or chunked_commits or args.resume):
+    print('The --sample-every and --sample-cap options cannot be used with '
+          '--jobs, --commit-rows, --commit-mb or --resume')
+    sys.exit(1)
+
+if args.dictionary and args.reject_file:
+    print('The rows in a reject file would be dictionary encoded, so '
+          '--reject-file cannot be used with --dictionary')
+    sys.exit(1)
+
+# Trim the tables to the fields that are to be uploaded. This must be done
+# before any of the tables are used.
+
+if args.load_profile:
+    try:
+        gazetteer.apply_load_profiles(
+            gazetteer.projection.read_load_profiles(args.load_profile))
+    except ValueError as err:
+        print('Cannot use the load profile: {}'.format(err))
+        sys.exit(1)
+    args.load_profile.close()
+
+# The foreign keys between the tables, leaving out any on the fields that are
+# not uploaded
+
+foreign_keys = [i for i in set().union(
+    *gazetteer.gazetteer_tables_indexes.values())
+    if isinstance(i, gazetteer.indexes.GazetteerForeignKey)]
+
+# The same sampler is used for every file, so that the counts for each value
+# of a capped field cover all of them. The rows that the foreign keys refer
+# to are kept, so that the foreign keys can be built on the sample.
+
+sampler = None
+
+if args.sample is not None or args.sample_every is not None or \
+        args.sample_cap is not None:
+    try:
+        sampler = gazetteer.sampling.RowSampler(
+            fraction=args.sample, every=args.sample_every,
+            key=args.sample_key,
+            stratum=args.sample_cap[0] if args.sample_cap else None,
+            cap=int(args.sample_cap[1]) if args.sample_cap else None)
+    except ValueError as err:
+        print('Cannot sample the rows: {}'.format(err))
+        sys.exit(1)
+    sampler.follow_foreign_keys(gazetteer.gazetteer_tables, foreign_keys)
+
+metrics = gazetteer.metrics.LoadMetrics(
+    progress=sys.stderr if args.progress else None)
 
 # Process files
 
 
-def process_file(filename, file_object, cursor):
-    '''Process a file and if appropriate copy data to the database'''
+def identify_table(filename):
+    '''Return the table that a file should be uploaded to, exiting if it
+    cannot be identified'''
 
     if args.type == 'DEFAULT':
 
@@ -124,51 +416,856 @@ def process_file(filename, file_object, cursor):
 
         table = gazetteer.gazetteer_tables[args.type]
 
+    # The files for each country can be uploaded straight into the partition
+    # of the table for that country
+
+    if isinstance(table, gazetteer.tables.GazetteerPartitionedTable):
+        partition = table.partition_for_file(os.path.split(filename)[-1])
+        if partition is not None:
+            table = partition
+
+    return table
+
+
+def process_file(filename, file_object, cursor, prepared_tables=None,
+                 header=True, offset=0, checkpoint=None, count_rows=None):
+    '''Process a file and if appropriate copy data to the database. If
+    tables are being replaced or uploaded as deltas, prepared_tables is a
+    dict of the tables that have already been prepared in the current
+    transaction (see finish_tables). If header is False, the file object
+    does not start with a header line. If offset is given, that many bytes
+    at the start of the file have already been uploaded and are skipped,
+    including the header. If checkpoint is given, the file is uploaded in
+    chunks (see --commit-rows) and checkpoint is called after each one with
+    the table name, the offset reached in the file and the number of rows in
+    the chunk. Otherwise, if count_rows is given, the records are counted as
+    they are read and count_rows is called with the number read once they
+    have been uploaded.'''
+
+    table = identify_table(filename)
+
+    # Timings and counts are recorded against the name of the file object, as
+    # the parts of a split file all have the same filename
+
+    name = getattr(file_object, 'name', None) or filename
+
+    if offset:
+        with metrics.phase('skip', name):
+            gazetteer.streams.skip_bytes(file_object, offset)
+        header = False
+
+    file_object = metrics.measure(file_object, name)
+    metrics.set_info(name, table=table.full_table_name,
+                     header_lines=1 if header else 0)
+
+    if table.full_table_name in staging_tables:
+        target = staging_tables[table.full_table_name].full_table_name
+    else:
+        target = None
+
     print('Uploading ''{}'' data to {}.'.format(filename,
                                                 table.full_table_name))
 
-    if isinstance(file_object, io.TextIOBase):
-        text_file_object = file_object
+    # Only the header line is decoded here. The rest of the file is passed to
+    # the table as raw bytes.
+
+    if header:
+        with metrics.phase('header', name):
+            header_line = file_object.readline()
+            offset += len(header_line)
+            header_ok = table.check_header(
+                header_line.decode(table.encoding or
+                                   locale.getpreferredencoding(False)),
+                print_debug=True)
+
+        if not header_ok:
+            print('File ''{}'' does not have the correct header'
+                  .format(filename))
+            sys.exit(1)
+
+    if checkpoint is None and count_rows is not None:
+        records = 0
+
+        def counted_records():
+            nonlocal records
+            for record in table.iter_records(file_object):
+                records += 1
+                yield record
+
+        rejected = upload_data(table, name, io.BufferedReader(
+            gazetteer.streams.RecordStream(counted_records(), name)),
+            cursor, target, prepared_tables)
+        count_rows(records)
+    elif checkpoint is None:
+        rejected = upload_data(table, name, file_object, cursor, target,
+                               prepared_tables)
     else:
-        text_file_object = \
-            io.TextIOWrapper(file_object, encoding=table.encoding)
+        rejected = 0
+        for chunk, size, rows in gazetteer.streams.iter_chunks(
+                table.iter_records(file_object), args.commit_rows,
+                None if args.commit_mb is None
+                else int(args.commit_mb * 1024 * 1024), name):
+            rejected += upload_data(table, name, chunk, cursor, target,
+                                    prepared_tables)
+            offset += size
+            checkpoint(table.full_table_name, offset, rows)
+
+    if rejected:
+        print('Rejected {} rows from ''{}''.'.format(rejected, filename))
+        metrics.set_info(name, rejected=rejected)
+
+    return table.full_table_name
+
+
+def upload_data(table, name, file_object, cursor, target,
+                prepared_tables=None):
+    '''Copy the data (without a header) from a file object to the table, or
+    to the target table if that is given, preparing the table first if
+    necessary. Return the number of rows rejected.'''
+
+    # The rows and fields left out by a load profile are removed as the data
+    # is read, before anything else is done with it
+
+    if table.load_profile is not None:
+        file_object = table.load_profile.filter(table, file_object)
+
+    if sampler is not None and \
+            not isinstance(table, gazetteer.tables.GazetteerTableDuplicate):
+        file_object = sampler.filter(table, file_object)
+
+    if args.cluster and table.coordinates is not None:
+        with metrics.phase('cluster', name):
+            file_object = gazetteer.clustering.cluster_records(
+                table, file_object, args.cluster_memory)
+
+    if (args.replace or args.delta) and \
+            not isinstance(table, gazetteer.tables.GazetteerTableDuplicate) \
+            and table.full_table_name not in prepared_tables:
+        delta = gazetteer.delta.DeltaLoad(table, dictionary=args.dictionary)
+        with metrics.phase('prepare', table.full_table_name):
+            if args.replace:
+                group = replace_groups[table.full_table_name]
+                for _, i in sorted(group.items()):
+                    cursor.execute('CREATE SCHEMA IF NOT EXISTS {};'
+                                   .format(i.schema))
+                    cursor.execute(i.generate_sql_ddl(
+                        if_not_exists=True, geography=args.postgis,
+                        dictionary=args.dictionary))
+
+                    # The view on a partitioned table is created with the
+                    # table itself by gazetteer_schema.py
+
+                    if args.dictionary and i.dictionary_fields and \
+                            i.parent is None:
+                        cursor.execute(i.generate_view_sql(args.postgis))
+
+                cursor.execute('TRUNCATE TABLE {};'
+                               .format(', '.join(sorted(group))))
+                for table_name, i in sorted(group.items()):
+                    cursor.execute(gazetteer.delta.DeltaLoad(
+                        i, dictionary=args.dictionary).generate_drop_sql())
+                    prepared_tables[table_name] = None
+            else:
+                delta.begin(cursor)
+                prepared_tables[table.full_table_name] = delta
+
+    if args.delta and prepared_tables.get(table.full_table_name):
+        delta = prepared_tables[table.full_table_name]
+        file_object = delta.filter(file_object)
+        target = delta.staging_table_name
+
+    encoding = dictionaries.get((table.parent or table).full_table_name)
+    if encoding is not None:
+        file_object = encoding.filter(file_object)
+
+    # Any rows in the file for a partition that belong in other partitions
+    # are uploaded through the partitioned table afterwards. A staging copy
+    # of a partition or a delta can only hold the rows for the partition
+    # itself, and with --replace the other partitions may be truncated
+    # later, or be locked by other workers until the end of the upload.
+
+    diverted = None
+    if table.parent is not None:
+        diverted = [] if target is None and not args.replace else None
+        file_object = table.partition_filter(file_object, diverted)
+
+    with metrics.phase('copy', name):
+        if args.reject_file:
+            rejected = table.copy_data_tolerant(file_object, cursor,
+                                                args.reject_file,
+                                                args.chunk_rows, target)
+        else:
+            # COPY FREEZE is not possible inside the savepoints used above
+            rejected = 0
+            table.copy_data(file_object, cursor, target, freeze=args.replace)
+
+    if diverted:
+        print("Uploading {} rows from '{}' through {} as they belong in "
+              'other partitions.'.format(len(diverted), name,
+                                         table.parent.full_table_name))
+        diverted_file = io.BytesIO(b''.join(
+            i if i.endswith(b'\n') else i + b'\n' for i in diverted))
+        diverted_file.name = name
+        with metrics.phase('copy', name):
+            if args.reject_file:
+                rejected += table.parent.copy_data_tolerant(
+                    diverted_file, cursor, args.reject_file, args.chunk_rows)
+            else:
+                table.parent.copy_data(diverted_file, cursor)
+
+    return rejected
+
+
+def load_options(table):
+    '''Return the fingerprint of the options that change which rows or values
+    of the table are uploaded, which is recorded with the fingerprint of each
+    file uploaded to it'''
+
+    profile = table.load_profile
+    return gazetteer.fingerprints.options_fingerprint({
+        'sample': args.sample,
+        'sample_every': args.sample_every,
+        'sample_key': args.sample_key if sampler is not None else None,
+        'sample_cap': tuple(args.sample_cap) if args.sample_cap else None,
+        'dictionary': args.dictionary and bool(table.dictionary_fields),
+        'load_profile': None if profile is None else (
+            None if profile.columns is None else sorted(profile.columns),
+            sorted(profile.exclude),
+            sorted((i, sorted(j)) for i, j in profile.where.items()))})
+
+
+def upload_member(filename, file_object, upload_connection, cursor,
+                  prepared_tables=None, crc=None):
+    '''Upload a file or a member of a .zip file using process_file, recording
+    it in the load journal in the same transaction if one is kept, and then
+    committing it if --commit-each was given. A file that the journal
+    records as already uploaded is skipped when resuming, and a file that
+    was partly uploaded in chunks is continued from the offset reached.
+    Return the name of the table uploaded to, or None if the file was
+    skipped.'''
+
+    member = filename if file_ext == '.zip' else os.path.basename(filename)
+
+    offset = 0
+    rows = 0
+    if member in journal_members and journal_members[member][0] == crc:
+        status, byte_offset, row_count = journal_members[member][1:]
+        if status in (gazetteer.journal.status_loaded,
+                      gazetteer.journal.status_skipped,
+                      gazetteer.journal.status_unchanged):
+            print('Skipping ''{}'' as it has already been uploaded.'
+                  .format(filename))
+            return None
+        if byte_offset:
+            print('Continuing ''{}'' from byte {} after {} rows.'
+                  .format(filename, byte_offset, row_count))
+            offset = byte_offset
+            rows = row_count or 0
+
+    # Every file is uploaded if the contents of the tables are being
+    # replaced, as the fingerprints of the old contents have been forgotten
+
+    table = identify_table(filename)
+    fingerprint = member_fingerprints.get(member)
+    options = load_options(table)
+    if fingerprints is not None and \
+            fingerprints.unchanged(table.full_table_name, member,
+                                   fingerprint, options):
+        print('Skipping ''{}'' as it is unchanged since it was uploaded to '
+              '{}.'.format(filename, table.full_table_name))
+        if journal is not None:
+            journal.record(cursor, member, crc, table.full_table_name, None,
+                           gazetteer.journal.status_unchanged,
+                           journal.start())
+            if args.commit_each:
+                upload_connection.commit()
+        return None
+
+    if journal is None:
+        table_name = process_file(filename, file_object, cursor,
+                                  prepared_tables)
+    else:
+        started = journal.start()
+
+        def checkpoint(table_name, position, chunk_rows):
+            '''Record the offset reached in the journal and commit the chunk
+            of the file uploaded'''
+
+            nonlocal offset, rows
+            offset = position
+            rows += chunk_rows
+            journal.record(cursor, member, crc, table_name, rows,
+                           gazetteer.journal.status_partial, started,
+                           byte_offset=offset)
+            save_dictionaries()
+            with metrics.phase('commit'):
+                upload_connection.commit()
+
+        def count_rows(count):
+            '''Add the number of records read from the file to the count
+            recorded in the journal'''
+
+            nonlocal rows
+            rows += count
+
+        try:
+            table_name = process_file(
+                filename, file_object, cursor, prepared_tables,
+                offset=offset,
+                checkpoint=checkpoint if chunked_commits else None,
+                count_rows=count_rows)
+        except BaseException as err:
+            # The failure is recorded in a transaction of its own, which
+            # means that anything else uploaded in the same transaction is
+            # lost. The offset of the chunks already committed is kept so
+            # that the file can be continued.
+            upload_connection.rollback()
+            with upload_connection.cursor() as cur:
+                journal.record(cur, member, crc, None, rows or None,
+                               gazetteer.journal.status_failed, started,
+                               '{}: {}'.format(type(err).__name__,
+                                               ' '.join(str(err).split())),
+                               byte_offset=offset or None)
+            upload_connection.commit()
+            raise
+
+        if isinstance(table, gazetteer.tables.GazetteerTableDuplicate):
+            status = gazetteer.journal.status_skipped
+        else:
+            status = gazetteer.journal.status_loaded
+        journal.record(cursor, member, crc, table_name, rows, status,
+                       started)
+
+    if fingerprints is not None and fingerprint is not None and \
+            not isinstance(table, gazetteer.tables.GazetteerTableDuplicate):
+        fingerprints.record(cursor, table_name, member, fingerprint,
+                            table.parent.full_table_name
+                            if table.parent is not None else None,
+                            os.path.basename(args.file), options)
+
+    if args.commit_each:
+        save_dictionaries()
+        with metrics.phase('commit'):
+            upload_connection.commit()
+
+    return table_name
 
-    if not table.check_header(text_file_object.readline(), print_debug=True):
-        print('File ''{}'' does not have the correct header'.format(filename))
-        sys.exit(1)
 
-    table.copy_data(text_file_object, cursor)
+def finish_tables(prepared_tables, cursor):
+    '''Complete the upload of any tables being uploaded as deltas, before the
+    transaction is committed'''
+
+    for delta in prepared_tables.values():
+        if delta is not None:
+            with metrics.phase('delta_apply', delta.table.full_table_name):
+                delta.apply(cursor)
+            metrics.set_info(delta.table.full_table_name,
+                             rows_changed=delta.rows_changed)
+            print('Uploaded {} new or changed rows to {}.'
+                  .format(delta.rows_changed, delta.table.full_table_name))
+
+
+def process_file_sqlite(filename, file_object, prepared_tables):
+    '''Process a file and if appropriate insert its data into the SQLite
+    database. prepared_tables is a dict of the tables that have already been
+    created or cleared, recording whether each had search indexes that need
+    to be rebuilt.'''
+
+    table = identify_table(filename)
+
+    if isinstance(table, gazetteer.tables.GazetteerTableDuplicate):
+        return None
+
+    # SQLite has no partitions, so all of the data goes in one table
+
+    table = table.parent or table
+
+    name = getattr(file_object, 'name', None) or filename
+    file_object = metrics.measure(file_object, name)
+    metrics.set_info(name, table=table.full_table_name, header_lines=1)
+
+    print('Uploading ''{}'' data to {}.'.format(
+        filename, gazetteer.sqlitedb.table_name(table)))
+
+    if table.full_table_name not in prepared_tables:
+        with metrics.phase('prepare', table.full_table_name):
+            sqlite_connection.execute(
+                gazetteer.sqlitedb.generate_sql_ddl(table, if_not_exists=True))
+            prepared_tables[table.full_table_name] = \
+                gazetteer.sqlitedb.search_indexes_exist(sqlite_connection,
+                                                        table)
+            if args.replace:
+                gazetteer.sqlitedb.truncate_table(sqlite_connection, table)
+
+    if table.load_profile is not None:
+        file_object = table.load_profile.filter(table, file_object,
+                                                header=True)
+
+    if sampler is not None:
+        file_object = sampler.filter(table, file_object, header=True)
+
+    if args.cluster and table.coordinates is not None:
+        with metrics.phase('cluster', name):
+            file_object = gazetteer.clustering.cluster_records(
+                table, file_object, args.cluster_memory, header=True)
+
+    with metrics.phase('copy', name):
+        try:
+            gazetteer.sqlitedb.load_file(sqlite_connection, table,
+                                         file_object)
+        except (ValueError, sqlite3.IntegrityError) as err:
+            print('Cannot upload ''{}'': {}'.format(filename, err))
+            sys.exit(1)
 
     return table.full_table_name
 
 
+def save_dictionaries():
+    '''Save any new values in the dictionaries and commit them using the main
+    connection. This must be done before the rows that use their keys are
+    committed. It can be used by several threads at once.'''
+
+    if dictionaries:
+        with dictionaries_lock, connection.cursor() as cur:
+            for i in dictionaries.values():
+                with metrics.phase('dictionary', i.table.full_table_name):
+                    i.save(cur)
+
+            with metrics.phase('commit'):
+                connection.commit()
+
+
+def write_metrics():
+    '''Finish the progress line and write the metrics report if requested'''
+
+    metrics.finish_progress()
+
+    if args.metrics_file:
+        metrics.write_report(args.metrics_file)
+        args.metrics_file.close()
+
+
 # Find the files to process
 
 file_ext = os.path.splitext(args.file)[1]
 
+if file_ext == '.txt' or file_ext == '.csv':
+    file_names = [args.file, ]
+elif file_ext == '.zip':
+    with zipfile.ZipFile(args.file, 'r') as inputs:
+        file_names = inputs.namelist()
+else:
+    print('Cannot handle files of this type: {}'.format(file_ext))
+    sys.exit(1)
+
+# Upload to a SQLite database instead if requested. All of the files are
+# inserted in one transaction. SQLite does not maintain the R*Tree and FTS5
+# indexes as the data changes, so any that exist are rebuilt afterwards.
+
+if args.sqlite:
+    sqlite_connection = gazetteer.sqlitedb.connect(args.sqlite)
+    sqlite_connection.execute('BEGIN;')
+
+    prepared_tables = {}
+    if file_ext == '.zip':
+        with zipfile.ZipFile(args.file, 'r') as inputs:
+            for i in file_names:
+                with inputs.open(i, 'r') as fp:
+                    process_file_sqlite(i, fp, prepared_tables)
+    else:
+        with open(args.file, 'rb') as fp:
+            process_file_sqlite(args.file, fp, prepared_tables)
+
+    for i, search_indexes in prepared_tables.items():
+        if search_indexes:
+            print('Rebuilding search indexes on {}.'.format(i))
+            with metrics.phase('index', i):
+                gazetteer.sqlitedb.build_search_indexes(
+                    sqlite_connection, gazetteer.gazetteer_tables[i])
+
+    with metrics.phase('commit'):
+        sqlite_connection.execute('COMMIT;')
+
+    for i in prepared_tables:
+        with metrics.phase('analyze', i):
+            sqlite_connection.execute('ANALYZE {};'.format(
+                gazetteer.sqlitedb.table_name(gazetteer.gazetteer_tables[i])))
+
+    sqlite_connection.close()
+    write_metrics()
+    sys.exit(0)
+
+connection = connect()
+
+# The workers uploading a .zip container in parallel each have their own
+# transaction, so the rows uploaded by one are not visible to the others
+# until the end. A foreign key that has been built between two of the tables
+# being uploaded would reject the rows that refer to rows uploaded by another
+# worker. Staging tables have no foreign keys, so --swap is not affected.
+
+if file_ext == '.zip' and args.jobs > 1 and not args.swap:
+    loaded_tables = set()
+    for i in file_names:
+        table = identify_table(i)
+        loaded_tables.add(table.full_table_name)
+        loaded_tables.add((table.parent or table).full_table_name)
+
+    with connection.cursor() as cur:
+        built_keys = [i.name for i in gazetteer.indexes.existing_foreign_keys(
+            cur, [i for i in foreign_keys
+                  if i.full_table_name in loaded_tables and
+                  i.foreign_schema + '.' + i.foreign_table_name
+                  in loaded_tables])]
+    connection.rollback()
+
+    if built_keys:
+        print('The foreign keys {} link tables being uploaded, so the files '
+              'cannot be uploaded in parallel. Use --jobs 1, --swap or drop '
+              'the foreign keys first.'.format(', '.join(sorted(built_keys))))
+        sys.exit(1)
+
+# Tables being replaced that are linked by foreign keys are truncated
+# together by one TRUNCATE statement, as PostgreSQL will not truncate a table
+# that is referred to by a foreign key from a table that is not truncated at
+# the same time. Each group of linked tables is uploaded in one transaction.
+# A table referred to by a foreign key from a table that is not being
+# replaced cannot be truncated without losing the data in the other table.
+
+replace_groups = {}
+
+if args.replace:
+    for i in file_names:
+        table = identify_table(i)
+        if not isinstance(table, gazetteer.tables.GazetteerTableDuplicate):
+            replace_groups[table.full_table_name] = \
+                {table.full_table_name: table}
+
+    for i in foreign_keys:
+        group = replace_groups.get(i.full_table_name)
+        foreign_group = replace_groups.get(
+            i.foreign_schema + '.' + i.foreign_table_name)
+        if group is not None and foreign_group is not None and \
+                group is not foreign_group:
+            group.update(foreign_group)
+            for j in foreign_group:
+                replace_groups[j] = group
+
+    with connection.cursor() as cur:
+        blocking_keys = gazetteer.indexes.existing_foreign_keys(
+            cur, [i for i in foreign_keys
+                  if i.full_table_name not in replace_groups and
+                  i.foreign_schema + '.' + i.foreign_table_name
+                  in replace_groups])
+    connection.rollback()
+
+    if blocking_keys:
+        print('The tables {} are referred to by the foreign keys {} on '
+              'tables that are not being replaced, so they cannot be '
+              'truncated. Upload the other tables as well or drop the '
+              'foreign keys first.'.format(
+                  ', '.join(sorted(set(i.foreign_schema + '.' +
+                                       i.foreign_table_name
+                                       for i in blocking_keys))),
+                  ', '.join(sorted(i.name for i in blocking_keys))))
+        sys.exit(1)
+
+# Load the existing dictionaries for the tables being uploaded with their
+# fields dictionary encoded. These are shared by all of the workers, so the
+# same value is given the same key whichever file it is in. They stay locked
+# against other processes until the upload is finished, and are locked in
+# order of their table names so that two uploads cannot deadlock.
+
+dictionaries = {}
+dictionaries_lock = threading.Lock()
+
+if args.dictionary:
+    for i in file_names:
+        table = identify_table(i)
+        table = table.parent or table
+        if table.dictionary_fields and \
+                table.full_table_name not in dictionaries:
+            dictionaries[table.full_table_name] = \
+                gazetteer.dictionary.DictionaryEncoding(table)
+
+    with connection.cursor() as cur:
+        for name, encoding in sorted(dictionaries.items()):
+            with metrics.phase('prepare', name):
+                encoding.begin(cur)
+
+    with metrics.phase('commit'):
+        connection.commit()
+
+# Create the load journal if requested and find what has already been
+# uploaded if the upload is being resumed
+
+journal = None
+journal_members = {}
+
+if args.journal:
+    journal = gazetteer.journal.LoadJournal(
+        gazetteer.journal.archive_identity(args.file))
+    with connection.cursor() as cur:
+        cur.execute(journal.generate_create_sql())
+        if args.resume:
+            journal_members = journal.members(cur)
+
+    with metrics.phase('commit'):
+        connection.commit()
+
+# Fetch the fingerprints of the files uploaded before if unchanged files are
+# to be skipped. If the contents of the tables are being replaced, the
+# fingerprints of the files uploaded to them before are forgotten instead.
+
+fingerprints = None
+member_fingerprints = {}
+
+if args.skip_unchanged:
+    fingerprints = gazetteer.fingerprints.FingerprintCache()
+    with connection.cursor() as cur:
+        cur.execute(fingerprints.generate_create_sql())
+        if args.replace or args.swap or args.delta:
+            for i in set(identify_table(j).full_table_name
+                         for j in file_names):
+                fingerprints.forget(cur, i)
+        else:
+            fingerprints.load(cur)
+
+    with metrics.phase('commit'):
+        connection.commit()
+
+    if file_ext == '.zip':
+        with zipfile.ZipFile(args.file, 'r') as inputs:
+            member_fingerprints = {
+                i.filename: gazetteer.fingerprints.member_fingerprint(i)
+                for i in inputs.infolist()}
+    else:
+        member_fingerprints = {
+            os.path.basename(args.file):
+            gazetteer.fingerprints.file_fingerprint(args.file)}
+
+# Create empty staging tables for the data if requested. These are committed
+# before the upload starts so that they are visible to all the connections.
+
+staging_tables = {}
+
+if args.swap:
+    for i in file_names:
+        table = identify_table(i)
+        if not isinstance(table, gazetteer.tables.GazetteerTableDuplicate) \
+                and table.full_table_name not in staging_tables:
+            staging_tables[table.full_table_name] = \
+                gazetteer.staging.StagingTable(
+                    table,
+                    gazetteer.gazetteer_tables_indexes.get(
+                        (table.parent or table).full_table_name, ()),
+                    geography=args.postgis, dictionary=args.dictionary)
+
+    # A whole partitioned table is staged with a staging copy of each of its
+    # partitions, so they cannot also be staged separately
+
+    for i in staging_tables.values():
+        if i.table.parent is not None and \
+                i.table.parent.full_table_name in staging_tables:
+            print('The partitioned table {} and its partition {} cannot both '
+                  'be swapped in one upload'
+                  .format(i.table.parent.full_table_name,
+                          i.table.full_table_name))
+            sys.exit(1)
+
+    with connection.cursor() as cur:
+        for i in staging_tables.values():
+            cur.execute(i.generate_create_sql())
+
+    with metrics.phase('commit'):
+        connection.commit()
+
+# Upload the data
+
 tables_modified = []
 
-if file_ext == '.txt' or file_ext == '.csv':
-    with open(args.file, 'rt') as fp, \
+if (file_ext == '.txt' or file_ext == '.csv') and \
+        (args.jobs == 1 or args.replace or args.delta or args.cluster or
+         args.journal or args.skip_unchanged or
+         os.path.getsize(args.file) == 0):
+    with open(args.file, 'rb') as fp, \
             connection.cursor() as cur:
 
-        tables_modified.append(process_file(args.file, fp, cur))
+        prepared_tables = {}
+        tables_modified.append(upload_member(args.file, fp, connection, cur,
+                                             prepared_tables))
+        finish_tables(prepared_tables, cur)
 
-    connection.commit()
+    save_dictionaries()
+    with metrics.phase('commit'):
+        connection.commit()
 
-elif file_ext == '.zip':
+elif file_ext == '.txt' or file_ext == '.csv':
+
+    # A single file is split into ranges on record boundaries which are each
+    # uploaded concurrently through their own connection. Only the first
+    # range includes the header line. A table being replaced or uploaded as a
+    # delta must be loaded by a single transaction, a clustered file must be
+    # sorted as a whole and a file recorded in the journal or the
+    # fingerprint table must be uploaded in the same transaction as its
+    # record, so this is not done in those cases.
+
+    def process_range(buf, start, end):
+        '''Process the part of a memory-mapped file from start to end using
+        a new connection, which is returned along with the table name'''
+
+        range_connection = connect()
+        with gazetteer.streams.open_range(
+                buf, start, end,
+                '{}[{}:{}]'.format(args.file, start, end)) as fp, \
+                range_connection.cursor() as cur:
+            return range_connection, process_file(args.file, fp, cur,
+                                                  header=(start == 0))
+
+    with open(args.file, 'rb') as fp, \
+            mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+
+        split_points = identify_table(args.file).find_split_points(
+            buf, buf.find(b'\n') + 1, args.jobs)
+        split_points[0] = 0
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) \
+                as executor:
+            futures = [executor.submit(process_range, buf, start, end)
+                       for start, end in zip(split_points, split_points[1:])]
+            results = [i.result() for i in futures]
+
+    save_dictionaries()
+    for range_connection, table_name in results:
+        tables_modified.append(table_name)
+        with metrics.phase('commit'):
+            range_connection.commit()
+        if not args.dry_run:
+            range_connection.close()
+
+elif file_ext == '.zip' and args.jobs == 1:
     with zipfile.ZipFile(args.file, 'r') as inputs, \
             connection.cursor() as cur:
 
-        for i in inputs.namelist():
+        prepared_tables = {}
+        for i in inputs.infolist():
             with inputs.open(i, 'r') as fp:
-                tables_modified.append(process_file(i, fp, cur))
+                tables_modified.append(upload_member(i.filename, fp,
+                                                     connection, cur,
+                                                     prepared_tables, i.CRC))
+        finish_tables(prepared_tables, cur)
 
+    save_dictionaries()
+    with metrics.phase('commit'):
+        connection.commit()
+
+elif file_ext == '.zip':
+
+    # Each worker thread has its own connection and its own handle on the .zip
+    # file. The largest files are started first as they dominate the total
+    # run time. Every connection is only committed once all of the files have
+    # been uploaded successfully. If tables are being replaced or uploaded as
+    # deltas, all of the files for a table must be uploaded in one transaction
+    # so they are handled together by one worker, along with the files for
+    # any tables being replaced that are truncated at the same time.
+
+    worker_state = threading.local()
+    worker_resources = []
+    worker_resources_lock = threading.Lock()
+
+    def process_members(members):
+        '''Process a list of members of the .zip file using the connection
+        and .zip file handle belonging to the current worker thread'''
+
+        if not hasattr(worker_state, 'connection'):
+            worker_state.connection = connect()
+            worker_state.inputs = zipfile.ZipFile(args.file, 'r')
+            with worker_resources_lock:
+                worker_resources.append((worker_state.connection,
+                                         worker_state.inputs))
+
+        result = []
+        prepared_tables = {}
+        with worker_state.connection.cursor() as cur:
+            for i in members:
+                with worker_state.inputs.open(i, 'r') as fp:
+                    result.append(upload_member(i.filename, fp,
+                                                worker_state.connection, cur,
+                                                prepared_tables, i.CRC))
+            finish_tables(prepared_tables, cur)
+        return result
+
+    with zipfile.ZipFile(args.file, 'r') as inputs:
+        if args.replace or args.delta:
+            members_by_table = {}
+            for i in inputs.infolist():
+                name = identify_table(i.filename).full_table_name
+                if name in replace_groups:
+                    name = min(replace_groups[name])
+                members_by_table.setdefault(name, []).append(i)
+            work = list(members_by_table.values())
+        else:
+            work = [[i, ] for i in inputs.infolist()]
+
+    work.sort(key=lambda x: sum(i.file_size for i in x), reverse=True)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) \
+            as executor:
+        futures = [executor.submit(process_members, i) for i in work]
+        try:
+            for i in futures:
+                tables_modified.extend(i.result())
+        except BaseException:
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+
+    save_dictionaries()
+    for worker_connection, worker_inputs in worker_resources:
+        with metrics.phase('commit'):
+            worker_connection.commit()
+        worker_inputs.close()
+        if not args.dry_run:
+            worker_connection.close()
+
+# All of the new dictionary values have been saved, so other uploads can now
+# use the dictionaries
+
+if dictionaries:
+    with connection.cursor() as cur:
+        for i in dictionaries.values():
+            i.release(cur)
     connection.commit()
 
-else:
-    print('Cannot handle files of this type: {}'.format(file_ext))
-    sys.exit(1)
+# Index the staging tables and swap them in place of the live tables. The
+# indexes are built before the swap so that the transaction that swaps the
+# tables is short.
+
+recreated_keys = []
+deferred_keys = []
+partitioned_tables = [
+    name for name, table in gazetteer.gazetteer_tables.items()
+    if isinstance(table, gazetteer.tables.GazetteerPartitionedTable)]
+
+if staging_tables:
+    with connection.cursor() as cur:
+        for i in staging_tables.values():
+            print('Building indexes on {}.'.format(i.full_table_name))
+            with metrics.phase('index', i.table.full_table_name):
+                cur.execute(i.generate_index_sql())
+                connection.commit()
+
+        print('Swapping staging tables into place.')
+        with metrics.phase('swap'):
+            recreated_keys, deferred_keys = \
+                gazetteer.staging.swap_staging_tables(
+                    staging_tables.values(), foreign_keys, cur,
+                    partitioned_tables)
+
+            for i in staging_tables.values():
+                for j in [i] + i.partitions:
+                    cur.execute(gazetteer.delta.DeltaLoad(j.table)
+                                .generate_drop_sql())
+
+            connection.commit()
 
 
 # Update database statistics
@@ -176,7 +1273,30 @@ else:
 connection.autocommit = True
 
 with connection.cursor() as cur:
-    for i in tables_modified:
-        cur.execute('VACUUM ANALYZE {};'.format(i))
+    for i in recreated_keys:
+        with metrics.phase('validate', i.full_table_name):
+            cur.execute(i.generate_validate_sql())
+
+    # The foreign keys on partitioned tables could not be added NOT VALID
+    # during the swap, so they are added and checked now
+
+    for i in deferred_keys:
+        with metrics.phase('validate', i.full_table_name):
+            cur.execute(i.generate_sql(drop_existing=True))
+
+    # Frozen rows already have their visibility information set so only the
+    # statistics need to be updated
+
+    for i in dict.fromkeys(tables_modified):
+        if i is None:
+            continue
+        if args.replace:
+            with metrics.phase('analyze', i):
+                cur.execute('ANALYZE {};'.format(i))
+        else:
+            with metrics.phase('vacuum_analyze', i):
+                cur.execute('VACUUM ANALYZE {};'.format(i))
 
 connection.close()
+
+write_metrics()
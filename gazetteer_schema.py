@@ -26,11 +26,19 @@ the supported sources.'''
 import os
 import sys
 import argparse
+import zipfile
 
 import psycopg2
 
 import gazetteer
+import gazetteer.delta
+import gazetteer.fingerprints
+import gazetteer.indexes
 import gazetteer.mockdb
+import gazetteer.profiling
+import gazetteer.projection
+import gazetteer.sqlitedb
+import gazetteer.tables
 
 # Parse command line arguments
 
@@ -38,9 +46,9 @@ parser = argparse.ArgumentParser(description='Create or modify a PostgreSQL '
                                  'database schema for gazetteer data')
 parser.add_argument('action', metavar='ACTION',
                     choices=['create', 'truncate', 'index',
-                             'dropindex', 'list'],
+                             'dropindex', 'list', 'profile'],
                     help='Whether to "create", "truncate", "index", '
-                         '"dropindex" or "list" tables')
+                         '"dropindex", "list" or "profile" tables')
 parser.add_argument('table',
                     help='The database schema or table to act on, or ALL',
                     metavar='TABLE', nargs='?', default='ALL')
@@ -50,12 +58,40 @@ parser_po.add_argument('--drop-existing', help='Drop existing tables or '
                        'indexes (and any data) before recreating',
                        action='store_true',
                        default=False)
+parser_po.add_argument('--postgis', help='Add a PostGIS geography column '
+                       'computed from the coordinates to the tables that '
+                       'have them, and a GiST index on it',
+                       action='store_true', default=False)
+parser_po.add_argument('--dictionary', help='Store integer keys in place of '
+                       'the values of the fields that can be dictionary '
+                       'encoded, with the values in separate tables and a '
+                       'view that decodes them',
+                       action='store_true', default=False)
+parser_po.add_argument('--load-profile', help='A JSON file giving the fields '
+                       'to create for each table, as used by '
+                       'gazetteer_extract.py', metavar='PROFILE FILE',
+                       default=None, type=argparse.FileType('r'))
+
+parser_pr = parser.add_argument_group('profiling options')
+parser_pr.add_argument('--file', help='The data file (.txt, .csv or .zip) to '
+                       'profile', metavar='DATA FILE', default=None)
+parser_pr.add_argument('--ddl', help='Print the SQL to create the profiled '
+                       'tables with the recommended field types',
+                       action='store_true', default=False)
+parser_pr.add_argument('--apply', help='Change the fields of the profiled '
+                       'tables in the database to the recommended types',
+                       action='store_true', default=False)
 
 parser_db = parser.add_argument_group('database arguments')
 parser_db.add_argument('--dry-run', help='Dump commands to a file rather than '
                                          'executing them on the database',
                        nargs='?', metavar='LOG FILE', default=None,
                        type=argparse.FileType('x'))
+parser_db.add_argument('--sqlite',
+                       help='Act on this SQLite database file rather than '
+                            'on PostgreSQL. Indexing also builds R*Tree '
+                            'indexes on coordinates and FTS5 indexes on '
+                            'names.', metavar='SQLITE FILE', default=None)
 parser_db.add_argument('--database',
                        help='PostgreSQL database to use (default gazetteer)',
                        action='store', default='gazetteer')
@@ -73,6 +109,18 @@ parser_db.add_argument("--maintenance-work-mem",
                        action="store", type=int, default=0)
 args = parser.parse_args()
 
+# Trim the tables to the fields that are to be uploaded, and leave out any
+# indexes on the other fields
+
+if args.load_profile:
+    try:
+        gazetteer.apply_load_profiles(
+            gazetteer.projection.read_load_profiles(args.load_profile))
+    except ValueError as err:
+        print('Cannot use the load profile: {}'.format(err))
+        sys.exit(1)
+    args.load_profile.close()
+
 # Identify the required tables and schemas
 
 if args.table == 'ALL':
@@ -101,6 +149,170 @@ if args.action == 'list':
                 print(' {0}'.format(j))
     sys.exit(0)
 
+# Profile the values in a data file if requested. The database is only used
+# if the recommended field types are to be applied.
+
+profiles = {}
+
+
+def profile_file(filename, file_object):
+    '''Add the data in a file to the profile of its table, unless it is not
+    one of the tables selected'''
+
+    table = gazetteer.find_table(os.path.split(filename)[-1])
+    if table is None and len(tables) == 1:
+        table = gazetteer.gazetteer_tables[list(tables)[0]]
+
+    if table is None or table.full_table_name not in tables or \
+            isinstance(table, gazetteer.tables.GazetteerTableDuplicate):
+        print('Skipping ''{}''.'.format(filename))
+        return
+
+    print('Profiling ''{}'' data for {}.'.format(filename,
+                                                 table.full_table_name))
+    if table.load_profile is not None:
+        file_object = table.load_profile.filter(table, file_object,
+                                                header=True)
+    if table.full_table_name not in profiles:
+        profiles[table.full_table_name] = \
+            gazetteer.profiling.TableProfile(table)
+
+    try:
+        profiles[table.full_table_name].add_file(file_object)
+    except ValueError as err:
+        print('Cannot profile ''{}'': {}'.format(filename, err))
+        sys.exit(1)
+
+
+def print_profile(profile):
+    '''Print a summary of each field of a profiled table along with the
+    recommended type'''
+
+    def shorten(value):
+        text = '' if value is None else str(value)
+        return text if len(text) <= 12 else text[:11] + '~'
+
+    print('\nTable {} ({} rows from {} files):'
+          .format(profile.table.full_table_name, profile.rows,
+                  profile.files))
+    print('  {:<24} {:>6} {:>9} {:>6} {:>12} {:>12}  {}'
+          .format('Field', 'NULL %', 'Distinct', 'Length', 'Minimum',
+                  'Maximum', 'Type'))
+
+    for column, field in zip(profile.columns, profile.recommended_fields()):
+        if field is column.field:
+            field_type = field.sql_type()
+        else:
+            field_type = '{} -> {}'.format(column.field.sql_type(),
+                                           field.sql_type())
+        if column.invalid:
+            field_type += ' ({} invalid values)'.format(column.invalid)
+
+        print('  {:<24} {:>6.1f} {:>9} {:>6} {:>12} {:>12}  {}'
+              .format(field.sql_name, column.null_rate() * 100,
+                      column.cardinality(), column.max_length,
+                      shorten(column.minimum), shorten(column.maximum),
+                      field_type))
+
+
+if args.action == 'profile':
+    if args.file is None:
+        print('The file to profile must be given with --file')
+        sys.exit(1)
+
+    if args.apply and args.sqlite:
+        print('SQLite does not enforce field types, so they cannot be '
+              'applied')
+        sys.exit(1)
+
+    file_ext = os.path.splitext(args.file)[1]
+
+    if file_ext == '.txt' or file_ext == '.csv':
+        with open(args.file, 'rb') as fp:
+            profile_file(args.file, fp)
+    elif file_ext == '.zip':
+        with zipfile.ZipFile(args.file, 'r') as inputs:
+            for i in inputs.namelist():
+                with inputs.open(i, 'r') as fp:
+                    profile_file(i, fp)
+    else:
+        print('Cannot handle files of this type: {}'.format(file_ext))
+        sys.exit(1)
+
+    for i in profiles.values():
+        print_profile(i)
+
+    if args.ddl:
+        for i in profiles.values():
+            print()
+            print(i.recommended_table().generate_sql_ddl())
+
+    if not args.apply:
+        sys.exit(0)
+
+# Act on a SQLite database instead if requested. Dropping the indexes also
+# drops the R*Tree and FTS5 indexes, and creating them builds them from the
+# data already in the tables.
+
+if args.sqlite:
+    if args.dry_run or args.postgis or args.dictionary:
+        print('The --dry-run, --postgis and --dictionary options cannot be '
+              'used with --sqlite')
+        sys.exit(1)
+
+    connection = gazetteer.sqlitedb.connect(args.sqlite)
+    connection.execute('BEGIN;')
+
+    tables_modified = []
+
+    for table in tables:
+        gazetteer_table = gazetteer.gazetteer_tables[table]
+        btree_indexes = [
+            i for i in gazetteer.gazetteer_tables_indexes.get(table, ())
+            if isinstance(i, gazetteer.indexes.GazetteerBTreeIndex)]
+
+        if args.action == 'truncate':
+            gazetteer.sqlitedb.truncate_table(connection, gazetteer_table)
+
+        elif args.action == 'create':
+            if args.drop_existing:
+                for i in gazetteer.sqlitedb.generate_drop_search_sql(
+                        gazetteer_table):
+                    connection.execute(i)
+                connection.execute('DROP TABLE IF EXISTS {};'.format(
+                    gazetteer.sqlitedb.table_name(gazetteer_table)))
+            connection.execute(gazetteer.sqlitedb.generate_sql_ddl(
+                gazetteer_table))
+
+        elif args.action == 'index':
+            for index in btree_indexes:
+                if args.drop_existing:
+                    connection.execute(
+                        gazetteer.sqlitedb.generate_drop_index_sql(index))
+                connection.execute(
+                    gazetteer.sqlitedb.generate_index_sql(index))
+            gazetteer.sqlitedb.build_search_indexes(connection,
+                                                    gazetteer_table)
+            tables_modified.append(table)
+
+        elif args.action == 'dropindex':
+            for index in btree_indexes:
+                connection.execute(
+                    gazetteer.sqlitedb.generate_drop_index_sql(index))
+            for i in gazetteer.sqlitedb.generate_drop_search_sql(
+                    gazetteer_table):
+                connection.execute(i)
+
+    connection.execute('COMMIT;')
+
+    # The query planner needs statistics to choose between the new indexes
+
+    for i in tables_modified:
+        connection.execute('ANALYZE {};'.format(
+            gazetteer.sqlitedb.table_name(gazetteer.gazetteer_tables[i])))
+    connection.close()
+    sys.exit(0)
+
 # Create database connection
 
 if args.dry_run:
@@ -111,7 +323,7 @@ else:
                                       user=args.user,
                                       password=args.password,
                                       host=args.host,
-                                      port=args.post)
+                                      port=args.port)
     else:
         connection = psycopg2.connect(database=args.database,
                                       user=args.user,
@@ -119,6 +331,41 @@ else:
 
 # Create tables or truncate them
 
+
+def delta_tables(table_name):
+    '''Return a list of the table and any partitions of it, each of which can
+    have its own row hashes for delta uploads'''
+
+    result = [gazetteer.gazetteer_tables[table_name], ]
+    if isinstance(result[0], gazetteer.tables.GazetteerPartitionedTable):
+        result += result[0].partitions()
+    return result
+
+
+def referring_tables(table_name):
+    '''Return a sorted list of the names of the tables with foreign keys that
+    refer to the table, directly or through other tables, which TRUNCATE ...
+    CASCADE empties along with it'''
+
+    foreign_keys = [
+        i for indexes in gazetteer.gazetteer_tables_indexes.values()
+        for i in indexes
+        if isinstance(i, gazetteer.indexes.GazetteerForeignKey)]
+
+    result = set()
+    pending = [table_name, ]
+    while pending:
+        name = pending.pop()
+        for i in foreign_keys:
+            if i.foreign_schema + '.' + i.foreign_table_name == name and \
+                    i.full_table_name != table_name and \
+                    i.full_table_name not in result:
+                result.add(i.full_table_name)
+                pending.append(i.full_table_name)
+
+    return sorted(result)
+
+
 tables_modified = []
 
 with connection.cursor() as cur:
@@ -126,31 +373,74 @@ with connection.cursor() as cur:
         cur.execute("SET SESSION maintenance_work_mem=%s;",
                     (args.maintenance_work_mem*1024,))
 
+    if args.postgis:
+        cur.execute('CREATE EXTENSION IF NOT EXISTS postgis;')
+
     for i in schemas:
         cur.execute('CREATE SCHEMA IF NOT EXISTS {};'.format(i))
 
+    # The fingerprints recorded by gazetteer_extract.py --skip-unchanged must
+    # be forgotten along with the data, or the files would not be uploaded
+    # again
+
+    fingerprints = None
+    if args.action == 'truncate' or \
+            (args.action == 'create' and args.drop_existing):
+        fingerprints = gazetteer.fingerprints.FingerprintCache()
+        cur.execute(fingerprints.generate_create_sql())
+
     for table in tables:
+        indexes = list(gazetteer.gazetteer_tables_indexes.get(table, ()))
+        if args.postgis and \
+                gazetteer.gazetteer_tables[table].coordinates is not None:
+            indexes.append(gazetteer.gazetteer_tables[table]
+                           .geography_index())
+
+        # The row hashes used by delta uploads and the fingerprints of the
+        # files uploaded no longer describe the data once it is removed,
+        # including the data of the tables emptied by TRUNCATE ... CASCADE
+
         if args.action == 'truncate':
             cur.execute('TRUNCATE TABLE {} CASCADE;'.format(table))
+            for i in [table, ] + referring_tables(table):
+                for j in delta_tables(i):
+                    cur.execute(gazetteer.delta.DeltaLoad(j)
+                                .generate_drop_sql())
+                fingerprints.forget(cur, i)
             tables_modified.append(table)
 
         elif args.action == 'create':
             if args.drop_existing:
                 cur.execute('DROP TABLE IF EXISTS {} CASCADE;'
                             .format(table))
+                for i in delta_tables(table):
+                    cur.execute(gazetteer.delta.DeltaLoad(i)
+                                .generate_drop_sql())
+                fingerprints.forget(cur, table)
                 tables_modified.append(table)
-            cur.execute(gazetteer.gazetteer_tables[table].generate_sql_ddl())
+            cur.execute(gazetteer.gazetteer_tables[table].generate_sql_ddl(
+                geography=args.postgis, dictionary=args.dictionary))
+            if args.dictionary and \
+                    gazetteer.gazetteer_tables[table].dictionary_fields:
+                cur.execute(gazetteer.gazetteer_tables[table]
+                            .generate_dictionary_sql())
+                cur.execute(gazetteer.gazetteer_tables[table]
+                            .generate_view_sql(args.postgis))
 
         elif args.action == 'index':
-            if table in gazetteer.gazetteer_tables_indexes:
-                for index in gazetteer.gazetteer_tables_indexes[table]:
-                    cur.execute(index.
-                                generate_sql(drop_existing=args.drop_existing))
+            for index in indexes:
+                cur.execute(index.
+                            generate_sql(drop_existing=args.drop_existing))
 
         elif args.action == 'dropindex':
-            if table in gazetteer.gazetteer_tables_indexes:
-                for index in gazetteer.gazetteer_tables_indexes[table]:
-                    cur.execute(index.generate_drop_sql())
+            for index in indexes:
+                cur.execute(index.generate_drop_sql())
+
+        elif args.action == 'profile' and table in profiles:
+            sql = profiles[table].generate_alter_sql()
+            if sql is not None:
+                cur.execute(sql)
+                tables_modified.append(table)
 
     connection.commit()
 
@@ -0,0 +1,82 @@
+# tests.test_clustering
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Tests of the Hilbert curve keys used to cluster records'''
+
+import unittest
+
+from gazetteer.clustering import hilbert_key, hilbert_order, \
+    no_coordinates_key
+
+
+def cell_centre(x, y, order):
+    '''Return the latitude and longitude of the centre of a cell of the grid
+    of 2**order by 2**order cells'''
+
+    side = 1 << order
+    return (y + 0.5) * 180.0 / side - 90.0, (x + 0.5) * 360.0 / side - 180.0
+
+
+class TestHilbertKey(unittest.TestCase):
+
+    def test_first_order(self):
+
+        # The first order curve visits the south west, north west, north
+        # east and south east quarters of the world in turn
+
+        self.assertEqual([hilbert_key(-45.0, -90.0, 1),
+                          hilbert_key(45.0, -90.0, 1),
+                          hilbert_key(45.0, 90.0, 1),
+                          hilbert_key(-45.0, 90.0, 1)],
+                         [0, 1, 2, 3])
+
+    def test_curve_is_continuous(self):
+
+        # Every cell has its own key, and the cells with consecutive keys
+        # are next to each other
+
+        order = 4
+        side = 1 << order
+        cells = {}
+        for x in range(side):
+            for y in range(side):
+                cells[hilbert_key(*cell_centre(x, y, order), order)] = (x, y)
+
+        self.assertEqual(sorted(cells), list(range(side * side)))
+        for i in range(1, side * side):
+            (x1, y1), (x2, y2) = cells[i - 1], cells[i]
+            self.assertEqual(abs(x1 - x2) + abs(y1 - y2), 1)
+
+    def test_limits(self):
+
+        # Points on or beyond the edges of the world are put in the cells at
+        # the edges, so every key is before the key for no coordinates
+
+        self.assertEqual(hilbert_key(-90.0, -180.0), 0)
+        self.assertEqual(hilbert_key(90.0, 180.0), hilbert_key(100.0, 200.0))
+        self.assertEqual(hilbert_key(-90.0, 180.0),
+                         (1 << (2 * hilbert_order)) - 1)
+        for lat in (-90.0, 0.0, 90.0):
+            for long in (-180.0, 0.0, 180.0):
+                self.assertLess(hilbert_key(lat, long), no_coordinates_key)
+
+
+if __name__ == '__main__':
+    unittest.main()
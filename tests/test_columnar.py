@@ -0,0 +1,59 @@
+# tests.test_columnar
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Tests of the splitting of COPY text format data in gazetteer.columnar'''
+
+import unittest
+
+from gazetteer.columnar import split_copy_text
+
+
+class TestSplitCopyText(unittest.TestCase):
+
+    def test_no_escapes(self):
+        self.assertEqual(split_copy_text('a|b||c', '|'),
+                         ['a', 'b', '', 'c'])
+
+    def test_escaped_separator(self):
+        self.assertEqual(split_copy_text('a\\|b|c', '|'), ['a|b', 'c'])
+
+    def test_escaped_backslash(self):
+        self.assertEqual(split_copy_text('a\\\\|b', '|'), ['a\\', 'b'])
+
+    def test_escaped_tab_separator(self):
+        self.assertEqual(split_copy_text('a\\\tb\tc', '\t'), ['a\tb', 'c'])
+
+    def test_control_escapes(self):
+        self.assertEqual(split_copy_text('\\n\\r\\t\\b\\f\\v', '|'),
+                         ['\n\r\t\b\f\v'])
+
+    def test_octal_and_hexadecimal_escapes(self):
+        self.assertEqual(split_copy_text('\\101\\x42\\7|\\x4', '|'),
+                         ['AB\x07', '\x04'])
+
+    def test_other_escapes(self):
+        self.assertEqual(split_copy_text('\\a\\x|\\9', '|'), ['ax', '9'])
+
+    def test_trailing_separator(self):
+        self.assertEqual(split_copy_text('a\\\\|', '|'), ['a\\', ''])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# tests.test_dictionary
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Tests of the replacement of dictionary encoded fields by their keys as
+the data is read'''
+
+import io
+import unittest
+
+import gazetteer
+from gazetteer.dictionary import DictionaryEncoding, DictionaryReader
+
+
+def features_record(county_name, map_name):
+    '''Return a record for usgnis.features with the given values of
+    county_name and map_name, with every other field set to x'''
+
+    table = gazetteer.gazetteer_tables['usgnis.features']
+    names = [i.sql_name for i in table.fields]
+    fields = [b'x'] * len(names)
+    fields[names.index('county_name')] = county_name
+    fields[names.index('map_name')] = map_name
+    return b'|'.join(fields) + b'\n'
+
+
+class TestDictionaryEncoding(unittest.TestCase):
+
+    def setUp(self):
+        self.table = gazetteer.gazetteer_tables['usgnis.features']
+        self.encoding = DictionaryEncoding(self.table)
+        names = [i.sql_name for i in self.table.fields]
+        self.county = self.encoding.dictionaries[names.index('county_name')]
+        self.map = self.encoding.dictionaries[names.index('map_name')]
+
+    def encode(self, *records):
+        return self.encoding.filter(io.BytesIO(b''.join(records))).read()
+
+    def test_keys_assigned(self):
+        result = self.encode(features_record(b'Kent', b'Dover'),
+                             features_record(b'Sussex', b'Dover'),
+                             features_record(b'Kent', b'Rye'))
+
+        self.assertEqual(result, features_record(b'1', b'1') +
+                         features_record(b'2', b'1') +
+                         features_record(b'1', b'2'))
+        self.assertEqual(self.county.new_values, [b'Kent', b'Sussex'])
+        self.assertEqual(self.map.new_values, [b'Dover', b'Rye'])
+
+    def test_existing_keys(self):
+
+        # The values already in the dictionary table keep their keys, and
+        # new values are numbered after them
+
+        reader = DictionaryReader('test', b'|', 'UTF-8')
+        reader.write(b'7|Kent\n')
+        reader.write(b'3|Sus')
+        reader.write(b'sex\n')
+        self.county.keys = reader.keys
+        self.county.next_key = 8
+
+        result = self.encode(features_record(b'Sussex', b'Rye'),
+                             features_record(b'Essex', b'Rye'))
+
+        self.assertEqual(result, features_record(b'3', b'1') +
+                         features_record(b'8', b'1'))
+        self.assertEqual(self.county.new_values, [b'Essex'])
+
+    def test_null_values(self):
+        result = self.encode(features_record(b'', b''))
+
+        self.assertEqual(result, features_record(b'', b''))
+        self.assertEqual(self.county.new_values, [])
+
+    def test_escaped_separator(self):
+
+        # An escaped separator is part of the value, so the fields after it
+        # are not shifted
+
+        result = self.encode(features_record(b'Kent\\|Sussex', b'Rye'))
+
+        self.assertEqual(result, features_record(b'1', b'1'))
+        self.assertEqual(self.county.new_values, [b'Kent\\|Sussex'])
+
+    def test_too_many_values(self):
+        self.county.max_key = 1
+
+        with self.assertRaisesRegex(ValueError, 'too many values'):
+            self.encode(features_record(b'Kent', b'Rye'),
+                        features_record(b'Sussex', b'Rye'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+# tests.test_extract
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Tests of the upload modes of gazetteer_extract.py, run against the mock
+database so that the statements it would execute can be checked'''
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import gazetteer
+import gazetteer.bench
+
+script = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'gazetteer_extract.py')
+
+
+class ExtractTestCase(unittest.TestCase):
+    '''Base class for tests that run gazetteer_extract.py on data files
+    written to a temporary directory'''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_file(self, table_name, rows=20, filename=None):
+        '''Write a data file for the table and return its path'''
+
+        table = gazetteer.gazetteer_tables[table_name]
+        if filename is None:
+            filename = gazetteer.bench.example_filename(table)
+        path = os.path.join(self.directory.name, filename)
+        gazetteer.bench.write_file(table, path, rows)
+        return path
+
+    def extract(self, path, *args, check=True):
+        '''Run gazetteer_extract.py with --dry-run on the file at path with
+        the extra arguments given. Return the completed process and the
+        statements logged.'''
+
+        log = os.path.join(self.directory.name, 'dry_run.log')
+        process = subprocess.run(
+            [sys.executable, script, path] + list(args) +
+            ['--dry-run-consume', '--dry-run', log],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        if check:
+            self.assertEqual(process.returncode, 0, process.stderr)
+
+        with open(log) as fp:
+            return process, fp.read()
+
+    def assertInOrder(self, statements, log):
+        '''Check that each of the statements appears in the log after the
+        ones before it'''
+
+        position = 0
+        for i in statements:
+            found = log.find(i, position)
+            self.assertNotEqual(found, -1,
+                                '{!r} not found in order'.format(i))
+            position = found + len(i)
+
+
+class TestSwap(ExtractTestCase):
+
+    def test_swap(self):
+        path = self.write_file('usnga.country_codes')
+        _, log = self.extract(path, '--swap')
+
+        self.assertInOrder(
+            ('CREATE UNLOGGED TABLE usnga.country_codes_staging',
+             'COPY usnga.country_codes_staging FROM STDIN',
+             'Consumed 20 rows',
+             'ADD CONSTRAINT country_codes_staging_pkey PRIMARY KEY',
+             'ALTER TABLE usnga.country_codes_staging SET LOGGED;',
+             'DROP TABLE IF EXISTS usnga.country_codes;',
+             'ALTER TABLE usnga.country_codes_staging RENAME TO '
+             'country_codes;',
+             'Committed transaction'),
+            log)
+        self.assertNotIn('COPY usnga.country_codes FROM STDIN', log)
+
+
+class TestSwapPartitioned(ExtractTestCase):
+
+    def test_swap(self):
+        path = self.write_file('usnga.geonames', 30)
+        _, log = self.extract(path, '--swap')
+
+        # The rows are routed to the staging partitions through a staging
+        # partitioned table, and the foreign keys on the partitioned table
+        # are only added once the swap has been committed
+
+        self.assertInOrder(
+            ('CREATE UNLOGGED TABLE usnga.geonames_aa_staging',
+             'ALTER TABLE usnga.geonames_staging ATTACH PARTITION '
+             'usnga.geonames_aa_staging',
+             'COPY usnga.geonames_staging FROM STDIN',
+             'Consumed 30 rows',
+             'ALTER TABLE usnga.geonames_staging DETACH PARTITION '
+             'usnga.geonames_aa_staging;',
+             'DROP TABLE IF EXISTS usnga.geonames_aa;',
+             'ALTER TABLE usnga.geonames_aa_staging RENAME TO geonames_aa;',
+             'Committed transaction',
+             'Set autocommit status to: True',
+             'FOREIGN KEY (DSG)'),
+            log)
+        self.assertNotIn('NOT VALID', log)
+
+
+class TestReplace(ExtractTestCase):
+
+    def write_partition_file(self, values):
+        '''Write a file for the usnga.geonames partition for AA, with rows
+        that have the given values of cc1, and return its path'''
+
+        table = gazetteer.gazetteer_tables['usnga.geonames']
+        index = [i.sql_name for i in table.fields].index('cc1')
+        rows = gazetteer.bench.generate_rows(table, len(values))
+
+        path = os.path.join(self.directory.name, 'aa.txt')
+        with open(path, 'w', encoding=table.encoding, newline='') as fp:
+            fp.write(next(rows))
+            for row, value in zip(rows, values):
+                fields = row.rstrip('\n').split(table.sep)
+                fields[index] = value
+                fp.write(table.sep.join(fields) + '\n')
+        return path
+
+    def test_replace(self):
+        path = self.write_partition_file(['AA'] * 10)
+        _, log = self.extract(path, '--replace')
+
+        self.assertInOrder(
+            ('CREATE TABLE IF NOT EXISTS usnga.geonames_aa PARTITION OF '
+             'usnga.geonames',
+             'TRUNCATE TABLE usnga.geonames_aa;',
+             'COPY usnga.geonames_aa FROM STDIN',
+             'FREEZE',
+             'Consumed 10 rows',
+             'Committed transaction'),
+            log)
+        self.assertNotIn('_staging', log)
+
+    def test_replace_stray_row(self):
+        path = self.write_partition_file(['AA'] * 5 + ['BB'] + ['AA'] * 4)
+        process, log = self.extract(path, '--replace', check=False)
+
+        self.assertNotEqual(process.returncode, 0)
+        self.assertIn('Row 6 of {} has cc1 BB'.format(path), process.stderr)
+        self.assertIn('Rolled back transaction', log)
+        self.assertNotIn('Committed transaction', log)
+
+
+if __name__ == '__main__':
+    unittest.main()
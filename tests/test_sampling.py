@@ -0,0 +1,203 @@
+# tests.test_sampling
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Tests of the deterministic sampling of records'''
+
+import io
+import unittest
+
+import gazetteer
+import gazetteer.indexes
+from gazetteer.sampling import RowSampler
+
+
+def make_record(table_name, **values):
+    '''Return a record for the table with the fields named set to the values
+    given, and every other field set to x'''
+
+    table = gazetteer.gazetteer_tables[table_name]
+    names = [i.sql_name for i in table.fields]
+    fields = [b'x'] * len(names)
+    for name, value in values.items():
+        fields[names.index(name)] = value
+    return table.sep.encode('ASCII').join(fields) + b'\n'
+
+
+def foreign_keys():
+    '''Return all of the foreign keys registered between the tables'''
+
+    return [i for i in set().union(
+        *gazetteer.gazetteer_tables_indexes.values())
+        if isinstance(i, gazetteer.indexes.GazetteerForeignKey)]
+
+
+class SamplingTestCase(unittest.TestCase):
+
+    def sample(self, sampler, table_name, records):
+        '''Return the list of records kept by the sampler'''
+
+        table = gazetteer.gazetteer_tables[table_name]
+        result = sampler.filter(table, io.BytesIO(b''.join(records)))
+        return list(table.iter_records(result))
+
+
+class TestRowSampler(SamplingTestCase):
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            RowSampler(fraction=0.5, every=2)
+        with self.assertRaises(ValueError):
+            RowSampler(fraction=0.0)
+        with self.assertRaises(ValueError):
+            RowSampler(fraction=1.5)
+        with self.assertRaises(ValueError):
+            RowSampler(every=0)
+        with self.assertRaises(ValueError):
+            RowSampler(stratum='cc1', cap=-1)
+
+    def test_fraction(self):
+        sampler = RowSampler(fraction=0.25)
+        records = [make_record('usgnis.features',
+                               feature_id=str(i).encode('ASCII'))
+                   for i in range(2000)]
+
+        kept = self.sample(sampler, 'usgnis.features', records)
+        self.assertTrue(400 < len(kept) < 600, len(kept))
+        self.assertEqual(kept, [i for i in records if i in kept])
+
+    def test_same_keys_in_each_table(self):
+
+        # The same feature_id values are kept in every table that has them,
+        # however the records are ordered
+
+        sampler = RowSampler(fraction=0.5)
+        ids = [str(i).encode('ASCII') for i in range(200)]
+
+        def kept_ids(table_name, ids):
+            records = [make_record(table_name, feature_id=i) for i in ids]
+            table = gazetteer.gazetteer_tables[table_name]
+            return set(table.split_record(i)[0] for i in
+                       self.sample(sampler, table_name, records))
+
+        self.assertEqual(kept_ids('usgnis.features', ids),
+                         kept_ids('usgnis.fed_codes', reversed(ids)))
+
+    def test_sample_key(self):
+        sampler = RowSampler(fraction=0.5, key='state_alpha')
+        records = [make_record('usgnis.features', feature_id=b'1',
+                               state_alpha=b'AL'),
+                   make_record('usgnis.features', feature_id=b'2',
+                               state_alpha=b'AL')]
+
+        self.assertIn(len(self.sample(sampler, 'usgnis.features', records)),
+                      (0, 2))
+
+    def test_every(self):
+        sampler = RowSampler(every=3)
+        records = [make_record('usgnis.features',
+                               feature_id=str(i).encode('ASCII'))
+                   for i in range(10)]
+
+        self.assertEqual(self.sample(sampler, 'usgnis.features', records),
+                         records[0::3])
+
+    def test_cap(self):
+
+        # The counts for each value continue from one file to the next
+
+        sampler = RowSampler(stratum='state_alpha', cap=2)
+        records = [make_record('usgnis.features', state_alpha=i)
+                   for i in (b'AL', b'AK', b'AL', b'AL', b'AK')]
+
+        self.assertEqual(self.sample(sampler, 'usgnis.features', records),
+                         records[0:3] + records[4:5])
+        self.assertEqual(self.sample(sampler, 'usgnis.features', records),
+                         [])
+
+    def test_escaped_separator(self):
+        sampler = RowSampler(stratum='state_alpha', cap=1)
+        records = [make_record('usgnis.features', feature_name=b'A\\|B',
+                               state_alpha=i)
+                   for i in (b'AL', b'AK', b'AL')]
+
+        self.assertEqual(self.sample(sampler, 'usgnis.features', records),
+                         records[0:2])
+
+
+class TestFollowForeignKeys(SamplingTestCase):
+
+    def test_code_tables_in_full(self):
+        sampler = RowSampler(fraction=0.1)
+        sampler.follow_foreign_keys(gazetteer.gazetteer_tables,
+                                    foreign_keys())
+
+        for i in ('usnga.feature_class_codes',
+                  'usnga.feature_designation_codes',
+                  'usgnis.feature_class_code_definitions',
+                  'uknptg.admin_areas', 'uknptg.regions'):
+            self.assertIn(i, sampler.full_tables)
+        for i in ('usnga.geonames', 'usgnis.features', 'uknptg.localities'):
+            self.assertNotIn(i, sampler.full_tables)
+
+        records = [make_record('usnga.feature_class_codes',
+                               feature_class=str(i).encode('ASCII'))
+                   for i in range(50)]
+        self.assertEqual(self.sample(sampler, 'usnga.feature_class_codes',
+                                     records), records)
+
+    def test_every_uploads_referred_tables_in_full(self):
+
+        # Taking every Nth row cannot keep the rows that are referred to, so
+        # all of the tables that are referred to are uploaded in full
+
+        sampler = RowSampler(every=10)
+        sampler.follow_foreign_keys(gazetteer.gazetteer_tables,
+                                    foreign_keys())
+
+        self.assertIn('uknptg.localities', sampler.full_tables)
+        self.assertNotIn('uknptg.localities_hierarchy', sampler.full_tables)
+
+    def test_referring_rows(self):
+
+        # A row of the hierarchy of localities is only kept if both of the
+        # localities it refers to are kept
+
+        sampler = RowSampler(fraction=0.5)
+        sampler.follow_foreign_keys(gazetteer.gazetteer_tables,
+                                    foreign_keys())
+        self.assertEqual(
+            sampler.hashed_fields['uknptg.localities_hierarchy'],
+            {'parentnptglocalitycode', 'childnptglocalitycode'})
+
+        codes = ['E{:07d}'.format(i).encode('ASCII') for i in range(40)]
+        kept = set(i for i in codes if sampler.sampled(i))
+        records = [b'"' + i + b'","' + j + b'",x,x,x,x,x\n'
+                   for i in codes for j in codes]
+
+        result = self.sample(sampler, 'uknptg.localities_hierarchy', records)
+        self.assertEqual(len(result), len(kept) ** 2)
+        for i in result:
+            parent, child = i.split(b',')[:2]
+            self.assertIn(parent.strip(b'"'), kept)
+            self.assertIn(child.strip(b'"'), kept)
+
+
+if __name__ == '__main__':
+    unittest.main()
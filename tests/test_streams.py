@@ -0,0 +1,101 @@
+# tests.test_streams
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Tests of the splitting of raw records into fields and of files into
+records'''
+
+import io
+import unittest
+
+from gazetteer.streams import iter_chunks, iter_records, split_fields
+
+
+class TestSplitFields(unittest.TestCase):
+
+    def test_plain(self):
+        self.assertEqual(split_fields(b'a|b||c', b'|'),
+                         [b'a', b'b', b'', b'c'])
+
+    def test_backslash_escapes(self):
+        self.assertEqual(split_fields(b'a\\|b|c', b'|', backslash=True),
+                         [b'a\\|b', b'c'])
+        self.assertEqual(split_fields(b'a\\\\|b', b'|', backslash=True),
+                         [b'a\\\\', b'b'])
+        self.assertEqual(split_fields(b'a\\\\\\|b|', b'|', backslash=True),
+                         [b'a\\\\\\|b', b''])
+
+    def test_backslash_not_escape(self):
+
+        # In CSV files a backslash is an ordinary character unless it is
+        # the table's escape character
+
+        self.assertEqual(split_fields(b'a\\,b', b','), [b'a\\', b'b'])
+
+    def test_quoted(self):
+        self.assertEqual(split_fields(b'"a,b",c,"d"', b',', b'"', b'"'),
+                         [b'"a,b"', b'c', b'"d"'])
+        self.assertEqual(split_fields(b'"a"",b",c', b',', b'"', b'"'),
+                         [b'"a"",b"', b'c'])
+
+    def test_fields_rejoin(self):
+        for record, args in ((b'a\\|b|\\\\|c', (b'|', None, None, True)),
+                             (b'"a,""b",,c', (b',', b'"', b'"'))):
+            self.assertEqual(args[0].join(split_fields(record, *args)),
+                             record)
+
+
+class TestIterRecords(unittest.TestCase):
+
+    def test_lines(self):
+        self.assertEqual(list(iter_records(io.BytesIO(b'a\nb\nc'))),
+                         [b'a\n', b'b\n', b'c'])
+
+    def test_quoted_line_breaks(self):
+        data = b'a,"b\nc"\n"d""\n",e\nf\n'
+        self.assertEqual(list(iter_records(io.BytesIO(data), b'"', b'"')),
+                         [b'a,"b\nc"\n', b'"d""\n",e\n', b'f\n'])
+
+
+class TestIterChunks(unittest.TestCase):
+
+    def test_chunks(self):
+        records = [b'a\n', b'bb\n', b'ccc\n', b'd\n', b'e\n']
+
+        chunks = [(i.read(), size, rows)
+                  for i, size, rows in iter_chunks(records, max_rows=2)]
+        self.assertEqual(chunks, [(b'a\nbb\n', 5, 2), (b'ccc\nd\n', 6, 2),
+                                  (b'e\n', 2, 1)])
+
+        chunks = [(i.read(), size, rows)
+                  for i, size, rows in iter_chunks(records, max_bytes=6)]
+        self.assertEqual(chunks, [(b'a\nbb\n', 5, 2), (b'ccc\nd\n', 6, 2),
+                                  (b'e\n', 2, 1)])
+
+    def test_large_record(self):
+
+        # A chunk always holds at least one record, however large
+
+        chunks = [(size, rows) for _, size, rows in
+                  iter_chunks([b'aaaaaa\n', b'b\n'], max_bytes=4)]
+        self.assertEqual(chunks, [(7, 1), (2, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# tests.test_tables
+
+# Copyright 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''Tests of the routing of records to the partitions of a
+GazetteerPartitionedTable'''
+
+import io
+import unittest
+
+import gazetteer
+
+
+def geonames_record(cc1, mgrs=b'x'):
+    '''Return a record for usnga.geonames with the given values of cc1 and
+    mgrs, which comes before it, with every other field set to x'''
+
+    table = gazetteer.gazetteer_tables['usnga.geonames']
+    names = [i.sql_name for i in table.fields]
+    fields = [b'x'] * len(names)
+    fields[names.index('cc1')] = cc1
+    fields[names.index('mgrs')] = mgrs
+    return table.sep.encode('ASCII').join(fields) + b'\n'
+
+
+class TestPartitionFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.table = gazetteer.gazetteer_tables['usnga.geonames']
+
+    def test_records_kept(self):
+        records = [geonames_record(b'AA'), geonames_record(b'AA')]
+        diverted = []
+        result = self.table.partition('AA').partition_filter(
+            io.BytesIO(b''.join(records)), diverted)
+
+        self.assertEqual(result.read(), b''.join(records))
+        self.assertEqual(diverted, [])
+
+    def test_records_diverted(self):
+        records = [geonames_record(b'AA'), geonames_record(b'BB'),
+                   geonames_record(b'AA')]
+        diverted = []
+        result = self.table.partition('AA').partition_filter(
+            io.BytesIO(b''.join(records)), diverted)
+
+        self.assertEqual(result.read(), records[0] + records[2])
+        self.assertEqual(diverted, [records[1]])
+
+    def test_default_partition(self):
+        records = [geonames_record(b'ZZ'), geonames_record(b'AA')]
+        diverted = []
+        result = self.table.partition().partition_filter(
+            io.BytesIO(b''.join(records)), diverted)
+
+        self.assertEqual(result.read(), records[0])
+        self.assertEqual(diverted, [records[1]])
+
+    def test_stray_record_raises(self):
+        records = [geonames_record(b'AA'), geonames_record(b'BB')]
+        result = self.table.partition('AA').partition_filter(
+            io.BytesIO(b''.join(records)))
+
+        with self.assertRaisesRegex(ValueError, 'Row 2 .* has cc1 BB'):
+            result.read()
+
+    def test_escaped_separator(self):
+
+        # The escaped tab must not shift the fields, or the value looked at
+        # would not be the one in cc1
+
+        records = [geonames_record(b'AA', b'A\\\tB'),
+                   geonames_record(b'BB', b'A\\\tB')]
+        diverted = []
+        result = self.table.partition('AA').partition_filter(
+            io.BytesIO(b''.join(records)), diverted)
+
+        self.assertEqual(result.read(), records[0])
+        self.assertEqual(diverted, [records[1]])
+
+    def test_short_records_kept(self):
+
+        # Records with too few fields are left for the database to reject
+
+        result = self.table.partition('AA').partition_filter(
+            io.BytesIO(b'1\t2\n'))
+        self.assertEqual(result.read(), b'1\t2\n')
+
+
+if __name__ == '__main__':
+    unittest.main()